@@ -1,20 +1,34 @@
-from flask import Flask, request, jsonify, send_file, session
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import json
 import smtplib
 import ssl
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-from email.header import Header
 import pandas as pd
-import re
 import logging
-from datetime import datetime
 import traceback
+import time
+import uuid
+import shutil
+import zipfile
+
+from email_providers import EMAIL_PROVIDERS
+from email_sender import run_send_job
+from attachment_cache import attachment_cache
+from send_jobs import SendJobQueue, FINISHED_STATES, get_send_job_store
+from attachment_index import get_attachment_index
+from attachment_store import get_attachment_store
+from upload_sessions import get_upload_sessions, UploadError
+from recipient_store import get_recipient_store
+from send_ledger import valid_campaign_id
+from recipient_parser import iter_workbook, parse_workbook, read_excel_field_names
+from batch_parser import parse_workbooks, is_workbook
+from zip_utils import plan_extraction, UnsafeZipError, COPY_CHUNK_SIZE as ZIP_COPY_CHUNK_SIZE
+from mail_template import find_missing_fields
+from recipient_merge import merge_recipients
+import metrics
+from structured_logging import setup_logging
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -22,168 +36,92 @@ app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ATTACHMENT_FOLDER'] = 'attachments'
 app.config['TEMPLATE_FOLDER'] = 'templates'
+app.config['DATA_FOLDER'] = 'data'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB
+app.config['SEND_WORKERS'] = int(os.environ.get('SEND_WORKERS', 2))  # 同时执行的发送任务数
 
-# 创建必要的目录
-for folder in ['uploads', 'attachments', 'templates']:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
-
-# 配置日志
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 邮箱服务商配置
-EMAIL_PROVIDERS = {
-    'mobile139': {
-        'name': '中国移动139邮箱',
-        'smtp_host': 'smtp.139.com',
-        'smtp_port_ssl': 465,
-        'smtp_port': 25,
-        'pop3_host': 'pop.139.com',
-        'pop3_port_ssl': 995,
-        'pop3_port': 110,
-        'imap_host': 'imap.139.com',
-        'imap_port_ssl': 993,
-        'imap_port': 143,
-        'use_auth_code': True,
-        'help_text': '请使用16位授权码'
-    },
-    'qq': {
-        'name': 'QQ邮箱',
-        'smtp_host': 'smtp.qq.com',
-        'smtp_port_ssl': 465,
-        'smtp_port': 587,
-        'pop3_host': 'pop.qq.com',
-        'pop3_port_ssl': 995,
-        'imap_host': 'imap.qq.com',
-        'imap_port_ssl': 993,
-        'use_auth_code': True,
-        'help_text': '请使用授权码，非登录密码'
-    },
-    '163': {
-        'name': '163邮箱',
-        'smtp_host': 'smtp.163.com',
-        'smtp_port_ssl': 465,
-        'smtp_port': 25,
-        'pop3_host': 'pop.163.com',
-        'pop3_port_ssl': 995,
-        'imap_host': 'imap.163.com',
-        'imap_port_ssl': 993,
-        'use_auth_code': True,
-        'help_text': '请使用授权码'
-    },
-    'outlook': {
-        'name': 'Outlook',
-        'smtp_host': 'smtp-mail.outlook.com',
-        'smtp_port': 587,
-        'use_tls': True,
-        'use_auth_code': False
-    }
-}
-
-def parse_custom_excel(filepath):
+# 批量解析的进程池用 spawn 启动子进程，以 python app.py 运行时子进程会以 __mp_main__ 的名字重新执行本模块；
+# 子进程只执行 batch_parser 中的解析函数，不创建目录、不同步附件索引、不启动发送线程
+if __name__ != '__mp_main__':
+    # 创建必要的目录
+    for folder in ['uploads', 'attachments', 'templates', 'data']:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    # 配置日志
+    setup_logging()
+
+    # 附件索引
+    attachment_index = get_attachment_index(
+        app.config['ATTACHMENT_FOLDER'],
+        os.path.join(app.config['DATA_FOLDER'], 'attachment_index.db')
+    )
+
+    # 附件内容存储（相同内容只保存一份，文件名为硬链接）
+    attachment_store = get_attachment_store(app.config['ATTACHMENT_FOLDER'], attachment_index)
+
+    # 大附件分块上传会话
+    upload_sessions = get_upload_sessions(os.path.join(app.config['DATA_FOLDER'], 'uploads.db'), attachment_store)
+
+    # 解析后的收件人列表（服务端保存，通过列表ID引用）
+    recipient_store = get_recipient_store(os.path.join(app.config['DATA_FOLDER'], 'recipients.db'))
+
+    # 发送任务队列：任务在提交它的进程中执行，进度和结果写入数据库，任何工作进程都可以查询和取消
+    send_queue = SendJobQueue(
+        run_send_job,
+        workers=app.config['SEND_WORKERS'],
+        store=get_send_job_store(os.path.join(app.config['DATA_FOLDER'], 'send_jobs.db'))
+    )
+
+    # 运行指标：任务队列和附件缓存的统计在抓取 /api/metrics 时读取；各工作进程的指标经共享目录汇总
+    metrics.watch_send_queue(send_queue)
+    metrics.watch_attachment_cache(attachment_cache)
+    metrics.registry.enable_multiprocess()
+
+# 发送进度事件流：心跳间隔（秒，保持代理连接）、汇总进度最短推送间隔（秒）、断线重连间隔（毫秒）、
+# 检查服务是否正在停止的间隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+SSE_PROGRESS_INTERVAL = 1
+SSE_RETRY_MS = 3000
+SSE_STOP_CHECK_SECONDS = 1
+
+def upload_path(filename):
+    """
+    上传的工作簿保存路径：每个请求一个唯一的文件名（保留扩展名）
+    secure_filename 会去掉中文，不同分公司的文件名会变成同一个，后上传的会覆盖正在读取的文件
+    """
+    return os.path.join(app.config['UPLOAD_FOLDER'], f'{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}')
+
+def iter_custom_excel(filepath, stats=None):
+    """
+    流式解析Excel：openpyxl只读模式分批读取，每批解析完即产出收件人，
+    无需等待整个文件读完。stats 字典（可选）中累计 total / skipped，并记录表头 fields
+    """
+    attachment_index.ensure_fresh()
+    yield from iter_workbook(filepath, app.config['ATTACHMENT_FOLDER'], attachment_index, stats)
+
+def parse_custom_excel(filepath, streaming=None):
     """
     解析自定义格式的Excel
-    重要：只处理有附件的行，没有附件的直接跳过
+    streaming 为 None 时，大于 EXCEL_STREAM_THRESHOLD_MB 的xlsx文件自动使用流式读取
     """
     try:
-        # 读取Excel
-        df = pd.read_excel(filepath, header=0)
-        
-        recipients = []
-        skipped_count = 0  # 统计跳过的数量
-        
-        logger.info(f"开始解析Excel，总行数: {len(df)}")
-        
-        for idx, row in df.iterrows():
-            try:
-                # 获取各列数据 - 根据您的Excel格式
-                # A列:前级 B列:部门 C列:附件位置 D列:奖金联系人 E列:奖金标题(邮箱)
-                department = str(row.iloc[0]) if pd.notna(row.iloc[0]) else ""
-                dept2 = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ""
-                attachment_path = str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else ""
-                contact_names = str(row.iloc[3]) if len(row) > 3 and pd.notna(row.iloc[3]) else ""
-                contact_emails = str(row.iloc[4]) if len(row) > 4 and pd.notna(row.iloc[4]) else ""
-                
-                # 重要：先检查是否有附件，没有附件直接跳过
-                if not attachment_path or attachment_path == 'nan' or attachment_path.strip() == '':
-                    skipped_count += 1
-                    logger.info(f"第{idx+2}行: 无附件，跳过此行")
-                    continue
-                
-                # 解析附件路径
-                attachments = []
-                # 处理Windows路径 D:\AutoEmail\域名\分公司\2025年1[CD:\AutoEmail\附件\2025年10月]\新疆分配-域名.x
-                if '\\' in attachment_path:
-                    # 提取实际的文件路径
-                    # 可能包含多个路径，用分号或其他符号分隔
-                    paths = re.split(r'[;；]', attachment_path)
-                    for path in paths:
-                        path = path.strip()
-                        if path:
-                            # 提取文件名
-                            filename = path.split('\\')[-1]
-                            # 在附件目录查找
-                            local_path = os.path.join(app.config['ATTACHMENT_FOLDER'], filename)
-                            if os.path.exists(local_path):
-                                attachments.append(local_path)
-                                logger.info(f"找到附件: {filename}")
-                            else:
-                                logger.warning(f"附件未找到: {filename} (路径: {local_path})")
-                
-                # 如果解析后还是没有找到附件，跳过
-                if not attachments:
-                    skipped_count += 1
-                    logger.info(f"第{idx+2}行: 附件文件不存在，跳过")
-                    continue
-                
-                # 解析邮箱 - 支持多个邮箱
-                if not contact_emails or contact_emails == 'nan':
-                    skipped_count += 1
-                    logger.info(f"第{idx+2}行: 无邮箱地址，跳过")
-                    continue
-                
-                # 提取所有邮箱地址
-                email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-                emails = re.findall(email_pattern, str(contact_emails))
-                
-                if not emails:
-                    skipped_count += 1
-                    logger.info(f"第{idx+2}行: 邮箱格式无效，跳过")
-                    continue
-                
-                # 解析姓名
-                names = []
-                if contact_names and contact_names != 'nan':
-                    # 支持多种分隔符
-                    names = re.split(r'[、，,;；]', contact_names)
-                    names = [n.strip() for n in names if n.strip()]
-                
-                # 为每个邮箱创建收件人记录
-                for i, email in enumerate(emails):
-                    name = names[i] if i < len(names) else email.split('@')[0]
-                    
-                    recipient = {
-                        'email': email.strip(),
-                        'name': name,
-                        'department': f"{department} {dept2}".strip(),
-                        'attachment': attachments[0],  # 个性化附件
-                        'all_attachments': attachments  # 所有附件
-                    }
-                    
-                    recipients.append(recipient)
-                    logger.info(f"添加收件人: {name} ({email}) - 部门: {recipient['department']}, 附件数: {len(attachments)}")
-                    
-            except Exception as e:
-                logger.error(f"处理第{idx+2}行时出错: {str(e)}")
-                continue
+        attachment_index.ensure_fresh()
+        parse_stats = {}
+        recipients, skipped_count, fields = parse_workbook(
+            filepath, app.config['ATTACHMENT_FOLDER'], attachment_index, streaming, stats=parse_stats
+        )
+        metrics.record_parse(parse_stats['mode'], parse_stats['seconds'], parse_stats['rows'],
+                             len(recipients), skipped_count)
         
         logger.info(f"解析完成: 成功{len(recipients)}个收件人, 跳过{skipped_count}行(无附件或无效)")
         
         return {
             'success': True,
             'recipients': recipients,
+            'fields': fields,
             'total': len(recipients),
             'skipped': skipped_count
         }
@@ -196,6 +134,45 @@ def parse_custom_excel(filepath):
             'error': str(e)
         }
 
+def check_template_fields(data, available_fields):
+    """检查主题和正文中引用的变量，返回收件人数据中不存在的变量"""
+    return find_missing_fields([data.get('subject', ''), data.get('content', '')], available_fields)
+
+def missing_fields_response(missing):
+    placeholders = '、'.join('{{' + field + '}}' for field in missing)
+    return jsonify({
+        'success': False,
+        'message': f'邮件模板中的变量在收件人数据中不存在: {placeholders}',
+        'missing_fields': missing
+    }), 400
+
+def load_sender_configs():
+    """读取保存的发件人配置（templates/sender_configs.json，不含密码）"""
+    path = os.path.join(app.config['TEMPLATE_FOLDER'], 'sender_configs.json')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def resolve_sender_pool(data):
+    """
+    多账号发送：smtp_configs 中每一项是完整的SMTP配置，
+    或 {config_id, password} 引用已保存的发件人配置（密码不保存，需随请求提交）
+    """
+    pool = data.get('smtp_configs') or []
+    if not pool:
+        return []
+    saved = {config['id']: config for config in load_sender_configs()}
+    configs = []
+    for item in pool:
+        config_id = item.get('config_id')
+        if config_id:
+            if config_id not in saved:
+                raise ValueError(f'发件人配置不存在: {config_id}')
+            item = {**saved[config_id], **item}
+        configs.append(item)
+    return configs
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """健康检查"""
@@ -209,6 +186,11 @@ def health():
         }
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """运行指标（Prometheus 文本格式）：Excel解析、SMTP连接/登录/发送耗时、发送结果、附件读取编码、缓存和队列"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/api/email-providers', methods=['GET'])
 def get_email_providers():
     """获取支持的邮箱服务商配置"""
@@ -267,29 +249,36 @@ def parse_excel():
         if file.filename == '':
             return jsonify({'success': False, 'message': '文件名为空'}), 400
         
-        # 保存文件
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # 保存文件（解析完即删除）
+        filepath = upload_path(file.filename)
         file.save(filepath)
-        
-        # 使用自定义解析器
-        result = parse_custom_excel(filepath)
+        try:
+            # 使用自定义解析器
+            result = parse_custom_excel(filepath)
+        finally:
+            os.remove(filepath)
         
         if result['success']:
-            # 保存到session
-            session['recipients'] = result['recipients']
+            merge_report = apply_merge_option(result, request.form)
+            # 保存到服务端，发送时通过 list_id 引用（未结束的任务正在读取的列表不随过期清理）
+            list_id = recipient_store.save(result['recipients'], source=file.filename, fields=result['fields'],
+                                           keep=send_queue.active_list_ids())
             
             message = f"成功导入 {result['total']} 个有附件的收件人"
             if result['skipped'] > 0:
                 message += f"，跳过 {result['skipped']} 行（无附件或无效数据）"
+            message += merge_message(merge_report)
             
             return jsonify({
                 'success': True,
+                'list_id': list_id,
                 'recipients': result['recipients'],
+                'fields': result['fields'],
                 'message': message,
                 'stats': {
                     'total': result['total'],
-                    'skipped': result['skipped']
+                    'skipped': result['skipped'],
+                    'merge': merge_report
                 }
             })
         else:
@@ -305,6 +294,132 @@ def parse_excel():
             'message': str(e)
         }), 500
 
+def apply_merge_option(result, form):
+    """
+    表单参数 merge_recipients=1 时按邮箱合并收件人（附件合并为一封邮件），
+    merge_max_mb 为每封邮件附件总大小上限；返回合并报告，未合并时返回 None
+    """
+    if form.get('merge_recipients') not in ('1', 'true'):
+        return None
+    kwargs = {}
+    if form.get('merge_max_mb'):
+        kwargs['max_bytes'] = int(float(form['merge_max_mb']) * 1024 * 1024)
+    result['recipients'], report = merge_recipients(result['recipients'], **kwargs)
+    return report
+
+def merge_message(report):
+    if not report or not report['merged_emails']:
+        return ''
+    message = f"，合并同一邮箱的多行后共 {report['after']} 封邮件"
+    if report['split_emails']:
+        message += f"（{report['split_emails']} 个邮箱因附件过大拆分为多封）"
+    return message
+
+def save_batch_workbooks(files, batch_dir):
+    """
+    保存批量上传的工作簿（ZIP包中的工作簿逐个解压），返回 ([(原文件名, 保存路径), ...], [被拒绝的成员名])
+    ZIP包与附件压缩包使用相同的安全检查（成员数、解压后总大小、压缩比、路径穿越），超出限制时抛出 UnsafeZipError
+    保存时使用序号命名：secure_filename 会去掉中文，不同分公司的文件名会重复
+    """
+    saved = []
+    rejected = []
+
+    def target_path(filename):
+        return os.path.join(batch_dir, f'{len(saved)}{os.path.splitext(filename)[1].lower()}')
+
+    for file in files:
+        if not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as zf:
+                try:
+                    members, unsafe = plan_extraction(zf)
+                except UnsafeZipError as e:
+                    raise UnsafeZipError(f'{file.filename}: {e}') from e
+                rejected.extend(f'{file.filename}/{name}' for name in unsafe)
+                for info, name in members:
+                    if not is_workbook(name):
+                        continue
+                    path = target_path(name)
+                    with zf.open(info) as src, open(path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, ZIP_COPY_CHUNK_SIZE)
+                    saved.append((f'{file.filename}/{name}', path))
+        elif is_workbook(file.filename):
+            path = target_path(file.filename)
+            file.save(path)
+            saved.append((file.filename, path))
+    return saved, rejected
+
+@app.route('/api/parse-excel-batch', methods=['POST'])
+def parse_excel_batch():
+    """
+    批量解析Excel：一次上传多个工作簿（或包含工作簿的ZIP包），在进程池中并行解析，
+    合并所有收件人并去重（同一邮箱 + 同一附件只保留一个）
+    """
+    batch_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'batch-{uuid.uuid4().hex}')
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({'success': False, 'message': '未找到文件'}), 400
+        
+        os.makedirs(batch_dir)
+        workbooks, rejected = save_batch_workbooks(files, batch_dir)
+        if rejected:
+            logger.warning(f"压缩包中有 {len(rejected)} 个不安全的成员已跳过: {rejected[:10]}")
+        if not workbooks:
+            return jsonify({'success': False, 'message': '没有找到Excel文件（支持 .xlsx / .xls 或包含它们的ZIP包）',
+                            'rejected': rejected}), 400
+        
+        attachment_index.ensure_fresh()
+        result = parse_workbooks(workbooks, app.config['ATTACHMENT_FOLDER'], attachment_index.names())
+        merge_report = apply_merge_option(result, request.form)
+        
+        list_id = recipient_store.save(result['recipients'], source=f'{len(workbooks)}个文件', fields=result['fields'],
+                                       keep=send_queue.active_list_ids())
+        
+        failed = [f for f in result['files'] if not f['success']]
+        message = f"解析 {len(workbooks)} 个文件，成功导入 {result['total']} 个有附件的收件人"
+        if result['duplicates'] > 0:
+            message += f"，去除重复 {result['duplicates']} 个"
+        if result['skipped'] > 0:
+            message += f"，跳过 {result['skipped']} 行（无附件或无效数据）"
+        if failed:
+            message += f"，{len(failed)} 个文件解析失败"
+        if rejected:
+            message += f"，{len(rejected)} 个不安全的压缩包成员已跳过"
+        message += merge_message(merge_report)
+        logger.info(message)
+        
+        return jsonify({
+            'success': True,
+            'list_id': list_id,
+            'recipients': result['recipients'],
+            'fields': result['fields'],
+            'message': message,
+            'stats': {
+                'total': result['total'],
+                'skipped': result['skipped'],
+                'duplicates': result['duplicates'],
+                'files': result['files'],
+                'rejected': rejected,
+                'merge': merge_report
+            }
+        })
+        
+    except zipfile.BadZipFile:
+        return jsonify({'success': False, 'message': 'ZIP文件已损坏或格式不正确'}), 400
+    except UnsafeZipError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"批量解析失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
 @app.route('/api/download-template', methods=['GET'])
 def download_template():
     """下载Excel模板"""
@@ -354,165 +469,241 @@ def download_template():
 
 @app.route('/api/send-emails', methods=['POST'])
 def send_emails():
-    """发送邮件 - 只发送给有附件的收件人"""
+    """发送邮件 - 只发送给有附件的收件人，任务进入后台队列后立即返回任务ID"""
     try:
         data = request.json
-        smtp_config = data.get('smtp_config', {})
-        subject = data.get('subject', '')
-        content_template = data.get('content', '')
-        common_attachments = data.get('common_attachments', [])
         
-        # 获取收件人列表
-        recipients = session.get('recipients', data.get('recipients', []))
+        campaign_id = data.get('campaign_id')
+        if campaign_id and not valid_campaign_id(campaign_id):
+            return jsonify({'success': False, 'message': '活动ID只能包含字母、数字、下划线和短横线（最长64位）'}), 400
         
-        # 再次过滤，确保只发送给有附件的收件人
-        recipients_with_attachments = [r for r in recipients if r.get('attachment') or r.get('all_attachments')]
+        # 获取收件人列表：优先使用解析时保存的列表（list_id），否则使用请求中的 recipients
+        list_id = data.get('list_id')
+        if list_id:
+            recipients_with_attachments = recipient_store.get(list_id)
+            if recipients_with_attachments is None:
+                return jsonify({'success': False, 'message': '收件人列表不存在或已过期，请重新导入Excel'}), 404
+            available_fields = recipient_store.info(list_id)['fields']
+        else:
+            recipients = data.get('recipients', [])
+            
+            # 再次过滤，确保只发送给有附件的收件人
+            recipients_with_attachments = [r for r in recipients if r.get('attachment') or r.get('all_attachments')]
+            available_fields = {field for r in recipients_with_attachments for field in (r.get('fields') or {})}
         
         if not recipients_with_attachments:
             return jsonify({'success': False, 'message': '没有符合条件的收件人（需要有附件）'}), 400
         
-        results = []
-        success_count = 0
-        
-        # SMTP连接配置
-        smtp_host = smtp_config.get('smtp_host')
-        smtp_port = smtp_config.get('smtp_port')
-        sender_email = smtp_config.get('sender_email')
-        password = smtp_config.get('password')
-        use_ssl = smtp_config.get('use_ssl', True)
-        use_tls = smtp_config.get('use_tls', False)
-        
-        # 139邮箱自动配置
-        if '139.com' in sender_email:
-            smtp_host = EMAIL_PROVIDERS['mobile139']['smtp_host']
-            smtp_port = EMAIL_PROVIDERS['mobile139']['smtp_port_ssl']
-            use_ssl = True
-            use_tls = False
-        
-        # 建立SMTP连接
-        if use_ssl:
-            context = ssl.create_default_context()
-            server = smtplib.SMTP_SSL(smtp_host, smtp_port, context=context)
-        elif use_tls:
-            server = smtplib.SMTP(smtp_host, smtp_port)
-            server.starttls()
-        else:
-            server = smtplib.SMTP(smtp_host, smtp_port)
+        # 模板引用了不存在的列时直接报错，不把 {{...}} 原样发出去
+        missing = check_template_fields(data, available_fields)
+        if missing:
+            return missing_fields_response(missing)
         
-        server.login(sender_email, password)
-        
-        for recipient in recipients_with_attachments:
-            try:
-                # 个性化内容
-                content = content_template.replace('{{name}}', recipient.get('name', ''))
-                content = content.replace('{{email}}', recipient.get('email', ''))
-                content = content.replace('{{department}}', recipient.get('department', ''))
-                
-                # 创建邮件
-                msg = MIMEMultipart()
-                msg['From'] = Header(sender_email, 'utf-8')
-                msg['To'] = Header(recipient['email'], 'utf-8')
-                msg['Subject'] = Header(subject, 'utf-8')
-                
-                # 添加正文
-                msg.attach(MIMEText(content, 'html', 'utf-8'))
-                
-                # 添加个性化附件（必须有）
-                attachments_added = False
-                if recipient.get('all_attachments'):
-                    for attachment_path in recipient['all_attachments']:
-                        try:
-                            with open(attachment_path, 'rb') as f:
-                                part = MIMEBase('application', 'octet-stream')
-                                part.set_payload(f.read())
-                                encoders.encode_base64(part)
-                                filename = os.path.basename(attachment_path)
-                                part.add_header(
-                                    'Content-Disposition',
-                                    f'attachment; filename="{filename}"'
-                                )
-                                msg.attach(part)
-                                attachments_added = True
-                        except Exception as e:
-                            logger.warning(f"无法添加附件 {attachment_path}: {str(e)}")
-                elif recipient.get('attachment'):
-                    try:
-                        with open(recipient['attachment'], 'rb') as f:
-                            part = MIMEBase('application', 'octet-stream')
-                            part.set_payload(f.read())
-                            encoders.encode_base64(part)
-                            filename = os.path.basename(recipient['attachment'])
-                            part.add_header(
-                                'Content-Disposition',
-                                f'attachment; filename="{filename}"'
-                            )
-                            msg.attach(part)
-                            attachments_added = True
-                    except Exception as e:
-                        logger.warning(f"无法添加附件 {recipient['attachment']}: {str(e)}")
-                
-                # 如果没有成功添加任何附件，跳过发送
-                if not attachments_added:
-                    results.append({
-                        'email': recipient['email'],
-                        'name': recipient.get('name', ''),
-                        'status': 'skipped',
-                        'message': '无有效附件，跳过发送'
-                    })
-                    continue
-                
-                # 添加公共附件（如果有）
-                for attachment_path in common_attachments:
-                    try:
-                        with open(attachment_path, 'rb') as f:
-                            part = MIMEBase('application', 'octet-stream')
-                            part.set_payload(f.read())
-                            encoders.encode_base64(part)
-                            filename = os.path.basename(attachment_path)
-                            part.add_header(
-                                'Content-Disposition',
-                                f'attachment; filename="{filename}"'
-                            )
-                            msg.attach(part)
-                    except Exception as e:
-                        logger.warning(f"无法添加公共附件 {attachment_path}: {str(e)}")
-                
-                # 发送邮件
-                server.send_message(msg)
-                success_count += 1
-                
-                results.append({
-                    'email': recipient['email'],
-                    'name': recipient.get('name', ''),
-                    'status': 'success',
-                    'message': '发送成功'
-                })
-                
-            except Exception as e:
-                results.append({
-                    'email': recipient['email'],
-                    'name': recipient.get('name', ''),
-                    'status': 'failed',
-                    'message': str(e)
-                })
-        
-        server.quit()
+        job = send_queue.submit({
+            'smtp_config': data.get('smtp_config', {}),
+            'smtp_configs': resolve_sender_pool(data),
+            'subject': data.get('subject', ''),
+            'content': data.get('content', ''),
+            'common_attachments': data.get('common_attachments', []),
+            'recipients': recipients_with_attachments,
+            'list_id': list_id,
+            'campaign_id': campaign_id
+        })
         
         return jsonify({
             'success': True,
-            'total': len(recipients_with_attachments),
-            'success_count': success_count,
-            'failed_count': len(recipients_with_attachments) - success_count,
-            'results': results
-        })
+            'message': f'发送任务已创建，共 {job.total} 个收件人',
+            'job_id': job.id,
+            'campaign_id': job.campaign_id,
+            'total': job.total
+        }), 202
         
     except Exception as e:
-        logger.error(f"发送邮件失败: {str(e)}")
+        logger.error(f"创建发送任务失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+@app.route('/api/send-excel', methods=['POST'])
+def send_excel():
+    """
+    直接按Excel发送：后台流式读取Excel，读到一批收件人就开始发送，无需先解析完整个文件
+    表单字段: file（Excel文件）, payload（JSON，包含 smtp_config / subject / content / common_attachments）
+    """
+    try:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': '未找到文件'}), 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'success': False, 'message': '文件名为空'}), 400
+
+        if not file.filename.lower().endswith('.xlsx'):
+            return jsonify({'success': False, 'message': '流式发送只支持xlsx文件'}), 400
+
+        data = json.loads(request.form.get('payload', '{}'))
+        campaign_id = data.get('campaign_id')
+        if campaign_id and not valid_campaign_id(campaign_id):
+            return jsonify({'success': False, 'message': '活动ID只能包含字母、数字、下划线和短横线（最长64位）'}), 400
+
+        # 任务在后台边读取边发送，工作簿在任务结束后由发送队列删除（temp_files）
+        filepath = upload_path(file.filename)
+        file.save(filepath)
+        try:
+            missing = check_template_fields(data, read_excel_field_names(filepath))
+            if missing:
+                os.remove(filepath)
+                return missing_fields_response(missing)
+
+            job = send_queue.submit({
+                'smtp_config': data.get('smtp_config', {}),
+                'smtp_configs': resolve_sender_pool(data),
+                'subject': data.get('subject', ''),
+                'content': data.get('content', ''),
+                'common_attachments': data.get('common_attachments', []),
+                'recipients': iter_custom_excel(filepath),
+                'campaign_id': campaign_id,
+                'temp_files': [filepath]
+            })
+        except Exception:
+            os.remove(filepath)
+            raise
+
+        return jsonify({
+            'success': True,
+            'message': '发送任务已创建，收件人将边读取边发送',
+            'job_id': job.id,
+            'campaign_id': job.campaign_id
+        }), 202
+
+    except Exception as e:
+        logger.error(f"创建发送任务失败: {str(e)}")
         return jsonify({
             'success': False,
             'message': str(e)
         }), 500
 
+@app.route('/api/recipient-lists/<list_id>', methods=['GET'])
+def get_recipient_list(list_id):
+    """分页查看已保存的收件人列表（?offset=0&limit=100）"""
+    info = recipient_store.info(list_id)
+    if info is None:
+        return jsonify({'success': False, 'message': '收件人列表不存在或已过期'}), 404
+    
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({
+        'success': True,
+        'list': info,
+        'recipients': recipient_store.load(list_id, offset, limit)
+    })
+
+@app.route('/api/recipient-lists/<list_id>', methods=['DELETE'])
+def delete_recipient_list(list_id):
+    """删除已保存的收件人列表，排队中或正在发送的任务还在读取该列表时拒绝删除"""
+    if list_id in send_queue.active_list_ids():
+        return jsonify({'success': False, 'message': '有发送任务正在使用该收件人列表，请等任务结束或取消后再删除'}), 409
+    if not recipient_store.delete(list_id):
+        return jsonify({'success': False, 'message': '收件人列表不存在或已过期'}), 404
+    return jsonify({'success': True, 'message': '收件人列表已删除'})
+
+def sse_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False))
+    return '\n'.join(lines) + '\n\n'
+
+def job_event_stream(job, cursor):
+    """
+    逐条推送发送结果和汇总进度，直到任务结束
+    本进程正在停止（send_queue.drain）时结束事件流，否则长连接会拖住工作进程退出；
+    浏览器按 retry 间隔带 Last-Event-ID 重连，由其他工作进程从数据库继续推送
+    """
+    yield f'retry: {SSE_RETRY_MS}\n\n'
+    last_progress = 0
+    while True:
+        finished = job.status in FINISHED_STATES
+        results = job.wait_for_results(cursor, SSE_STOP_CHECK_SECONDS)
+        for result in results:
+            cursor += 1
+            yield sse_event('result', result, cursor)
+        now = time.time()
+        interval = SSE_PROGRESS_INTERVAL if results else SSE_KEEPALIVE_SECONDS
+        if finished or now - last_progress >= interval:
+            yield sse_event('progress', job.to_dict(), cursor)
+            last_progress = now
+        if finished:
+            yield sse_event('done', job.to_dict(), cursor)
+            return
+        if send_queue.stopping:
+            return
+
+@app.route('/api/send-jobs', methods=['GET'])
+def list_send_jobs():
+    """列出发送任务及进度"""
+    jobs = sorted(send_queue.list_jobs(), key=lambda j: j.created_at, reverse=True)
+    return jsonify({
+        'success': True,
+        'jobs': [job.to_dict() for job in jobs]
+    })
+
+@app.route('/api/send-jobs/<job_id>', methods=['GET'])
+def get_send_job(job_id):
+    """查询发送任务进度（?include_results=1 时返回每个收件人的结果）"""
+    job = send_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    include_results = request.args.get('include_results') in ('1', 'true')
+    return jsonify({
+        'success': True,
+        'job': job.to_dict(include_results=include_results)
+    })
+
+@app.route('/api/send-jobs/<job_id>/events', methods=['GET'])
+def send_job_events(job_id):
+    """
+    发送进度事件流（Server-Sent Events）
+    - result: 每个收件人的发送结果，事件ID为已推送的结果数
+    - progress: 汇总计数、速率和预计剩余时间（有新结果时最多每秒一次，空闲时作为心跳）
+    - done: 任务结束，之后服务器关闭连接
+    断线重连时浏览器带上 Last-Event-ID，从该位置继续推送
+    """
+    job = send_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor') or 0
+    try:
+        cursor = max(0, int(cursor))
+    except ValueError:
+        cursor = 0
+    
+    return Response(
+        job_event_stream(job, cursor),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # 通过nginx代理时不缓冲响应
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/send-jobs/<job_id>/cancel', methods=['POST'])
+def cancel_send_job(job_id):
+    """取消发送任务"""
+    job = send_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    return jsonify({
+        'success': True,
+        'message': '任务已取消',
+        'job': job.to_dict()
+    })
+
 @app.route('/api/templates', methods=['GET'])
 def get_templates():
     """获取邮件模板列表"""
@@ -521,11 +712,11 @@ def get_templates():
 @app.route('/api/sender-configs', methods=['GET'])
 def get_sender_configs():
     """获取发件人配置列表"""
-    return jsonify([])
+    return jsonify(load_sender_configs())
 
 @app.route('/api/upload-attachment', methods=['POST'])
 def upload_attachment():
-    """上传附件"""
+    """上传附件（内容与已有附件相同时只保存一份）"""
     try:
         if 'file' not in request.files:
             return jsonify({'error': '没有文件'}), 400
@@ -535,16 +726,121 @@ def upload_attachment():
             return jsonify({'error': '文件名为空'}), 400
         
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['ATTACHMENT_FOLDER'], filename)
-        file.save(filepath)
+        entry = attachment_store.save_stream(filename, file.stream)
         
         return jsonify({
             'success': True,
             'filename': filename,
-            'path': filepath
+            'path': entry['path'],
+            'sha256': entry['sha256']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/attachments/link', methods=['POST'])
+def link_attachments():
+    """
+    先按SHA256引用已有内容，内容相同的附件无需重新上传
+    请求: {"files": [{"filename": ..., "sha256": ...}]}
+    返回已直接引用的文件（linked）和仍需上传的文件（missing）
+    """
+    try:
+        data = request.json or {}
+        linked = []
+        missing = []
+        for item in data.get('files', []):
+            filename = secure_filename(item.get('filename') or '')
+            if not filename:
+                continue
+            entry = attachment_store.link(filename, (item.get('sha256') or '').lower())
+            if entry is None:
+                missing.append(filename)
+            else:
+                linked.append({'filename': filename, 'path': entry['path'], 'sha256': entry['sha256']})
+        
+        return jsonify({'success': True, 'linked': linked, 'missing': missing})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """
+    创建分块上传会话
+    请求: {"filename": ..., "size": 字节数, "chunk_size": 可选, "sha256": 可选（整个文件）}
+    服务器上已有相同内容时直接完成，无需上传任何块
+    """
+    try:
+        data = request.json or {}
+        filename = secure_filename(data.get('filename') or '')
+        if not filename:
+            return jsonify({'success': False, 'message': '文件名为空'}), 400
+        sha256 = (data.get('sha256') or '').lower() or None
+
+        if sha256:
+            entry = attachment_store.link(filename, sha256)
+            if entry is not None:
+                return jsonify({'success': True, 'complete': True, 'filename': filename, 'path': entry['path'], 'sha256': sha256})
+
+        status = upload_sessions.create(filename, int(data.get('size', -1)), data.get('chunk_size'), sha256)
+        return jsonify({'success': True, **status}), 201
+    except (UploadError, ValueError, TypeError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"创建分块上传失败: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """上传进度，received 为已收到的块序号（续传时只上传其余的块）"""
+    status = upload_sessions.status(upload_id)
+    if status is None:
+        return jsonify({'success': False, 'message': '上传会话不存在或已过期'}), 404
+    return jsonify({'success': True, **status})
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """上传一块（请求体为原始字节，可选请求头 X-Chunk-Sha256 校验），可以并行上传多块"""
+    try:
+        result = upload_sessions.write_chunk(
+            upload_id, index, request.stream, request.headers.get('X-Chunk-Sha256')
+        )
+        if result is None:
+            return jsonify({'success': False, 'message': '上传会话不存在或已过期'}), 404
+        return jsonify({'success': True, **result})
+    except UploadError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"上传块失败: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """所有块上传完成后合并为附件"""
+    try:
+        entry = upload_sessions.complete(upload_id)
+        if entry is None:
+            return jsonify({'success': False, 'message': '上传会话不存在或已过期'}), 404
+        return jsonify({
+            'success': True,
+            'filename': entry['name'],
+            'path': entry['path'],
+            'sha256': entry['sha256']
+        })
+    except UploadError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"合并分块上传失败: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    """取消分块上传"""
+    try:
+        if not upload_sessions.delete(upload_id):
+            return jsonify({'success': False, 'message': '上传会话不存在或已过期'}), 404
+    except UploadError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -2,7 +2,7 @@
 """
 增强版app.py - 支持自动附件上传
 """
-from flask import Flask, request, jsonify, send_file, session
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
@@ -15,12 +15,24 @@ from email.mime.base import MIMEBase
 from email import encoders
 from email.header import Header
 import pandas as pd
-import re
 import logging
 from datetime import datetime
-import traceback
 import zipfile
 import shutil
+import uuid
+import threading
+import time
+from collections import OrderedDict
+
+from recipient_parser import read_columns, has_value, find_emails, expand_recipients, field_names, read_fields
+from attachment_index import get_attachment_index
+from attachment_store import get_attachment_store
+from attachment_matcher import AttachmentMatcher
+from recipient_store import get_recipient_store
+import zip_utils
+from zip_utils import ExtractProgress
+import metrics
+from structured_logging import setup_logging, EventLog
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -28,25 +40,81 @@ app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ATTACHMENT_FOLDER'] = 'attachments'
 app.config['TEMPLATE_FOLDER'] = 'templates'
+app.config['DATA_FOLDER'] = 'data'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB
 
 # 创建必要的目录
-for folder in ['uploads', 'attachments', 'templates', 'temp']:
+for folder in ['uploads', 'attachments', 'templates', 'temp', 'data']:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# 附件索引
+attachment_index = get_attachment_index(
+    app.config['ATTACHMENT_FOLDER'],
+    os.path.join(app.config['DATA_FOLDER'], 'attachment_index.db')
+)
+
+# 附件内容存储（相同内容只保存一份，文件名为硬链接）
+attachment_store = get_attachment_store(app.config['ATTACHMENT_FOLDER'], attachment_index)
+
+# 解析后的收件人列表（服务端保存，通过列表ID引用）
+recipient_store = get_recipient_store(os.path.join(app.config['DATA_FOLDER'], 'recipients.db'))
+
+# 正在解压/最近完成的ZIP包进度（upload_id -> ExtractProgress），只保留最近的一部分
+upload_progress = OrderedDict()
+upload_progress_lock = threading.Lock()
+MAX_TRACKED_UPLOADS = 100
+
+def track_upload(upload_id):
+    progress = ExtractProgress()
+    with upload_progress_lock:
+        upload_progress[upload_id] = progress
+        while len(upload_progress) > MAX_TRACKED_UPLOADS:
+            upload_progress.popitem(last=False)
+    return progress
+
+def extract_attachment_zip(file, progress):
+    """
+    直接从上传的文件流中逐个成员解压到附件目录（不再另存一份ZIP到 temp/），
+    每个文件写完后立即存入附件存储并加入附件索引
+    """
+    stream = file.stream
+    tmp_path = None
+    if not stream.seekable():
+        # 极少数情况下上传流不可随机读取，ZIP需要先读取末尾的目录
+        tmp_path = os.path.join('temp', f'{uuid.uuid4().hex}.zip')
+        file.save(tmp_path)
+        stream = open(tmp_path, 'rb')
+    try:
+        with zipfile.ZipFile(stream, 'r') as zip_ref:
+            return zip_utils.extract_zip(
+                zip_ref, app.config['ATTACHMENT_FOLDER'],
+                save=attachment_store.commit,
+                progress=progress,
+                tmp_dir=attachment_store.tmp_dir
+            )
+    finally:
+        if tmp_path:
+            stream.close()
+            os.remove(tmp_path)
+
 @app.route('/api/upload-batch-attachments', methods=['POST'])
 def upload_batch_attachments():
-    """批量上传附件（支持ZIP包）"""
+    """
+    批量上传附件（支持ZIP包）
+    可选参数 upload_id：解压过程中可通过 /api/upload-progress/<upload_id> 查询进度
+    """
     try:
         if 'files' not in request.files:
             return jsonify({'success': False, 'message': '没有文件'}), 400
         
         files = request.files.getlist('files')
+        upload_id = request.args.get('upload_id') or request.form.get('upload_id') or uuid.uuid4().hex
         uploaded_files = []
+        rejected_files = []
         
         for file in files:
             if file.filename == '':
@@ -56,36 +124,46 @@ def upload_batch_attachments():
             
             # 如果是ZIP文件，解压所有内容
             if filename.endswith('.zip'):
-                zip_path = os.path.join('temp', filename)
-                file.save(zip_path)
-                
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    # 解压到附件目录
-                    zip_ref.extractall(app.config['ATTACHMENT_FOLDER'])
-                    # 获取解压的文件列表
-                    for name in zip_ref.namelist():
-                        if not name.endswith('/'):  # 排除目录
-                            uploaded_files.append(os.path.basename(name))
-                
-                os.remove(zip_path)  # 删除临时ZIP文件
+                progress = track_upload(upload_id)
+                try:
+                    result = extract_attachment_zip(file, progress)
+                except (zipfile.BadZipFile, zip_utils.UnsafeZipError) as e:
+                    progress.finish(str(e))
+                    return jsonify({'success': False, 'message': f'{file.filename}: {e}'}), 400
+                except Exception as e:
+                    progress.finish(str(e))
+                    raise
+                progress.finish()
+                uploaded_files.extend(result['files'])
+                rejected_files.extend(result['rejected'])
             else:
                 # 直接保存文件
-                filepath = os.path.join(app.config['ATTACHMENT_FOLDER'], filename)
-                file.save(filepath)
+                attachment_store.save_stream(filename, file.stream)
                 uploaded_files.append(filename)
         
-        logger.info(f"批量上传成功: {uploaded_files}")
+        logger.info(f"批量上传成功: {len(uploaded_files)} 个文件")
         
         return jsonify({
             'success': True,
             'message': f'成功上传 {len(uploaded_files)} 个文件',
-            'files': uploaded_files
+            'files': uploaded_files,
+            'rejected': rejected_files,
+            'upload_id': upload_id
         })
         
     except Exception as e:
         logger.error(f"批量上传失败: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/upload-progress/<upload_id>', methods=['GET'])
+def get_upload_progress(upload_id):
+    """查询ZIP包解压进度"""
+    with upload_progress_lock:
+        progress = upload_progress.get(upload_id)
+    if progress is None:
+        return jsonify({'success': False, 'message': '上传任务不存在'}), 404
+    return jsonify({'success': True, 'upload_id': upload_id, **progress.to_dict()})
+
 @app.route('/api/parse-excel-with-attachments', methods=['POST'])
 def parse_excel_with_attachments():
     """解析Excel并同时上传相关附件"""
@@ -101,31 +179,37 @@ def parse_excel_with_attachments():
         
         # 获取附件文件（如果有）
         attachment_files = request.files.getlist('attachments')
+        events = EventLog(logger, 'save_attachments', excel=excel_filename)
         for att_file in attachment_files:
             if att_file.filename:
                 att_filename = secure_filename(att_file.filename)
-                att_path = os.path.join(app.config['ATTACHMENT_FOLDER'], att_filename)
-                att_file.save(att_path)
-                logger.info(f"保存附件: {att_filename}")
+                attachment_store.save_stream(att_filename, att_file.stream)
+                events.event('attachment_saved', '保存附件', filename=att_filename)
+        events.summary()
         
         # 解析Excel
         result = parse_custom_excel_with_smart_match(excel_path)
         
         if result['success']:
-            session['recipients'] = result['recipients']
+            list_id = recipient_store.save(result['recipients'], source=excel_filename, fields=result['fields'])
             
             message = f"成功导入 {result['total']} 个有附件的收件人"
             if result['skipped'] > 0:
                 message += f"，跳过 {result['skipped']} 行（无附件或无效数据）"
+            if result.get('ambiguous'):
+                message += f"，其中 {len(result['ambiguous'])} 行匹配到多个附件，请确认"
             
             return jsonify({
                 'success': True,
+                'list_id': list_id,
                 'recipients': result['recipients'],
+                'fields': result['fields'],
                 'message': message,
                 'stats': {
                     'total': result['total'],
                     'skipped': result['skipped'],
-                    'matched_files': result.get('matched_files', [])
+                    'matched_files': result.get('matched_files', []),
+                    'ambiguous': result.get('ambiguous', [])
                 }
             })
         else:
@@ -138,124 +222,109 @@ def parse_excel_with_attachments():
         logger.error(f"处理失败: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+_matcher_cache = {'version': None, 'matcher': None}
+
+def get_attachment_matcher():
+    """附件匹配引擎，附件索引变化后才重建"""
+    attachment_index.ensure_fresh()
+    if _matcher_cache['version'] != attachment_index.version:
+        _matcher_cache['matcher'] = AttachmentMatcher(attachment_index.list())
+        _matcher_cache['version'] = attachment_index.version
+    return _matcher_cache['matcher']
+
+def match_attachment(attachment_path, department, dept2, matcher):
+    """
+    智能匹配附件：精确文件名 -> 不带扩展名 -> 部门关键词模糊匹配（取得分最高的附件）
+    返回 MatchResult
+    """
+    # 提取文件名（处理Windows路径）
+    if '\\' in attachment_path:
+        filename = attachment_path.split('\\')[-1]
+    elif '/' in attachment_path:
+        filename = attachment_path.split('/')[-1]
+    else:
+        filename = attachment_path
+    
+    return matcher.match(filename, [department, dept2])
+
 def parse_custom_excel_with_smart_match(filepath):
     """智能匹配附件的Excel解析"""
     try:
+        start = time.perf_counter()
         df = pd.read_excel(filepath, header=0)
-        recipients = []
-        skipped_count = 0
-        matched_files = []
         
-        # 获取所有已上传的附件
-        attachment_dir = app.config['ATTACHMENT_FOLDER']
-        available_attachments = {}
-        if os.path.exists(attachment_dir):
-            for file in os.listdir(attachment_dir):
-                # 创建多种匹配键（文件名、不带扩展名的文件名等）
-                available_attachments[file.lower()] = os.path.join(attachment_dir, file)
-                name_without_ext = os.path.splitext(file)[0].lower()
-                available_attachments[name_without_ext] = os.path.join(attachment_dir, file)
+        # 附件匹配引擎（基于附件索引，不扫描目录）
+        matcher = get_attachment_matcher()
+        logger.info(f"可用附件: {len(matcher.entries)} 个")
         
-        logger.info(f"可用附件: {list(available_attachments.keys())}")
+        columns = read_columns(df)
         
-        for idx, row in df.iterrows():
-            try:
-                # 获取各列数据
-                department = str(row.iloc[0]) if pd.notna(row.iloc[0]) else ""
-                dept2 = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ""
-                attachment_path = str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else ""
-                contact_names = str(row.iloc[3]) if len(row) > 3 and pd.notna(row.iloc[3]) else ""
-                contact_emails = str(row.iloc[4]) if len(row) > 4 and pd.notna(row.iloc[4]) else ""
-                
-                # 智能匹配附件
-                matched_attachment = None
-                if attachment_path and attachment_path != 'nan':
-                    # 提取文件名（处理Windows路径）
-                    if '\\' in attachment_path:
-                        filename = attachment_path.split('\\')[-1]
-                    elif '/' in attachment_path:
-                        filename = attachment_path.split('/')[-1]
-                    else:
-                        filename = attachment_path
-                    
-                    # 尝试多种匹配方式
-                    filename_lower = filename.lower()
-                    name_without_ext = os.path.splitext(filename)[0].lower()
-                    
-                    # 精确匹配
-                    if filename_lower in available_attachments:
-                        matched_attachment = available_attachments[filename_lower]
-                        matched_files.append(filename)
-                    # 不带扩展名匹配
-                    elif name_without_ext in available_attachments:
-                        matched_attachment = available_attachments[name_without_ext]
-                        matched_files.append(filename)
-                    # 模糊匹配（包含关键词）
-                    else:
-                        # 尝试用部门名称匹配
-                        dept_keywords = [department, dept2]
-                        for keyword in dept_keywords:
-                            if keyword and keyword != 'nan':
-                                for avail_name, avail_path in available_attachments.items():
-                                    if keyword in avail_name or avail_name in keyword.lower():
-                                        matched_attachment = avail_path
-                                        matched_files.append(os.path.basename(avail_path))
-                                        break
-                            if matched_attachment:
-                                break
-                
-                # 没有找到附件，跳过
-                if not matched_attachment:
-                    skipped_count += 1
-                    logger.info(f"第{idx+2}行: 未找到匹配的附件 ({attachment_path})，跳过")
-                    continue
-                
-                # 解析邮箱
-                if not contact_emails or contact_emails == 'nan':
-                    skipped_count += 1
-                    continue
-                
-                email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-                emails = re.findall(email_pattern, str(contact_emails))
-                
-                if not emails:
-                    skipped_count += 1
-                    continue
-                
-                # 解析姓名
-                names = []
-                if contact_names and contact_names != 'nan':
-                    names = re.split(r'[、，,;；]', contact_names)
-                    names = [n.strip() for n in names if n.strip()]
-                
-                # 为每个邮箱创建收件人记录
-                for i, email in enumerate(emails):
-                    name = names[i] if i < len(names) else email.split('@')[0]
-                    
-                    recipient = {
-                        'email': email.strip(),
-                        'name': name,
-                        'department': f"{department} {dept2}".strip(),
-                        'attachment': matched_attachment,
-                        'attachment_name': os.path.basename(matched_attachment)
-                    }
-                    
-                    recipients.append(recipient)
-                    logger.info(f"添加收件人: {name} ({email}) - 附件: {os.path.basename(matched_attachment)}")
-                    
-            except Exception as e:
-                logger.error(f"处理第{idx+2}行时出错: {str(e)}")
-                skipped_count += 1
-                continue
+        # 智能匹配附件，相同的（附件位置, 前级, 部门）只匹配一次
+        keys = columns.loc[has_value(columns['attachment_path']), ['attachment_path', 'department', 'dept2']]
+        matches = {
+            key: match_attachment(*key, matcher)
+            for key in keys.drop_duplicates().itertuples(index=False, name=None)
+        }
+        row_matches = {
+            idx: matches[key]
+            for idx, key in zip(keys.index, keys.itertuples(index=False, name=None))
+        }
+        matched = {idx: result for idx, result in row_matches.items() if result.matched}
+        matched_files = [result.entry['name'] for result in matched.values()]
+        
+        # 多个附件得分相同，不自动选择，报告给用户
+        ambiguous = [
+            {
+                'row': int(idx) + 2,
+                'attachment_path': columns.at[idx, 'attachment_path'],
+                'department': f"{columns.at[idx, 'department']} {columns.at[idx, 'dept2']}".strip(),
+                'candidates': result.candidates
+            }
+            for idx, result in row_matches.items() if result.ambiguous
+        ]
+        if ambiguous:
+            logger.warning(f"{len(ambiguous)} 行附件匹配有歧义，已跳过")
+        
+        # 没有找到附件，跳过
+        unmatched_count = len(df) - len(matched)
+        if unmatched_count:
+            logger.info(f"{unmatched_count} 行未找到匹配的附件，跳过")
+        
+        # 解析邮箱
+        emails = find_emails(columns['contact_emails'][has_value(columns['contact_emails'])])
+        
+        valid = pd.Series(df.index.isin(list(matched)), index=df.index)
+        valid &= (emails.str.len() > 0).reindex(df.index, fill_value=False)
+        skipped_count = int((~valid).sum())
+        
+        # 各行的所有列，供邮件模板引用
+        fields = read_fields(df, valid.index[valid])
         
+        # 为每个邮箱创建收件人记录
+        recipients = []
+        for idx, email, name, department in expand_recipients(columns[valid], emails[valid[emails.index]]):
+            result = matched[idx]
+            recipients.append({
+                'email': email,
+                'name': name,
+                'department': department,
+                'attachment': result.entry['path'],
+                'attachment_name': result.entry['name'],
+                'match_confidence': result.confidence,
+                'fields': fields[idx]
+            })
+        
+        metrics.record_parse('smart_match', time.perf_counter() - start, len(df), len(recipients), skipped_count)
         logger.info(f"解析完成: 成功{len(recipients)}个收件人, 跳过{skipped_count}行")
         
         return {
             'success': True,
             'recipients': recipients,
+            'fields': field_names(df),
             'total': len(recipients),
             'skipped': skipped_count,
-            'matched_files': list(set(matched_files))
+            'matched_files': list(set(matched_files)),
+            'ambiguous': ambiguous
         }
         
     except Exception as e:
@@ -267,20 +336,20 @@ def parse_custom_excel_with_smart_match(filepath):
 
 @app.route('/api/list-attachments', methods=['GET'])
 def list_attachments():
-    """列出所有已上传的附件"""
+    """列出所有已上传的附件（?refresh=1 时与附件目录全量同步）"""
     try:
-        attachment_dir = app.config['ATTACHMENT_FOLDER']
-        attachments = []
-        
-        if os.path.exists(attachment_dir):
-            for file in os.listdir(attachment_dir):
-                file_path = os.path.join(attachment_dir, file)
-                if os.path.isfile(file_path):
-                    attachments.append({
-                        'name': file,
-                        'size': os.path.getsize(file_path),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                    })
+        if request.args.get('refresh') in ('1', 'true'):
+            attachment_index.sync()
+        else:
+            attachment_index.ensure_fresh()
+        attachments = [
+            {
+                'name': entry['name'],
+                'size': entry['size'],
+                'modified': datetime.fromtimestamp(entry['mtime']).isoformat()
+            }
+            for entry in attachment_index.list()
+        ]
         
         return jsonify({
             'success': True,
@@ -300,10 +369,17 @@ def clear_attachments():
                 file_path = os.path.join(attachment_dir, file)
                 if os.path.isfile(file_path):
                     os.remove(file_path)
+        attachment_index.clear()
+        attachment_store.gc()
         
         return jsonify({'success': True, 'message': '附件已清空'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """运行指标（Prometheus 文本格式）"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 # 保留原有的所有其他路由...
 # （这里包含原app.py的其他所有功能）
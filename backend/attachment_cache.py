@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+附件编码缓存模块 - 每个附件文件只读取、base64编码一次，多个收件人共用
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+from email import encoders
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 默认缓存上限（编码后的字节数）
+DEFAULT_CACHE_BYTES = int(os.environ.get('ATTACHMENT_CACHE_MB', 256)) * 1024 * 1024
+
+
+def encode_base64_bytes(data):
+    """base64编码，结果与 email.encoders.encode_base64 完全一致"""
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(data)
+    encoders.encode_base64(part)
+    return part.get_payload()
+
+
+class AttachmentCache:
+    """
+    按 (设备, inode, 修改时间, 文件大小) 缓存base64编码后的附件内容
+    附件按内容存储，相同内容的不同文件名是同一个inode，只编码一次；
+    文件被替换或修改后键随之变化，旧内容不会被误用；超过内存上限时淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(path):
+        st = os.stat(path)
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def get_encoded(self, path):
+        """返回文件base64编码后的内容，缓存未命中时读取并编码"""
+        key = self.make_key(path)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            # 同一文件只由一个线程读取编码，其他线程等待结果
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = threading.Lock()
+        with loading:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+                self.misses += 1
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                encoded = encode_base64_bytes(data)
+                metrics.ATTACHMENT_BYTES_READ.inc(len(data), source='cache')
+                metrics.ATTACHMENT_BYTES_ENCODED.inc(len(encoded), source='cache')
+                self._store(key, encoded)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return encoded
+
+    def _store(self, key, encoded):
+        size = len(encoded)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._entries[key] = encoded
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'used_bytes': self.used_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# 全局共享的附件缓存
+attachment_cache = AttachmentCache()
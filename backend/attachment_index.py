@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+附件索引模块 - 用SQLite记录附件目录中的文件（文件名、小写名、不带扩展名的小写名、大小、修改时间、SHA256），
+上传/清空附件时增量更新，解析Excel和列出附件时直接查索引，不再逐个扫描目录
+"""
+import os
+import hashlib
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """分块计算文件的SHA256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AttachmentIndex:
+    """
+    附件目录索引
+    - 启动时与目录做一次全量同步（只对大小或修改时间变化的文件重新计算哈希）
+    - 通过接口上传/删除文件时调用 add / remove / clear 增量更新
+    - 目录本身的修改时间变化（有人直接往目录里拷贝文件）时自动重新同步；
+      外部修改与接口上传恰好同时发生时可能漏掉，可调用 sync() 强制同步
+    """
+
+    def __init__(self, folder, db_path):
+        self.folder = folder
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._dir_mtime = None
+        # 索引内容每次变化时加一，便于上层缓存（例如附件匹配引擎）
+        self.version = 0
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS attachments (
+                    name TEXT PRIMARY KEY,
+                    name_lower TEXT NOT NULL,
+                    stem_lower TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    sha256 TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_attachments_name_lower ON attachments (name_lower)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_attachments_stem_lower ON attachments (stem_lower)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments (sha256)')
+        self.sync()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def path_of(self, name):
+        return os.path.join(self.folder, name)
+
+    def _current_dir_mtime(self):
+        try:
+            return os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _entry_from_stat(self, name, st, sha256):
+        return (name, name.lower(), os.path.splitext(name)[0].lower(), st.st_size, st.st_mtime, sha256)
+
+    def _upsert(self, conn, entry):
+        conn.execute(
+            'INSERT OR REPLACE INTO attachments (name, name_lower, stem_lower, size, mtime, sha256) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            entry
+        )
+
+    def sync(self):
+        """与目录全量同步，返回 (新增或更新数, 删除数)"""
+        with self._lock:
+            dir_mtime = self._current_dir_mtime()
+            conn = self._connect()
+            known = {
+                row['name']: (row['size'], row['mtime'])
+                for row in conn.execute('SELECT name, size, mtime FROM attachments')
+            }
+            seen = set()
+            updated = 0
+            if dir_mtime is not None:
+                with os.scandir(self.folder) as it:
+                    for entry in it:
+                        if not entry.is_file():
+                            continue
+                        seen.add(entry.name)
+                        st = entry.stat()
+                        if known.get(entry.name) == (st.st_size, st.st_mtime):
+                            continue
+                        self._upsert(conn, self._entry_from_stat(entry.name, st, file_sha256(entry.path)))
+                        updated += 1
+            removed = [name for name in known if name not in seen]
+            conn.executemany('DELETE FROM attachments WHERE name = ?', [(name,) for name in removed])
+            conn.commit()
+            self._dir_mtime = dir_mtime
+            if updated or removed:
+                self.version += 1
+        if updated or removed:
+            logger.info(f"附件索引已同步: 更新{updated}个, 移除{len(removed)}个")
+        return updated, len(removed)
+
+    def ensure_fresh(self):
+        """目录被外部修改过（直接拷贝/删除文件）时重新同步"""
+        if self._current_dir_mtime() != self._dir_mtime:
+            self.sync()
+
+    def add(self, name, sha256=None):
+        """新增或更新一个文件（上传保存后调用）"""
+        path = self.path_of(name)
+        st = os.stat(path)
+        entry = self._entry_from_stat(name, st, sha256 or file_sha256(path))
+        with self._lock:
+            conn = self._connect()
+            self._upsert(conn, entry)
+            conn.commit()
+            self._dir_mtime = self._current_dir_mtime()
+            self.version += 1
+        return self._row_to_dict(dict(zip(('name', 'name_lower', 'stem_lower', 'size', 'mtime', 'sha256'), entry)))
+
+    def remove(self, name):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM attachments WHERE name = ?', (name,))
+            conn.commit()
+            self._dir_mtime = self._current_dir_mtime()
+            self.version += 1
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM attachments')
+            conn.commit()
+            self._dir_mtime = self._current_dir_mtime()
+            self.version += 1
+
+    def _row_to_dict(self, row):
+        data = dict(row)
+        data['path'] = self.path_of(data['name'])
+        return data
+
+    def exists(self, name):
+        row = self._connect().execute('SELECT 1 FROM attachments WHERE name = ?', (name,)).fetchone()
+        return row is not None
+
+    def __contains__(self, name):
+        return self.exists(name)
+
+    def names(self):
+        """所有文件名（可传给子进程做附件查找）"""
+        return [row['name'] for row in self._connect().execute('SELECT name FROM attachments')]
+
+    def get(self, name):
+        row = self._connect().execute('SELECT * FROM attachments WHERE name = ?', (name,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list(self):
+        rows = self._connect().execute('SELECT * FROM attachments ORDER BY name')
+        return [self._row_to_dict(row) for row in rows]
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM attachments').fetchone()[0]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_attachment_index(folder, db_path):
+    """同一进程内同一附件目录共用一个索引"""
+    key = os.path.abspath(folder)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = AttachmentIndex(folder, db_path)
+        return _indexes[key]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+附件匹配模块 - 按附件名建立字符二元组倒排索引，
+根据部门关键词为每行找出得分最高的附件，并给出置信度；多个附件得分相同时报告为歧义而不是取第一个
+"""
+import os
+import logging
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZE = 2
+# 低于该得分视为未匹配
+MIN_SCORE = 0.6
+# 最高分与第二名相差小于该值时视为歧义
+AMBIGUITY_MARGIN = 0.05
+# 非子串关系时的得分折扣，保证子串匹配总是排在前面
+PARTIAL_MATCH_FACTOR = 0.95
+
+
+def ngrams(text):
+    if len(text) < NGRAM_SIZE:
+        return {text} if text else set()
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class MatchResult:
+    """单行的匹配结果"""
+
+    def __init__(self, entry=None, confidence=0.0, method=None, candidates=None):
+        self.entry = entry
+        self.confidence = confidence
+        self.method = method
+        self.candidates = candidates or []
+
+    @property
+    def matched(self):
+        return self.entry is not None
+
+    @property
+    def ambiguous(self):
+        return self.entry is None and len(self.candidates) > 1
+
+
+class AttachmentMatcher:
+    """
+    附件匹配引擎
+    entries 为附件索引中的记录（包含 name / name_lower / stem_lower / path）
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.by_name = {}
+        self.by_stem = {}
+        self.postings = defaultdict(list)
+        self.gram_counts = []
+        for i, entry in enumerate(self.entries):
+            self.by_name.setdefault(entry['name_lower'], entry)
+            self.by_stem.setdefault(entry['stem_lower'], entry)
+            grams = ngrams(entry['stem_lower'])
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(i)
+        self.search = lru_cache(maxsize=4096)(self._search)
+
+    def find_exact(self, filename):
+        """按文件名精确匹配（忽略大小写），再按不带扩展名的文件名匹配"""
+        filename_lower = filename.lower()
+        name_without_ext = os.path.splitext(filename)[0].lower()
+        for key in (filename_lower, name_without_ext):
+            entry = self.by_name.get(key) or self.by_stem.get(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def _score(self, keyword, keyword_grams, index, overlap):
+        stem = self.entries[index]['stem_lower']
+        if keyword in stem or stem in keyword:
+            return 1.0
+        containment = max(overlap / len(keyword_grams), overlap / max(self.gram_counts[index], 1))
+        return containment * PARTIAL_MATCH_FACTOR
+
+    def _search(self, keyword):
+        """按关键词模糊匹配，返回 MatchResult（结果按关键词缓存）"""
+        keyword = keyword.lower()
+        keyword_grams = ngrams(keyword)
+        if not keyword_grams:
+            return MatchResult()
+
+        overlaps = Counter()
+        for gram in keyword_grams:
+            overlaps.update(self.postings.get(gram, ()))
+
+        scored = sorted(
+            ((self._score(keyword, keyword_grams, i, overlap), i) for i, overlap in overlaps.items()),
+            key=lambda item: (-item[0], self.entries[item[1]]['name'])
+        )
+        scored = [(score, i) for score, i in scored if score >= MIN_SCORE]
+        if not scored:
+            return MatchResult()
+
+        best_score, best = scored[0]
+        ties = [i for score, i in scored if best_score - score < AMBIGUITY_MARGIN]
+        if len(ties) > 1:
+            return MatchResult(confidence=best_score, method='fuzzy',
+                               candidates=[self.entries[i]['name'] for i in ties])
+        return MatchResult(self.entries[best], round(best_score, 3), 'fuzzy')
+
+    def match(self, filename, keywords):
+        """
+        先按文件名精确匹配，失败后依次用关键词模糊匹配
+        某个关键词出现歧义时继续尝试后面的关键词，都失败时返回第一个歧义结果
+        """
+        entry = self.find_exact(filename) if filename else None
+        if entry is not None:
+            return MatchResult(entry, 1.0, 'exact')
+
+        first_ambiguous = None
+        for keyword in keywords:
+            if not keyword or keyword == 'nan':
+                continue
+            result = self.search(keyword)
+            if result.matched:
+                return result
+            if result.ambiguous and first_ambiguous is None:
+                first_ambiguous = result
+        return first_ambiguous or MatchResult()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+附件存储模块 - 按内容寻址保存附件：文件内容按SHA256保存一份（.blobs/ab/abcdef...），
+附件目录中的文件名只是指向它的硬链接，不同文件名的相同内容不占用额外磁盘空间；
+客户端可以先发送文件的SHA256，内容已存在时直接建立文件名引用，无需重新上传
+"""
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+import logging
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR_NAME = '.blobs'
+COPY_CHUNK_SIZE = 1024 * 1024
+# 内容文件只读：所有文件名共用同一份内容，不允许原地修改（更新附件时替换文件名的链接）
+BLOB_MODE = 0o444
+# 超过该时间的临时文件视为中断的上传残留，gc 时删除
+STALE_TMP_SECONDS = 24 * 3600
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def valid_sha256(sha256):
+    return bool(SHA256_PATTERN.match(sha256 or ''))
+
+
+class AttachmentStore:
+    """
+    内容寻址的附件存储，与附件索引配合使用
+    - save_stream / commit 保存内容并把文件名链接到内容，随后更新附件索引
+    - link 按SHA256直接建立文件名引用（内容已存在时）
+    - gc 删除已没有任何文件名引用的内容
+    文件系统不支持硬链接时退化为复制，功能不变，只是不再节省空间
+    """
+
+    def __init__(self, folder, index):
+        self.folder = folder
+        self.index = index
+        self.blob_dir = os.path.join(folder, BLOB_DIR_NAME)
+        self.tmp_dir = os.path.join(self.blob_dir, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.hardlinks = True
+        # 保存/链接与 gc 互斥（包括共用附件目录的其他工作进程），避免刚写入、尚未被引用的内容被清理
+        self._lock = FileLock(os.path.join(self.blob_dir, '.lock'))
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_dir, sha256[:2], sha256)
+
+    def has(self, sha256):
+        return valid_sha256(sha256) and os.path.exists(self.blob_path(sha256))
+
+    def temp_path(self):
+        """同一文件系统中的临时文件路径（写完后可以原子地移动到内容目录）"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def _link_name(self, blob, name):
+        """把文件名原子地指向内容文件（已有同名文件时直接替换）"""
+        tmp_path = self.temp_path()
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            self.hardlinks = False
+            shutil.copyfile(blob, tmp_path)
+        os.replace(tmp_path, os.path.join(self.folder, name))
+
+    def commit(self, tmp_path, name, sha256):
+        """
+        把已写好的临时文件保存为内容并链接到文件名，返回索引条目
+        相同内容已存在时丢弃临时文件
+        """
+        blob = self.blob_path(sha256)
+        with self._lock:
+            if os.path.exists(blob):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.chmod(tmp_path, BLOB_MODE)
+                os.replace(tmp_path, blob)
+            self._link_name(blob, name)
+            return self.index.add(name, sha256=sha256)
+
+    def save_stream(self, name, stream):
+        """边读边写入临时文件并计算SHA256，然后保存，返回索引条目"""
+        tmp_path = self.temp_path()
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as dst:
+                for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+                    dst.write(chunk)
+                    digest.update(chunk)
+            return self.commit(tmp_path, name, digest.hexdigest())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def link(self, name, sha256):
+        """内容已存在时直接建立文件名引用并返回索引条目，否则返回 None（需要上传）"""
+        if not valid_sha256(sha256):
+            return None
+        blob = self.blob_path(sha256)
+        with self._lock:
+            if not os.path.exists(blob):
+                return None
+            self._link_name(blob, name)
+            return self.index.add(name, sha256=sha256)
+
+    def adopt(self):
+        """
+        把附件目录中尚未按内容保存的文件（直接拷贝进来的、升级前上传的）转为内容引用，
+        重复内容只保留一份；返回处理的文件数
+        """
+        self.index.sync()
+        adopted = 0
+        for entry in self.index.list():
+            path = os.path.join(self.folder, entry['name'])
+            blob = self.blob_path(entry['sha256'])
+            with self._lock:
+                try:
+                    st = os.stat(path)
+                    if os.path.exists(blob):
+                        if os.path.samefile(path, blob) or not self.hardlinks:
+                            continue
+                        self._link_name(blob, entry['name'])
+                    elif st.st_nlink == 1:
+                        os.makedirs(os.path.dirname(blob), exist_ok=True)
+                        os.link(path, blob)
+                        os.chmod(blob, BLOB_MODE)
+                    else:
+                        continue
+                except OSError as e:
+                    logger.warning(f"附件 {entry['name']} 转为内容存储失败: {e}")
+                    continue
+                self.index.add(entry['name'], sha256=entry['sha256'])
+            adopted += 1
+        if adopted:
+            logger.info(f"已有 {adopted} 个附件转为内容存储")
+        return adopted
+
+    def gc(self):
+        """删除没有任何文件名引用的内容（链接数为1），返回删除数"""
+        removed = 0
+        with self._lock:
+            cutoff = time.time() - STALE_TMP_SECONDS
+            for filename in os.listdir(self.tmp_dir):
+                tmp_path = os.path.join(self.tmp_dir, filename)
+                if os.stat(tmp_path).st_mtime < cutoff:
+                    os.remove(tmp_path)
+            for prefix in os.listdir(self.blob_dir):
+                prefix_dir = os.path.join(self.blob_dir, prefix)
+                if prefix == 'tmp' or not os.path.isdir(prefix_dir):
+                    continue
+                for sha256 in os.listdir(prefix_dir):
+                    blob = os.path.join(prefix_dir, sha256)
+                    if os.stat(blob).st_nlink <= 1:
+                        os.remove(blob)
+                        removed += 1
+        if removed:
+            logger.info(f"已清理 {removed} 个未被引用的附件内容")
+        return removed
+
+    def stats(self):
+        blobs = 0
+        blob_bytes = 0
+        for root, dirs, files in os.walk(self.blob_dir):
+            if root == self.tmp_dir or root == self.blob_dir:
+                continue
+            for filename in files:
+                blobs += 1
+                blob_bytes += os.path.getsize(os.path.join(root, filename))
+        return {'blobs': blobs, 'blob_bytes': blob_bytes}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_attachment_store(folder, index):
+    """同一进程内同一附件目录共用一个存储，第一次创建时转换目录中已有的文件"""
+    key = os.path.abspath(folder)
+    with _stores_lock:
+        if key not in _stores:
+            store = AttachmentStore(folder, index)
+            store.adopt()
+            _stores[key] = store
+        return _stores[key]
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+批量解析模块 - 多个工作簿在进程池中并行解析，合并收件人并去重（同一邮箱 + 同一附件只保留一个）
+"""
+import os
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from recipient_parser import parse_workbook
+from send_ledger import recipient_key
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 解析进程数，默认为CPU核数
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 1))
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def is_workbook(filename):
+    return filename.lower().endswith(WORKBOOK_EXTENSIONS)
+
+
+def parse_workbook_file(filepath, attachment_folder, attachment_names):
+    """在子进程中执行：解析一个工作簿，解析失败作为结果返回而不是抛出"""
+    try:
+        stats = {}
+        recipients, skipped_count, fields = parse_workbook(filepath, attachment_folder, attachment_names, stats=stats)
+        return {'success': True, 'recipients': recipients, 'skipped': skipped_count, 'fields': fields,
+                'rows': stats['rows'], 'seconds': stats['seconds']}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """
+    进程池在第一次批量解析时创建并复用
+    使用 spawn 启动子进程：父进程中有发送线程和数据库连接，fork 不安全
+    （以 python app.py 启动时子进程会以 __mp_main__ 的名字导入 app.py，app.py 的启动代码在这种情况下不执行）
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _parse_all(paths, attachment_folder, attachment_names):
+    if len(paths) == 1 or PARSE_WORKERS <= 1:
+        return [parse_workbook_file(path, attachment_folder, attachment_names) for path in paths]
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(parse_workbook_file, path, attachment_folder, attachment_names) for path in paths]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        # 子进程异常退出（如内存不足），下次重新创建进程池
+        _reset_pool()
+        raise
+
+
+def parse_workbooks(files, attachment_folder, attachment_names):
+    """
+    并行解析多个工作簿并合并
+    files: [(文件名, 路径), ...]；attachment_names: 附件目录中的文件名
+    返回合并后的收件人（按文件顺序）、所有表头、每个文件的统计和重复数
+    """
+    names = frozenset(attachment_names)
+    results = _parse_all([path for _, path in files], attachment_folder, names)
+
+    recipients = []
+    fields = []
+    file_stats = []
+    seen = set()
+    duplicates = 0
+    skipped = 0
+    for (filename, _), result in zip(files, results):
+        if not result['success']:
+            logger.warning(f"解析 {filename} 失败: {result['error']}")
+            file_stats.append({'file': filename, 'success': False, 'error': result['error']})
+            continue
+
+        added = 0
+        for recipient in result['recipients']:
+            key = recipient_key(recipient)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            recipient['source_file'] = filename
+            recipients.append(recipient)
+            added += 1
+        for field in result['fields']:
+            if field not in fields:
+                fields.append(field)
+        skipped += result['skipped']
+        # 指标在主进程中记录（子进程中的计数不会被 /api/metrics 看到）
+        metrics.record_parse('batch', result['seconds'], result['rows'], len(result['recipients']), result['skipped'])
+        file_stats.append({
+            'file': filename,
+            'success': True,
+            'total': len(result['recipients']),
+            'added': added,
+            'skipped': result['skipped']
+        })
+
+    return {
+        'recipients': recipients,
+        'fields': fields,
+        'total': len(recipients),
+        'skipped': skipped,
+        'duplicates': duplicates,
+        'files': file_stats
+    }
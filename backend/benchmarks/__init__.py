@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+性能测试 - 在 backend 目录下以 python -m benchmarks.<模块> 运行，结果为JSON，便于不同版本之间对比
+"""
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Excel解析性能与一致性测试 - 对测试数据中的每个工作簿分别运行各解析函数，
+记录解析时间、峰值内存、收件人数、跳过行数，以及结果摘要（收件人 + 跳过行数的SHA256）
+
+每次解析在单独的子进程中进行（工作目录为测试数据目录），内存统计互不影响。
+修改解析代码前先生成对比基准，修改后用 --compare 对比：任一结果摘要不同（收件人或跳过行数变了）
+或解析时间变差超过 --threshold 时以退出码1结束
+
+--backend 指定要测试的代码目录（例如用 git worktree 检出的旧版本 backend），可以直接对比旧的逐行解析：
+旧版本不接受的参数（streaming=False）不传，不支持的测试项（custom_streaming）记为 unsupported；
+结果摘要只包含旧版本就有的收件人字段，新增的字段（fields、match_confidence 等）不参与对比
+
+在 backend 目录下运行:
+    python -m benchmarks.excel_corpus --out corpus --rows 1000,10000,100000
+    python -m benchmarks.bench_parse --corpus corpus --output parse-base.json
+    python -m benchmarks.bench_parse --corpus corpus --compare parse-base.json --save-outputs parse-out
+    git worktree add /tmp/mailer-base <旧版本> && python -m benchmarks.bench_parse --backend /tmp/mailer-base/backend --output parse-base.json
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import platform
+import inspect
+import argparse
+import resource
+import importlib
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 解析函数：名称 -> (模块, 函数, 关键字参数)
+PARSERS = {
+    'custom': ('app', 'parse_custom_excel', {'streaming': False}),
+    'custom_streaming': ('app', 'parse_custom_excel', {'streaming': True}),
+    'attachment_check': ('excel_handler', 'parse_excel_with_attachment_check', {}),
+    'smart_match': ('app_with_auto_attachment', 'parse_custom_excel_with_smart_match', {})
+}
+# 同一组中的解析函数结果必须完全相同（流式读取与一次性读取，包括新增的字段）
+EQUIVALENT_PARSERS = [('custom', 'custom_streaming')]
+# 旧版本解析函数没有的参数及与旧版本行为相同的取值：函数不接受该参数时，取值相同则不传，否则该项不支持
+LEGACY_KWARGS = {'streaming': False}
+# 旧版本就有的收件人字段，结果摘要只包含这些字段
+RECIPIENT_KEYS = ('email', 'name', 'department', 'attachment', 'all_attachments', 'attachment_name')
+
+
+def rss_mb():
+    # Linux 上 ru_maxrss 单位为KB，macOS 上为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class UnsupportedParser(Exception):
+    """要测试的代码中的解析函数不支持该测试项的参数"""
+
+
+def supported_kwargs(parse, kwargs):
+    """去掉函数不接受、且取值与旧版本行为相同的参数；取值不同时抛出 UnsupportedParser"""
+    parameters = inspect.signature(parse).parameters
+    if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+        return kwargs
+    accepted = {}
+    for key, value in kwargs.items():
+        if key in parameters:
+            accepted[key] = value
+        elif key not in LEGACY_KWARGS or LEGACY_KWARGS[key] != value:
+            raise UnsupportedParser(f'{parse.__name__} 不支持参数 {key}={value!r}')
+    return accepted
+
+
+def canonical_output(result, full=False):
+    """参与对比的输出：收件人（按顺序，默认只包含旧版本就有的字段）和跳过行数"""
+    recipients = result['recipients']
+    if not full:
+        recipients = [{key: r[key] for key in RECIPIENT_KEYS if key in r} for r in recipients]
+    return json.dumps(
+        {'recipients': recipients, 'skipped': result['skipped']},
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def run_child(parser_name, workbook, save_path=None):
+    """子进程中执行：解析一个工作簿，输出一行JSON"""
+    logging.disable(logging.CRITICAL)
+    module_name, function_name, kwargs = PARSERS[parser_name]
+    parse = getattr(importlib.import_module(module_name), function_name)
+    logging.disable(logging.CRITICAL)
+    try:
+        kwargs = supported_kwargs(parse, kwargs)
+    except UnsupportedParser as e:
+        print(json.dumps({'success': False, 'unsupported': True, 'error': str(e)}, ensure_ascii=False))
+        return
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    result = parse(workbook, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = rss_mb()
+
+    output = {'success': result['success'], 'seconds': round(elapsed, 4),
+              'peak_rss_mb': round(peak, 1), 'rss_delta_mb': round(peak - rss_before, 1)}
+    if result['success']:
+        canonical = canonical_output(result)
+        full = canonical_output(result, full=True)
+        output.update({
+            'total': len(result['recipients']),
+            'skipped': result['skipped'],
+            'digest': sha256_text(canonical),
+            'full_digest': sha256_text(full)
+        })
+        if save_path:
+            with open(save_path, 'w', encoding='utf-8') as f:
+                f.write(full)
+    else:
+        output['error'] = result.get('error')
+    print(json.dumps(output, ensure_ascii=False))
+
+
+def measure(corpus, parser_name, workbook, save_path=None, backend=BACKEND_DIR):
+    command = [sys.executable, '-m', 'benchmarks.bench_parse', '--child', parser_name, workbook]
+    if save_path:
+        command += ['--save-path', os.path.abspath(save_path)]
+    # 要测试的代码目录在前（解析函数从这里导入），本目录在后（提供 benchmarks 包）
+    path = [backend, BACKEND_DIR] if os.path.abspath(backend) != BACKEND_DIR else [BACKEND_DIR]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path + [os.environ.get('PYTHONPATH', '')]))
+    completed = subprocess.run(command, cwd=corpus, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {'success': False, 'error': completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run(args):
+    with open(os.path.join(args.corpus, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    parsers = args.parsers.split(',') if args.parsers else list(PARSERS)
+    if args.save_outputs:
+        os.makedirs(args.save_outputs, exist_ok=True)
+
+    results = []
+    for workbook in manifest['workbooks']:
+        for parser_name in parsers:
+            save_path = None
+            if args.save_outputs:
+                save_path = os.path.join(args.save_outputs, f"{workbook['file']}.{parser_name}.json")
+            # 多次运行取最短时间，内存取最大值
+            runs = [measure(args.corpus, parser_name, workbook['file'], save_path, args.backend)
+                    for _ in range(args.repeat)]
+            entry = {'file': workbook['file'], 'rows': workbook['rows'], 'parser': parser_name, **runs[0]}
+            if all(r['success'] for r in runs):
+                entry['seconds'] = min(r['seconds'] for r in runs)
+                entry['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+                entry['rows_per_sec'] = round(workbook['rows'] / entry['seconds']) if entry['seconds'] else None
+            results.append(entry)
+            if entry.get('unsupported'):
+                print(f"{workbook['file']:<20} {parser_name:<18} unsupported: {entry['error']}", file=sys.stderr)
+                continue
+            print(f"{workbook['file']:<20} {parser_name:<18} {entry.get('seconds')}s "
+                  f"{entry.get('peak_rss_mb')}MB total={entry.get('total')} skipped={entry.get('skipped')}",
+                  file=sys.stderr)
+
+    return {
+        'benchmark': 'parse',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': args.backend,
+        'corpus': manifest,
+        'results': results,
+        'equivalence_failures': check_equivalence(results)
+    }
+
+
+def check_equivalence(results):
+    """同一工作簿上，应当等价的解析函数完整结果（包括新增字段）的摘要必须相同"""
+    digests = {(r['file'], r['parser']): r.get('full_digest') for r in results if not r.get('unsupported')}
+    failures = []
+    for group in EQUIVALENT_PARSERS:
+        for workbook in sorted({r['file'] for r in results}):
+            values = {name: digests.get((workbook, name)) for name in group if (workbook, name) in digests}
+            if len(set(values.values())) > 1:
+                failures.append({'file': workbook, 'digests': values})
+    return failures
+
+
+def compare(current, baseline, threshold):
+    """返回 (结果不一致的项, 解析时间变差超过阈值的项)"""
+    previous = {(r['file'], r['parser']): r for r in baseline['results']}
+    mismatches = []
+    regressions = []
+    for entry in current['results']:
+        old = previous.get((entry['file'], entry['parser']))
+        if old is None or old.get('unsupported') or entry.get('unsupported'):
+            continue
+        if old.get('digest') != entry.get('digest') or old.get('skipped') != entry.get('skipped'):
+            mismatches.append({
+                'file': entry['file'], 'parser': entry['parser'],
+                'baseline': {'total': old.get('total'), 'skipped': old.get('skipped'), 'digest': old.get('digest')},
+                'current': {'total': entry.get('total'), 'skipped': entry.get('skipped'), 'digest': entry.get('digest')}
+            })
+        if old.get('seconds') and entry.get('seconds'):
+            change = (entry['seconds'] - old['seconds']) / old['seconds']
+            if change > threshold:
+                regressions.append({'file': entry['file'], 'parser': entry['parser'],
+                                    'baseline': old['seconds'], 'current': entry['seconds'], 'change': round(change, 4)})
+    return mismatches, regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Excel解析性能与一致性测试')
+    parser.add_argument('--corpus', default='corpus', help='excel_corpus 生成的测试数据目录')
+    parser.add_argument('--backend', default=BACKEND_DIR, help='要测试的代码目录（默认本目录，可指定旧版本的 backend 目录）')
+    parser.add_argument('--parsers', help=f"要测试的解析函数，逗号分隔（默认全部: {','.join(PARSERS)}）")
+    parser.add_argument('--repeat', type=int, default=1, help='每项运行次数（取最短时间）')
+    parser.add_argument('--output', help='结果JSON文件')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    parser.add_argument('--threshold', type=float, default=0.2, help='解析时间变差超过该比例视为性能回退')
+    parser.add_argument('--save-outputs', help='保存每次解析的完整输出，结果不一致时便于逐条对比')
+    parser.add_argument('--child', nargs=2, metavar=('PARSER', 'WORKBOOK'), help=argparse.SUPPRESS)
+    parser.add_argument('--save-path', help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        run_child(*args.child, save_path=args.save_path)
+        return 0
+
+    args.corpus = os.path.abspath(args.corpus)
+    args.backend = os.path.abspath(args.backend)
+    result = run(args)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        result['output_mismatches'], result['regressions'] = compare(result, baseline, args.threshold)
+        if baseline.get('corpus') != result['corpus']:
+            result['compare_warning'] = '与对比结果的测试数据不同'
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    failed = result['equivalence_failures'] or result.get('output_mismatches') or result.get('regressions')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
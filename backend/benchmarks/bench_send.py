@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+发送性能测试 - 启动本地SMTP测试服务器（子进程），用生成的收件人和附件执行一次完整的发送任务，
+统计发送速率（封/秒）、单封耗时 p50/p99、峰值内存和每封邮件的CPU时间，结果输出为JSON
+
+在 backend 目录下运行:
+    python -m benchmarks.bench_send --messages 1000 --attachment-sizes 20k,1m --output send.json
+    python -m benchmarks.bench_send --latency 0.05 --throttle 0.01 --compare send.json
+--compare 与之前的结果对比，任一指标变差超过 --threshold 时以退出码1结束
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import random
+import platform
+import argparse
+import resource
+import shutil
+import tempfile
+import subprocess
+
+# 性能指标及方向：True 表示越大越好
+METRICS = {
+    'messages_per_sec': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'peak_rss_mb': False,
+    'cpu_ms_per_message': False
+}
+
+SIZE_UNITS = {'k': 1024, 'm': 1024 * 1024}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def percentile(values, pct):
+    """最近秩法百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered), math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[index]
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 单位为KB，macOS 上为字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_sink(args, port):
+    command = [
+        sys.executable, '-m', 'benchmarks.smtp_sink', '--port', str(port),
+        '--latency', str(args.latency), '--connect-latency', str(args.connect_latency),
+        '--throttle', str(args.throttle), '--disconnect', str(args.disconnect),
+        '--max-per-connection', str(args.max_per_connection), '--seed', str(args.seed)
+    ]
+    sink = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return sink
+        except OSError:
+            time.sleep(0.05)
+    sink.kill()
+    raise RuntimeError('SMTP测试服务器启动失败')
+
+
+def stop_sink(sink):
+    sink.terminate()
+    output, _ = sink.communicate(timeout=10)
+    lines = output.strip().splitlines()
+    return json.loads(lines[-1]) if lines else {}
+
+
+def make_attachments(folder, sizes):
+    paths = []
+    for size in sizes:
+        path = os.path.join(folder, f'attachment-{size}.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def make_recipients(count, attachments):
+    return [
+        {
+            'email': f'user{i}@bench.local',
+            'name': f'收件人{i}',
+            'department': f'部门{i % 50}',
+            'attachment': attachments[i % len(attachments)],
+            'all_attachments': [attachments[i % len(attachments)]],
+            'fields': {'编号': str(i)}
+        }
+        for i in range(count)
+    ]
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='bench-send-')
+    # 发送记录、账号用量和限速状态写到临时目录（需在导入发送模块前设置）
+    os.environ['SEND_LEDGER_DIR'] = os.path.join(workdir, 'ledger')
+    os.environ['SENDER_USAGE_DB'] = os.path.join(workdir, 'sender_usage.db')
+    os.environ['RATE_LIMIT_DB'] = os.path.join(workdir, 'rate_limits.db')
+
+    import email_sender
+    from email_providers import EMAIL_PROVIDERS
+    from send_jobs import SendJob
+
+    port = free_port()
+    # 本地测试服务器作为一个服务商：并发连接数、单连接发送数和限速按参数设置
+    EMAIL_PROVIDERS['benchmark'] = {
+        'name': '本地压测',
+        'smtp_host': '127.0.0.1',
+        'max_connections': args.connections,
+        'max_messages_per_connection': args.messages_per_connection,
+        'rate_limit': args.rate,
+        'max_rate_limit': args.rate
+    }
+
+    sizes = [parse_size(s) for s in args.attachment_sizes.split(',') if s.strip()]
+    attachments = make_attachments(workdir, sizes)
+    recipients = make_recipients(args.messages, attachments)
+    accounts = [
+        {
+            'smtp_host': '127.0.0.1',
+            'smtp_port': port,
+            'sender_email': f'sender{i}@bench.local',
+            'password': 'benchmark',
+            'use_ssl': False,
+            'use_tls': False
+        }
+        for i in range(args.accounts)
+    ]
+    job = SendJob({
+        'smtp_configs': accounts,
+        'subject': '{{name}}，您好',
+        'content': '<p>{{department}} {{name}}：附件为您的资料（编号 {{编号}}）。</p>',
+        'common_attachments': [],
+        'recipients': recipients
+    })
+
+    # 单封耗时：从开始处理收件人到得到结果（包括限速等待、重试和切换账号）
+    latencies = []
+    send_to_recipient = email_sender._send_to_recipient
+
+    def timed_send(*send_args):
+        start = time.perf_counter()
+        try:
+            return send_to_recipient(*send_args)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    email_sender._send_to_recipient = timed_send
+
+    sink = start_sink(args, port)
+    try:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        job.started_at = time.time()
+        email_sender.run_send_job(job)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    finally:
+        email_sender._send_to_recipient = send_to_recipient
+        sink_stats = stop_sink(sink)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sent = job.sent_count
+    return {
+        'benchmark': 'send',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'messages': args.messages,
+            'attachment_sizes': sizes,
+            'accounts': args.accounts,
+            'connections': args.connections,
+            'messages_per_connection': args.messages_per_connection,
+            'rate': args.rate,
+            'latency': args.latency,
+            'connect_latency': args.connect_latency,
+            'throttle': args.throttle,
+            'disconnect': args.disconnect,
+            'max_per_connection': args.max_per_connection,
+            'seed': args.seed
+        },
+        'results': {
+            'sent': sent,
+            'failed': job.failed_count,
+            'skipped': job.skipped_count,
+            'elapsed_sec': round(elapsed, 3),
+            'messages_per_sec': round(sent / elapsed, 2) if elapsed else 0.0,
+            'latency_p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'latency_p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            'latency_max_ms': round(max(latencies) * 1000, 2) if latencies else None,
+            'peak_rss_mb': peak_rss_mb(),
+            'cpu_ms_per_message': round(cpu * 1000 / sent, 3) if sent else None,
+            'sink': sink_stats
+        }
+    }
+
+
+def compare(current, baseline, threshold):
+    """与之前的结果逐项对比，返回变差超过阈值的指标"""
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        new = current['results'].get(metric)
+        old = baseline['results'].get(metric)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        if worse > threshold:
+            regressions.append({'metric': metric, 'baseline': old, 'current': new, 'change': round(change, 4)})
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='发送性能测试')
+    parser.add_argument('--messages', type=int, default=500, help='收件人数')
+    parser.add_argument('--attachment-sizes', default='20k,200k,1m', help='附件大小，逗号分隔，收件人轮流使用')
+    parser.add_argument('--accounts', type=int, default=1, help='发件账号数')
+    parser.add_argument('--connections', type=int, default=4, help='每个账号的并发连接数')
+    parser.add_argument('--messages-per-connection', type=int, default=200, help='单连接发送多少封后重连')
+    parser.add_argument('--rate', type=float, default=1000.0, help='每个账号的发送速率上限（封/秒）')
+    parser.add_argument('--latency', type=float, default=0.0, help='测试服务器每封邮件的回复延迟（秒）')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='测试服务器建立连接的延迟（秒）')
+    parser.add_argument('--throttle', type=float, default=0.0, help='测试服务器回复450限流的概率')
+    parser.add_argument('--disconnect', type=float, default=0.0, help='测试服务器接收邮件后断开连接的概率')
+    parser.add_argument('--max-per-connection', type=int, default=0, help='测试服务器单连接发送上限（0为不限）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='结果JSON文件（默认只输出到标准输出）')
+    parser.add_argument('--compare', help='与之前的结果JSON对比')
+    parser.add_argument('--threshold', type=float, default=0.1, help='指标变差超过该比例视为性能回退')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    random.seed(args.seed)
+    result = run(args)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        result['regressions'] = compare(result, baseline, args.threshold)
+        if baseline.get('config') != result['config']:
+            # 参数不同的结果不具可比性，仍然输出对比但给出提示
+            result['compare_warning'] = '与对比结果的测试参数不同'
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    return 1 if result.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Excel测试数据生成 - 按分公司模板的A~E列格式生成工作簿（前级、部门、附件位置、奖金联系人、奖金标题），
+包含一格多个联系人/邮箱（、，,; 分隔）、Windows路径、多个附件、空附件、无效邮箱等情况，
+并在附件目录中生成被引用的附件（部分引用的附件故意不存在）
+numeric 格式的工作簿A、B列为带空值的数字编码，另有带空值的数字列（工号、金额）：
+pandas 会把这样的列读成浮点数（1 -> 1.0），用来检查流式读取与 pd.read_excel 的结果是否一致
+
+在 backend 目录下运行:
+    python -m benchmarks.excel_corpus --out corpus --rows 1000,10000,100000
+同样的 --seed 生成完全相同的数据，corpus/manifest.json 记录生成参数
+"""
+import os
+import json
+import random
+import argparse
+
+from openpyxl import Workbook
+
+HEADER = ['前级', '部门', '附件位置', '奖金联系人', '奖金标题']
+NUMERIC_HEADER = ['前级编码', '部门编码', '附件位置', '奖金联系人', '奖金标题', '工号', '金额']
+LAYOUTS = ('text', 'numeric')
+BRANCHES = ['北京', '上海', '广州', '深圳', '新疆', '天津', '重庆', '成都', '武汉', '西安']
+DEPARTMENTS = ['一分公司', '二分公司', '市场部', '网络部', '政企部', '财务部']
+SURNAMES = '张李王赵钱孙周吴郑冯陈褚卫蒋沈韩杨'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚'
+NAME_SEPARATORS = ['、', '，', ',', '、']
+EMAIL_SEPARATORS = ['、', '，', ';', ' ', '；']
+# 引用了、但附件目录中不存在的文件比例
+MISSING_ATTACHMENT_RATIO = 0.05
+
+
+def attachment_names(count):
+    """附件文件名（各分公司的分配表）"""
+    names = []
+    for i in range(count):
+        branch = BRANCHES[i % len(BRANCHES)]
+        extension = ('xlsx', 'pdf', 'docx')[i % 3]
+        names.append(f'{branch}分配-域区{i}.{extension}')
+    return names
+
+
+def _person(rng):
+    return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_NAMES) for _ in range(rng.choice((1, 2))))
+
+
+def _email(rng, index):
+    return f'user{index}{rng.choice(("", ".a", "_b"))}@{rng.choice(("tj.chinamobile.com", "139.com", "qq.com", "example.cn"))}'
+
+
+def _attachment_cell(rng, names, blank_ratio):
+    r = rng.random()
+    if r < blank_ratio:
+        return rng.choice([None, '', '   ', 'nan'])
+    name = rng.choice(names)
+    if rng.random() < MISSING_ATTACHMENT_RATIO:
+        name = f'不存在的附件{rng.randint(1, 999)}.xlsx'
+    style = rng.random()
+    if style < 0.6:
+        return f'D:\\AutoEmail\\附件\\2025年10月\\{name}'
+    if style < 0.75:
+        second = rng.choice(names)
+        return f'D:\\附件\\{name}{rng.choice((";", "；"))}D:\\附件\\{second}'
+    if style < 0.9:
+        return name
+    return f'/data/attachments/{name}'
+
+
+def _contact_cells(rng, row_index, blank_ratio):
+    """联系人和邮箱：大部分一人一个邮箱，部分一格多人，少量空值和无效邮箱"""
+    r = rng.random()
+    if r < blank_ratio:
+        return rng.choice([None, '', _person(rng)]), rng.choice([None, '', 'nan'])
+    if r < blank_ratio + 0.03:
+        return _person(rng), rng.choice(['无', 'bad-email', 'user@', '待定'])
+    count = 1 if rng.random() < 0.8 else rng.randint(2, 4)
+    people = [_person(rng) for _ in range(count)]
+    emails = [_email(rng, row_index * 10 + i) for i in range(count)]
+    if count > 1 and rng.random() < 0.2:
+        # 姓名比邮箱少，多出的邮箱使用最后一个姓名
+        people = people[:-1]
+    names_cell = rng.choice(NAME_SEPARATORS).join(people)
+    emails_cell = rng.choice(EMAIL_SEPARATORS).join(emails)
+    if rng.random() < 0.05:
+        emails_cell = f'  {emails_cell}  '
+    return names_cell, emails_cell
+
+
+def generate_rows(rows, names, seed, blank_ratio=0.15):
+    rng = random.Random(seed)
+    for i in range(rows):
+        branch = rng.choice(BRANCHES + [None]) if rng.random() < 0.98 else rng.choice([123, 4.5])
+        department = rng.choice(DEPARTMENTS + [None, ''])
+        if branch:
+            branch = f'{branch}分公司' if isinstance(branch, str) else branch
+        contact, emails = _contact_cells(rng, i, blank_ratio)
+        yield [branch, department, _attachment_cell(rng, names, blank_ratio), contact, emails]
+
+
+def generate_numeric_rows(rows, names, seed, blank_ratio=0.15):
+    """A、B列为数字编码，F、G列为工号和金额，各列都有空值"""
+    rng = random.Random(seed)
+
+    def blank_or(value):
+        return None if rng.random() < blank_ratio else value
+
+    for i in range(rows):
+        contact, emails = _contact_cells(rng, i, blank_ratio)
+        yield [
+            blank_or(rng.randint(1, 20)),
+            blank_or(rng.randint(100, 199)),
+            _attachment_cell(rng, names, blank_ratio),
+            contact,
+            emails,
+            blank_or(rng.randint(10000, 99999)),
+            blank_or(round(rng.uniform(100, 20000), 2))
+        ]
+
+
+def generate_workbook(path, rows, names, seed, blank_ratio=0.15, layout='text'):
+    """用openpyxl只写模式逐行写入，50万行也不占用大量内存"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    if layout == 'numeric':
+        sheet.append(NUMERIC_HEADER)
+        rows_iter = generate_numeric_rows(rows, names, seed, blank_ratio)
+    else:
+        sheet.append(HEADER)
+        rows_iter = generate_rows(rows, names, seed, blank_ratio)
+    for row in rows_iter:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def generate_corpus(out_dir, row_counts, seed=1, attachments=300, blank_ratio=0.15, layouts=LAYOUTS):
+    """生成测试数据目录：<out_dir>/rows-<n>.xlsx、rows-<n>-numeric.xlsx、attachments/ 和 manifest.json"""
+    attachment_dir = os.path.join(out_dir, 'attachments')
+    os.makedirs(attachment_dir, exist_ok=True)
+    names = attachment_names(attachments)
+    for name in names:
+        path = os.path.join(attachment_dir, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(name.encode('utf-8'))
+
+    workbooks = []
+    for rows in row_counts:
+        for layout in layouts:
+            filename = f'rows-{rows}.xlsx' if layout == 'text' else f'rows-{rows}-{layout}.xlsx'
+            generate_workbook(os.path.join(out_dir, filename), rows, names, seed + rows, blank_ratio, layout)
+            workbooks.append({'file': filename, 'rows': rows, 'layout': layout})
+
+    manifest = {
+        'seed': seed,
+        'attachments': attachments,
+        'blank_ratio': blank_ratio,
+        'workbooks': workbooks
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成Excel测试数据')
+    parser.add_argument('--out', default='corpus', help='输出目录')
+    parser.add_argument('--rows', default='1000,10000,100000', help='各工作簿的行数，逗号分隔（最多可到500000）')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--attachments', type=int, default=300, help='附件目录中的文件数')
+    parser.add_argument('--blank-ratio', type=float, default=0.15, help='空附件/空邮箱的比例')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='工作簿格式，逗号分隔（text: A~E列文本；numeric: 带空值的数字列）')
+    args = parser.parse_args(argv)
+
+    row_counts = [int(value) for value in args.rows.split(',') if value.strip()]
+    layouts = [value.strip() for value in args.layouts.split(',') if value.strip()]
+    unknown = set(layouts) - set(LAYOUTS)
+    if unknown:
+        parser.error(f"未知的格式: {','.join(sorted(unknown))}")
+    manifest = generate_corpus(args.out, row_counts, args.seed, args.attachments, args.blank_ratio, layouts)
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+本地SMTP测试服务器 - 代替139/QQ等真实服务器用于压测：接收邮件后直接丢弃，
+可模拟服务器延迟、限流回复（450）、单连接发送上限（421）和连接中断
+
+独立运行（在 backend 目录下）:
+    python -m benchmarks.smtp_sink --port 2525 --latency 0.05 --throttle 0.02 --disconnect 0.01
+收到 SIGTERM / Ctrl+C 时把统计信息以JSON输出到标准输出
+"""
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import socketserver
+
+
+class SinkStats:
+    def __init__(self):
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+        self.throttled = 0
+        self.disconnects = 0
+        self.connection_limits = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'messages': self.messages,
+                'bytes': self.bytes,
+                'throttled': self.throttled,
+                'disconnects': self.disconnects,
+                'connection_limits': self.connection_limits
+            }
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """一个SMTP连接：只实现发送邮件需要的命令，AUTH 任何账号密码都接受"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        options = self.server.options
+        stats = self.server.stats
+        stats.add('connections')
+        if options.connect_latency:
+            time.sleep(options.connect_latency)
+        self.reply('220 benchmark sink ready')
+        sent = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.strip().upper()
+            if command.startswith((b'EHLO', b'HELO')):
+                self.wfile.write(b'250-benchmark sink\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n')
+            elif command.startswith(b'AUTH'):
+                self.reply('235 authentication successful')
+            elif command.startswith(b'MAIL'):
+                if options.max_per_connection and sent >= options.max_per_connection:
+                    stats.add('connection_limits')
+                    self.reply('421 too many messages on this connection')
+                    return
+                if options.throttle and random.random() < options.throttle:
+                    stats.add('throttled')
+                    self.reply('450 too many messages, rate limited')
+                    continue
+                self.reply('250 ok')
+            elif command == b'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    size += len(data_line)
+                if options.disconnect and random.random() < options.disconnect:
+                    # 接收完邮件但不回复就断开，客户端无法确认是否已发送
+                    stats.add('disconnects')
+                    return
+                if options.latency:
+                    time.sleep(options.latency)
+                sent += 1
+                stats.add('messages')
+                stats.add('bytes', size)
+                self.reply('250 ok: queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                # RCPT / RSET / NOOP
+                self.reply('250 ok')
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host, port, options):
+        super().__init__((host, port), SinkHandler)
+        self.options = options
+        self.stats = SinkStats()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='本地SMTP测试服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0, help='每封邮件接收完成后延迟回复的秒数')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='建立连接后延迟问候的秒数')
+    parser.add_argument('--throttle', type=float, default=0.0, help='MAIL FROM 回复450限流的概率')
+    parser.add_argument('--disconnect', type=float, default=0.0, help='接收邮件后不回复直接断开的概率')
+    parser.add_argument('--max-per-connection', type=int, default=0, help='单个连接发送上限，超过后回复421（0为不限）')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子（便于复现）')
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    if options.seed is not None:
+        random.seed(options.seed)
+    server = SmtpSink(options.host, options.port, options)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'SMTP sink listening on {options.host}:{options.port}', file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.to_dict()), flush=True)
+
+
+if __name__ == '__main__':
+    main()
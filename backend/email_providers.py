@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+邮箱服务商配置模块
+"""
+
+# 邮箱服务商配置
+# max_connections: 同一任务允许的并发SMTP连接数（各服务商限流策略不同）
+# max_messages_per_connection: 单个连接发送多少封后主动重连（服务器会关闭长连接）
+# rate_limit / max_rate_limit: 初始发送速率和最高速率（封/秒），被限流时自动降速，恢复后逐步提速
+# daily_quota: 单个账号每日发送上限（可选，未配置时不限；发件账号配置中的 daily_quota 优先）
+EMAIL_PROVIDERS = {
+    'mobile139': {
+        'name': '中国移动139邮箱',
+        'smtp_host': 'smtp.139.com',
+        'smtp_port_ssl': 465,
+        'smtp_port': 25,
+        'pop3_host': 'pop.139.com',
+        'pop3_port_ssl': 995,
+        'pop3_port': 110,
+        'imap_host': 'imap.139.com',
+        'imap_port_ssl': 993,
+        'imap_port': 143,
+        'use_auth_code': True,
+        'help_text': '请使用16位授权码',
+        'max_connections': 2,
+        'max_messages_per_connection': 200,
+        'rate_limit': 1,
+        'max_rate_limit': 2
+    },
+    'qq': {
+        'name': 'QQ邮箱',
+        'smtp_host': 'smtp.qq.com',
+        'smtp_port_ssl': 465,
+        'smtp_port': 587,
+        'pop3_host': 'pop.qq.com',
+        'pop3_port_ssl': 995,
+        'imap_host': 'imap.qq.com',
+        'imap_port_ssl': 993,
+        'use_auth_code': True,
+        'help_text': '请使用授权码，非登录密码',
+        'max_connections': 3,
+        'max_messages_per_connection': 100,
+        'rate_limit': 1,
+        'max_rate_limit': 2
+    },
+    '163': {
+        'name': '163邮箱',
+        'smtp_host': 'smtp.163.com',
+        'smtp_port_ssl': 465,
+        'smtp_port': 25,
+        'pop3_host': 'pop.163.com',
+        'pop3_port_ssl': 995,
+        'imap_host': 'imap.163.com',
+        'imap_port_ssl': 993,
+        'use_auth_code': True,
+        'help_text': '请使用授权码',
+        'max_connections': 2,
+        'max_messages_per_connection': 100,
+        'rate_limit': 0.5,
+        'max_rate_limit': 1
+    },
+    'outlook': {
+        'name': 'Outlook',
+        'smtp_host': 'smtp-mail.outlook.com',
+        'smtp_port': 587,
+        'use_tls': True,
+        'use_auth_code': False,
+        'max_connections': 2,
+        'rate_limit': 0.5,
+        'max_rate_limit': 1
+    }
+}
+
+# 未知服务商（企业邮箱等）的默认并发连接数
+DEFAULT_MAX_CONNECTIONS = 2
+
+
+def find_provider(smtp_host):
+    """根据SMTP服务器地址查找服务商配置，找不到返回 (None, {})"""
+    for key, provider in EMAIL_PROVIDERS.items():
+        if provider.get('smtp_host') == smtp_host:
+            return key, provider
+    return None, {}
+
+
+def get_provider_setting(smtp_host, key, default=None):
+    """获取服务商的某项配置，未知服务商返回默认值"""
+    _, provider = find_provider(smtp_host)
+    return provider.get(key, default)
+
+
+def get_max_connections(smtp_host):
+    """获取服务商允许的并发连接数"""
+    return get_provider_setting(smtp_host, 'max_connections', DEFAULT_MAX_CONNECTIONS)
@@ -0,0 +1,600 @@
+# -*- coding: utf-8 -*-
+"""
+邮件发送模块 - 按服务商并发上限开启多个SMTP连接，并行发送个性化邮件；
+一个任务可以使用多个发件账号，按额度和健康状况分配收件人
+"""
+import smtplib
+import ssl
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from attachment_cache import attachment_cache
+from email_providers import EMAIL_PROVIDERS, get_max_connections, get_provider_setting
+from mime_stream import StreamingMessage, send_streaming
+from rate_limiter import get_rate_limiter, is_throttle_error
+from sender_usage import get_sender_usage
+from send_ledger import open_ledger, close_ledger, recipient_key
+from mail_template import compile_template
+from structured_logging import EventLog, log_event
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# SMTP连接超时（秒）
+DEFAULT_SMTP_TIMEOUT = 60
+# 单个连接发送多少封后主动更换连接
+DEFAULT_MAX_MESSAGES_PER_CONNECTION = 100
+# 连接空闲多少秒后发送前先检查是否存活
+DEFAULT_IDLE_TIMEOUT = 60
+# 连接断开后重试当前邮件的次数
+DEFAULT_SEND_RETRIES = 2
+# 被服务商限流后重试当前邮件的次数
+DEFAULT_THROTTLE_RETRIES = 3
+# 发件账号连续发送失败多少次后暂停使用，以及暂停的秒数
+MAX_CONSECUTIVE_FAILURES = 3
+ACCOUNT_COOLDOWN_SECONDS = 60
+
+
+def resolve_smtp_settings(smtp_config):
+    """根据前端提交的SMTP配置得到实际连接参数（139邮箱自动配置）"""
+    settings = {
+        'smtp_host': smtp_config.get('smtp_host'),
+        'smtp_port': smtp_config.get('smtp_port'),
+        'sender_email': smtp_config.get('sender_email'),
+        'password': smtp_config.get('password'),
+        'use_ssl': smtp_config.get('use_ssl', True),
+        'use_tls': smtp_config.get('use_tls', False)
+    }
+
+    # 139邮箱自动配置
+    if '139.com' in (settings['sender_email'] or ''):
+        settings['smtp_host'] = EMAIL_PROVIDERS['mobile139']['smtp_host']
+        settings['smtp_port'] = EMAIL_PROVIDERS['mobile139']['smtp_port_ssl']
+        settings['use_ssl'] = True
+        settings['use_tls'] = False
+
+    return settings
+
+
+def open_smtp_connection(settings):
+    """建立SMTP连接并登录（连接和登录耗时分别记入运行指标）"""
+    timeout = settings.get('timeout', DEFAULT_SMTP_TIMEOUT)
+    provider = metrics.provider_label(settings['smtp_host'])
+    with metrics.SMTP_CONNECT_SECONDS.time(provider=provider):
+        if settings['use_ssl']:
+            context = ssl.create_default_context()
+            server = smtplib.SMTP_SSL(settings['smtp_host'], settings['smtp_port'], context=context, timeout=timeout)
+        elif settings['use_tls']:
+            server = smtplib.SMTP(settings['smtp_host'], settings['smtp_port'], timeout=timeout)
+            server.starttls()
+        else:
+            server = smtplib.SMTP(settings['smtp_host'], settings['smtp_port'], timeout=timeout)
+
+    with metrics.SMTP_LOGIN_SECONDS.time(provider=provider):
+        server.login(settings['sender_email'], settings['password'])
+    return server
+
+
+def _is_connection_error(error):
+    """判断是否为连接已断开（需要重连）的错误"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # 421: 服务不可用，服务器即将关闭连接（MAIL/DATA阶段，或RCPT阶段）
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421:
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and any(
+            code == 421 for code, _ in error.recipients.values()):
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError, ssl.SSLError))
+
+
+def _error_kind(error):
+    """运行指标中的错误分类"""
+    if is_throttle_error(error):
+        return 'throttle'
+    if _is_connection_error(error):
+        return 'connection'
+    return 'other'
+
+
+class SmtpSession:
+    """
+    可自动重连的SMTP会话
+    - 连接被服务器断开时重新连接、重新登录，并重试当前邮件
+    - 发送达到 max_messages 封后主动更换连接
+    - 空闲超过 idle_timeout 秒后先用 NOOP 检查连接是否存活
+    - 指定 rate_limiter 时每封邮件发送前先取令牌；被限流时通知限速器降速，等待后重试当前邮件
+    """
+
+    def __init__(self, settings, max_messages=DEFAULT_MAX_MESSAGES_PER_CONNECTION,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_retries=DEFAULT_SEND_RETRIES,
+                 rate_limiter=None, max_throttle_retries=DEFAULT_THROTTLE_RETRIES):
+        self.settings = settings
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        self.max_throttle_retries = max_throttle_retries
+        self.server = None
+        self.messages_sent = 0
+        self.reconnect_count = 0
+        self.last_used = 0
+        self.provider = metrics.provider_label(settings['smtp_host'])
+
+    def connect(self):
+        self.close()
+        self.server = open_smtp_connection(self.settings)
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+        return self
+
+    def reconnect(self):
+        self.reconnect_count += 1
+        logger.info(f"重新连接SMTP服务器 {self.settings['smtp_host']}（第{self.reconnect_count}次）")
+        return self.connect()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+    def _ensure_alive(self):
+        if self.server is None:
+            self.connect()
+            return
+        if self.max_messages and self.messages_sent >= self.max_messages:
+            logger.info(f"连接已发送 {self.messages_sent} 封，主动更换连接")
+            self.reconnect()
+            return
+        if self.idle_timeout and time.monotonic() - self.last_used > self.idle_timeout:
+            try:
+                code, _ = self.server.noop()
+                if code != 250:
+                    self.reconnect()
+            except Exception:
+                self.reconnect()
+
+    def send_message(self, msg):
+        """发送邮件，连接断开时重连并重试，被限流时降速后重试"""
+        attempt = 0
+        throttled = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            self._ensure_alive()
+            start = time.perf_counter()
+            try:
+                send_streaming(self.server, msg)
+                metrics.SMTP_SEND_SECONDS.observe(time.perf_counter() - start, provider=self.provider)
+                metrics.SMTP_BYTES_SENT.inc(msg.bytes_written, provider=self.provider)
+                self.messages_sent += 1
+                self.last_used = time.monotonic()
+                if self.rate_limiter is not None:
+                    self.rate_limiter.on_success()
+                return
+            except Exception as e:
+                metrics.SMTP_ERRORS.inc(provider=self.provider, kind=_error_kind(e))
+                if self.rate_limiter is not None and is_throttle_error(e):
+                    self.rate_limiter.on_throttle(e)
+                    if throttled >= self.max_throttle_retries:
+                        raise
+                    throttled += 1
+                    if _is_connection_error(e):
+                        self.close()
+                    continue
+                if not _is_connection_error(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"SMTP连接已断开（{str(e)}），重连后重试第{attempt}次")
+                self.close()
+                self.reconnect_count += 1
+
+
+def build_message(sender_email, recipient, subject, content, common_attachments, events=None):
+    """
+    创建个性化邮件（流式发送，附件内容在发送时才读取）
+    返回 (msg, attachments_added)，没有成功添加个性化附件时 attachments_added 为 False
+    events（EventLog，可选）记录无法添加的附件，由发送任务汇总输出
+    """
+    msg = StreamingMessage(sender_email, recipient['email'], subject, content, cache=attachment_cache)
+
+    # 添加个性化附件（必须有）
+    personal_attachments = recipient.get('all_attachments') or [recipient['attachment']]
+    attachments_added = False
+    for attachment_path in personal_attachments:
+        try:
+            msg.add_attachment(attachment_path)
+            attachments_added = True
+        except Exception as e:
+            _attachment_event(events, 'attachment_unreadable', '无法添加附件', attachment_path, e)
+
+    if not attachments_added:
+        return msg, False
+
+    # 添加公共附件（如果有）
+    for attachment_path in common_attachments:
+        try:
+            msg.add_attachment(attachment_path)
+        except Exception as e:
+            _attachment_event(events, 'common_attachment_unreadable', '无法添加公共附件', attachment_path, e)
+
+    return msg, True
+
+
+def _attachment_event(events, event, message, path, error):
+    if events is not None:
+        events.event(event, message, logging.WARNING, path=path, error=str(error))
+    else:
+        log_event(logger, logging.WARNING, event, message, path=path, error=str(error))
+
+
+class SmtpSessionPool:
+    """
+    SMTP会话池：发送时借出一个空闲会话，用完归还，任务结束时统一关闭
+    max_sessions 限制同时打开的连接数（服务商并发上限）
+    """
+
+    def __init__(self, settings, max_messages=DEFAULT_MAX_MESSAGES_PER_CONNECTION, rate_limiter=None,
+                 max_sessions=None):
+        self.settings = settings
+        self.max_messages = max_messages
+        self.rate_limiter = rate_limiter
+        self._slots = threading.BoundedSemaphore(max_sessions) if max_sessions else None
+        self._idle = []
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def new_session(self):
+        return SmtpSession(self.settings, max_messages=self.max_messages, rate_limiter=self.rate_limiter)
+
+    def add(self, session):
+        """放入一个已登录的会话，供第一个借用的线程使用"""
+        with self._lock:
+            self._idle.append(session)
+            self._sessions.append(session)
+
+    @contextmanager
+    def session(self):
+        """借出一个会话（没有空闲的则新建），用完自动归还"""
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                session = self.new_session()
+                with self._lock:
+                    self._sessions.append(session)
+            try:
+                yield session
+            finally:
+                with self._lock:
+                    self._idle.append(session)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+    @property
+    def reconnect_count(self):
+        with self._lock:
+            return sum(session.reconnect_count for session in self._sessions)
+
+    def close_all(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+            self._idle = []
+        for session in sessions:
+            session.close()
+
+
+def get_concurrency(settings, smtp_config):
+    """并发连接数：服务商上限，前端可指定更小的值"""
+    limit = get_max_connections(settings['smtp_host'])
+    requested = smtp_config.get('max_connections')
+    if requested:
+        limit = max(1, min(limit, int(requested)))
+    return limit
+
+
+class SenderAccount:
+    """
+    发件账号：连接池、限速器、今日额度和健康状况
+    daily_quota 取账号配置，其次服务商配置，都没有时不限额度
+    """
+
+    def __init__(self, smtp_config, usage):
+        self.settings = resolve_smtp_settings(smtp_config)
+        self.email = self.settings['sender_email']
+        host = self.settings['smtp_host']
+        self.daily_quota = smtp_config.get('daily_quota') or get_provider_setting(host, 'daily_quota')
+        self.concurrency = get_concurrency(self.settings, smtp_config)
+        max_messages = int(smtp_config.get('max_messages_per_connection') or get_provider_setting(
+            host, 'max_messages_per_connection', DEFAULT_MAX_MESSAGES_PER_CONNECTION))
+        self.rate_limiter = get_rate_limiter(host, self.email)
+        self.pool = SmtpSessionPool(self.settings, max_messages=max_messages,
+                                    rate_limiter=self.rate_limiter, max_sessions=self.concurrency)
+        self.used = usage.sent_today(self.email)
+        self.sent = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.disabled = None
+
+    @property
+    def remaining(self):
+        """今日剩余额度（包括正在发送的），不限额度时为无穷大"""
+        if not self.daily_quota:
+            return float('inf')
+        return int(self.daily_quota) - self.used - self.in_flight
+
+    def stats(self):
+        return {
+            'sender': self.email,
+            'sent': self.sent,
+            'failed': self.failed,
+            'used_today': self.used,
+            'daily_quota': self.daily_quota,
+            'disabled': self.disabled,
+            'reconnects': self.pool.reconnect_count,
+            'rate_limit': self.rate_limiter.stats()
+        }
+
+
+class SenderPool:
+    """
+    发件账号池：为每封邮件选择账号
+    - 优先选择有空闲连接、今日剩余额度最多、已用量最少的账号，收件人按额度分散到各账号
+    - 登录失败的账号在本任务中停用；连续发送失败 MAX_CONSECUTIVE_FAILURES 次的账号暂停 ACCOUNT_COOLDOWN_SECONDS 秒
+    - 所有账号都在暂停中时等待最早恢复的账号
+    """
+
+    def __init__(self, smtp_configs, usage=None):
+        usage = usage or get_sender_usage()
+        self.usage = usage
+        self.accounts = [SenderAccount(config, usage) for config in smtp_configs]
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self):
+        return sum(a.concurrency for a in self.accounts if a.disabled is None)
+
+    def connect(self):
+        """每个账号先建立一个连接，登录失败的账号停用；全部失败时抛出最后一个错误"""
+        last_error = None
+        for account in self.accounts:
+            try:
+                account.pool.add(account.pool.new_session().connect())
+            except Exception as e:
+                last_error = e
+                account.disabled = f'登录失败: {str(e)}'
+                logger.warning(f"发件账号 {account.email} 登录失败，已停用: {str(e)}")
+        if all(account.disabled for account in self.accounts):
+            raise last_error
+
+    def acquire(self, exclude=(), wait_cancelled=None):
+        """
+        选择一个账号并占用一个额度，没有可用账号时返回 None
+        wait_cancelled(seconds)（可选）代替 time.sleep 等待账号恢复，返回 True（任务已取消）时不再等待，返回 None
+        """
+        while True:
+            with self._lock:
+                candidates = [
+                    a for a in self.accounts
+                    if a.disabled is None and a.remaining > 0 and a not in exclude
+                ]
+                if not candidates:
+                    return None
+                now = time.monotonic()
+                ready = [a for a in candidates if a.cooldown_until <= now]
+                if ready:
+                    account = max(ready, key=lambda a: (a.in_flight < a.concurrency, a.remaining, -a.used))
+                    account.in_flight += 1
+                    return account
+                wait = min(a.cooldown_until for a in candidates) - now
+            if wait_cancelled is None:
+                time.sleep(wait)
+            elif wait_cancelled(wait):
+                return None
+
+    def release(self, account, sent):
+        """归还账号，sent 表示是否实际发出了一封邮件"""
+        with self._lock:
+            account.in_flight -= 1
+            if sent:
+                account.used += 1
+                account.sent += 1
+                account.consecutive_failures = 0
+        if sent:
+            self.usage.add(account.email)
+
+    def report_failure(self, account, error):
+        """账号发送失败（非收件人原因）"""
+        with self._lock:
+            account.in_flight -= 1
+            account.failed += 1
+            account.consecutive_failures += 1
+            if isinstance(error, smtplib.SMTPAuthenticationError):
+                account.disabled = f'登录失败: {str(error)}'
+                logger.warning(f"发件账号 {account.email} 登录失败，已停用")
+            elif account.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+                account.cooldown_until = time.monotonic() + ACCOUNT_COOLDOWN_SECONDS
+                account.consecutive_failures = 0
+                logger.warning(f"发件账号 {account.email} 连续发送失败，暂停 {ACCOUNT_COOLDOWN_SECONDS} 秒")
+
+    def close_all(self):
+        for account in self.accounts:
+            account.pool.close_all()
+
+
+def _is_recipient_error(error):
+    """收件人被拒收（地址不存在等），换账号发送也不会成功"""
+    return (isinstance(error, smtplib.SMTPRecipientsRefused)
+            and not is_throttle_error(error) and not _is_connection_error(error))
+
+
+def _is_message_error(error):
+    """
+    邮件本身被拒绝（DATA阶段的永久错误，例如552邮件过大、554内容被拒），换账号发送也不会成功，
+    不计入账号的连续失败；发件人被拒（MAIL FROM）和登录失败属于账号问题，仍换账号重试
+    """
+    return (isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+            and not isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError))
+            and not is_throttle_error(error) and not _is_connection_error(error))
+
+
+def _record(job, events, result):
+    """记录单个收件人的结果（逐条事件：失败为WARNING，其他为DEBUG；默认只计入任务结束时的汇总）"""
+    job.record(result)
+    level = logging.WARNING if result['status'] == 'failed' else logging.DEBUG
+    events.event('recipient_' + result['status'], '发送结果', level, email=result['email'],
+                 sender=result.get('sender'), detail=result.get('message'))
+
+
+def _send_to_recipient(job, senders, ledger, recipient, subject_template, content_template, common_attachments,
+                       events):
+    """发送给单个收件人并记录结果，账号发送失败时换其他账号重试"""
+    if job.cancelled:
+        return
+
+    result = {
+        'email': recipient['email'],
+        'name': recipient.get('name', '')
+    }
+    # 本活动已发送过（或正在发送）同一收件人和附件时跳过
+    key = recipient_key(recipient)
+    if not ledger.claim(key):
+        _record(job, events, {**result, 'status': 'skipped', 'message': '已发送过，跳过（防止重复发送）'})
+        return
+
+    sent = False
+    tried = []
+    last_error = None
+    try:
+        while True:
+            account = senders.acquire(exclude=tried, wait_cancelled=job.wait_cancelled)
+            if account is None and job.cancelled:
+                return
+            if account is None:
+                message = str(last_error) if last_error else '没有可用的发件账号（今日额度已用完或账号不可用）'
+                _record(job, events, {**result, 'status': 'failed', 'message': message})
+                return
+
+            try:
+                msg, attachments_added = build_message(
+                    account.email, recipient, subject_template.render(recipient),
+                    content_template.render(recipient), common_attachments, events
+                )
+
+                # 如果没有成功添加任何附件，跳过发送
+                if not attachments_added:
+                    senders.release(account, sent=False)
+                    _record(job, events, {**result, 'status': 'skipped', 'message': '无有效附件，跳过发送'})
+                    return
+
+                # 发送邮件
+                with account.pool.session() as session:
+                    session.send_message(msg)
+
+            except Exception as e:
+                if _is_recipient_error(e) or _is_message_error(e):
+                    senders.release(account, sent=False)
+                    _record(job, events, {**result, 'status': 'failed', 'message': str(e), 'sender': account.email})
+                    return
+                senders.report_failure(account, e)
+                tried.append(account)
+                last_error = e
+                if len(senders.accounts) > 1:
+                    events.event('sender_retry', '发件账号发送失败，尝试其他账号', logging.WARNING,
+                                 sender=account.email, email=recipient['email'], error=str(e))
+                continue
+
+            sent = True
+            senders.release(account, sent=True)
+            try:
+                ledger.record(key, {'email': recipient['email'], 'sender': account.email, 'job_id': job.id})
+            except Exception as e:
+                logger.error(f"写入发送记录失败（{recipient['email']} 已发送）: {str(e)}")
+            _record(job, events, {**result, 'status': 'success', 'message': '发送成功', 'sender': account.email})
+            return
+    finally:
+        if not sent:
+            ledger.release(key)
+
+
+def get_smtp_configs(payload):
+    """任务使用的发件账号：smtp_configs（多个账号）或 smtp_config（单个账号）"""
+    return payload.get('smtp_configs') or [payload.get('smtp_config', {})]
+
+
+def run_send_job(job):
+    """
+    执行一个发送任务
+    job.payload 包含 smtp_config（或多个账号 smtp_configs）/ subject / content / common_attachments / recipients
+    recipients 可以是列表，也可以是流式解析Excel得到的迭代器（边读边发）
+    每封成功发送的邮件写入活动（job.campaign_id）的发送记录，同一活动中已发送的收件人不再重复发送
+    每个账号按服务商的并发上限开启多个SMTP连接并行发送，发送速率受账号的限速器控制，
+    收件人按各账号今日剩余额度和健康状况分配，
+    每个收件人的结果通过 job.record() 记录，任务被取消时停止发送
+    """
+    payload = job.payload
+    # 主题和正文模板只编译一次，每个收件人直接拼接
+    subject_template = compile_template(payload.get('subject', ''))
+    content_template = compile_template(payload.get('content', ''))
+    common_attachments = payload.get('common_attachments', [])
+    recipients = payload['recipients']
+
+    senders = SenderPool(get_smtp_configs(payload))
+    # 同一活动正在其他工作进程中发送时等待其结束，等待期间任务被取消则直接返回
+    ledger = open_ledger(job.campaign_id, cancelled=lambda: job.cancelled)
+    if ledger is None:
+        logger.info(f"任务 {job.id} 已取消，停止发送")
+        return
+    # 逐个收件人的事件（发送结果、附件无法读取、换账号重试），任务结束时输出汇总
+    events = EventLog(logger, 'send_job', job_id=job.id)
+    try:
+        # 先为每个账号建立一个连接，全部登录失败时整个任务直接失败
+        senders.connect()
+
+        concurrency = senders.concurrency
+        if job.total_known:
+            concurrency = min(concurrency, len(recipients)) or 1
+        logger.info(f"任务 {job.id} 使用 {len(senders.accounts)} 个发件账号、{concurrency} 个并发连接发送")
+
+        # 总数已知时（列表或按ID引用的收件人列表）核对实际读取到的数量
+        expected = len(recipients) if job.total_known else None
+        read = 0
+        # 限制排队中的收件人数量，流式读取时不会一次把整个文件读入内存
+        in_flight = threading.BoundedSemaphore(concurrency * 4)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'smtp-{job.id[:8]}') as executor:
+            for recipient in recipients:
+                if job.cancelled:
+                    break
+                read += 1
+                if not job.total_known:
+                    job.add_pending()
+                in_flight.acquire()
+                future = executor.submit(
+                    _send_to_recipient, job, senders, ledger, recipient,
+                    subject_template, content_template, common_attachments, events
+                )
+                future.add_done_callback(lambda _: in_flight.release())
+            job.finish_reading()
+        if job.cancelled:
+            logger.info(f"任务 {job.id} 已取消，停止发送")
+        elif expected is not None and read < expected:
+            # 收件人列表在发送过程中被删除，剩余收件人没有发送，任务不能算作完成
+            raise RuntimeError(f'收件人列表只读取到 {read}/{expected} 个收件人，剩余收件人未发送（列表可能已被删除）')
+        for account in senders.accounts:
+            logger.info(f"发件账号: {account.stats()}")
+        logger.info(f"附件缓存: {attachment_cache.stats()}")
+    finally:
+        senders.close_all()
+        close_ledger(ledger)
+        events.summary()
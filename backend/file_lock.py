@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+文件锁模块 - 线程锁 + fcntl.flock，多个工作进程（gunicorn）共用数据目录时在进程之间互斥；
+没有 fcntl 的平台（Windows 本地开发，只有一个进程）只使用线程锁
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock:
+    """
+    用法与 threading.Lock 相同（with / acquire / release），锁文件在第一次加锁时创建
+    同一进程内的线程由线程锁互斥，不同进程由锁文件上的 flock 互斥
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        try:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.release()
+            return False
+        except BaseException:
+            self._lock.release()
+            raise
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def is_current(self):
+        """持有的锁文件是否仍在该路径上（等待期间锁文件被删除或重建时返回 False，需要重新加锁）"""
+        try:
+            return os.path.samestat(os.fstat(self._fd), os.stat(self.path))
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        """关闭锁文件（同时释放进程间的锁）"""
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置 - 多个工作进程，每个进程多个线程
+收件人列表、发送任务进度和附件索引保存在 data/ 下的SQLite数据库中，所有工作进程共用；
+发送任务在接收请求的进程中执行，停止服务时每个进程先等待正在发送的任务完成；
+同一发件账号的限速状态（rate_limiter）和运行指标（metrics）经 data/ 下的共享存储在所有工作进程之间汇总
+
+环境变量:
+    BIND                监听地址（默认 0.0.0.0:5000）
+    WEB_WORKERS         工作进程数（默认为CPU核数）
+    WEB_THREADS         每个进程的线程数（默认8，每个进度事件流占用一个线程）
+    SEND_DRAIN_SECONDS  停止服务时等待发送任务完成的秒数（默认120），超时后取消剩余收件人
+"""
+import os
+import shutil
+import signal
+import threading
+import multiprocessing
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+
+# app.py 导入时启动发送线程、打开数据库连接，必须在每个工作进程中单独加载
+preload_app = False
+
+# 上传大文件、解析大Excel的请求可能较慢
+timeout = 300
+keepalive = 5
+
+SEND_DRAIN_SECONDS = int(os.environ.get('SEND_DRAIN_SECONDS', 120))
+# 主进程等待工作进程退出的时间：发送任务的等待时间，再加上取消后发完当前邮件的时间
+graceful_timeout = SEND_DRAIN_SECONDS + 30
+
+
+def start_drain(worker):
+    """在后台线程中执行 send_queue.drain（只启动一次）：不再开始新任务，等待正在发送的任务完成"""
+    thread = getattr(worker, 'send_drain', None)
+    if thread is None:
+        from app import send_queue
+
+        thread = threading.Thread(target=send_queue.drain, args=(SEND_DRAIN_SECONDS,), name='send-drain')
+        thread.start()
+        worker.send_drain = thread
+    return thread
+
+
+def on_starting(server):
+    """主进程启动时清空上次运行留下的各进程指标快照，计数从零开始"""
+    from metrics import METRICS_DIR
+
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    """
+    收到 SIGTERM（停止或重载服务）时立即开始等待发送任务，同时结束进度事件流：
+    gthread 工作进程要等正在处理的请求（包括事件流长连接）结束后才退出，
+    等到 worker_exit 再开始就来不及了
+    """
+    handle_exit = worker.handle_exit
+
+    def handle_term(sig, frame):
+        start_drain(worker)
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    """工作进程退出前等待发送任务结束（因其他原因退出、没有收到 SIGTERM 时在这里开始）"""
+    start_drain(worker).join()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+邮件模板模块 - 主题和正文在任务开始时编译一次（拆分为固定文本和变量），
+每个收件人只需拼接一次；变量可以是 name / email / department，也可以是Excel中任意列的表头，
+引用了不存在的列时在创建任务前报错，而不是把 {{...}} 原样发出去
+"""
+import re
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*([^{}]+?)\s*\}\}')
+
+# 每个收件人都有的变量（一行多个邮箱时各自的姓名/邮箱不同，优先于同名的Excel列）
+BUILTIN_FIELDS = ('name', 'email', 'department')
+
+
+class CompiledTemplate:
+    """编译后的模板：literals[i] + 变量fields[i] + ... + literals[-1]"""
+
+    def __init__(self, source):
+        self.source = source or ''
+        self.literals = []
+        self.fields = []
+        pos = 0
+        for match in PLACEHOLDER_PATTERN.finditer(self.source):
+            self.literals.append(self.source[pos:match.start()])
+            self.fields.append(match.group(1))
+            pos = match.end()
+        self.literals.append(self.source[pos:])
+
+    @property
+    def field_names(self):
+        return set(self.fields)
+
+    def missing_fields(self, available_fields):
+        """模板中引用了、但收件人数据中没有的变量"""
+        return sorted(self.field_names - set(BUILTIN_FIELDS) - set(available_fields))
+
+    def render(self, recipient):
+        if not self.fields:
+            return self.source
+        columns = recipient.get('fields') or {}
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            if field in BUILTIN_FIELDS:
+                value = recipient.get(field, '')
+            else:
+                value = columns.get(field, '')
+            parts.append(value if isinstance(value, str) else str(value))
+            parts.append(literal)
+        return ''.join(parts)
+
+
+def compile_template(source):
+    return CompiledTemplate(source)
+
+
+def find_missing_fields(sources, available_fields):
+    """检查多个模板（主题、正文），返回所有缺少的变量"""
+    missing = set()
+    for source in sources:
+        missing.update(compile_template(source).missing_fields(available_fields))
+    return sorted(missing)
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+运行指标模块 - 解析、发送路径中的计数器和直方图，由 /api/metrics 以 Prometheus 文本格式输出
+不依赖 prometheus_client；热路径上每次记录只是一次加锁累加，
+附件缓存、任务队列等已有统计的对象在抓取时通过回调读取，不在发送过程中额外记录
+指标在各进程内累计（批量解析的子进程把耗时和行数随结果带回主进程记录）；
+多个工作进程（gunicorn）时调用 registry.enable_multiprocess()，各进程定期把自己的指标写入共享目录，
+抓取时汇总所有进程（包括已退出的进程）的数据
+"""
+import os
+import json
+import atexit
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Excel解析耗时（秒）的直方图分桶
+PARSE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# SMTP连接、登录、发送耗时（秒）的直方图分桶
+SMTP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 各进程指标快照的目录（gunicorn 主进程启动时清空）和写入间隔（秒，抓取到的其他进程数据最多延迟这么久）
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join('data', 'metrics'))
+SNAPSHOT_SECONDS = 5
+# 已退出进程的累计值合并到该文件
+ARCHIVE_FILE = 'archived.json'
+
+# 多进程汇总方式
+SUM = 'sum'            # 累加所有进程，包括已退出的（计数器、直方图）
+LIVE_SUM = 'live_sum'  # 只累加运行中的进程（当前值，如缓存占用）
+LATEST = 'latest'      # 取各进程中最近一次设置的值
+LOCAL = 'local'        # 只取当前进程（回调读取的已是所有进程共用的数据库）
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    指标基类：按标签值（元组）保存数据，labels 为标签名
+    aggregate 为多进程时的汇总方式（SUM / LIVE_SUM / LATEST / LOCAL）
+    """
+    kind = 'untyped'
+    aggregate = SUM
+
+    def __init__(self, name, documentation, labels=(), aggregate=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        if aggregate is not None:
+            self.aggregate = aggregate
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'指标 {self.name} 需要标签 {self.labelnames}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def collect(self):
+        """当前进程的数据 {标签值元组: 值}"""
+        with self._lock:
+            return dict(self._values)
+
+    def snapshot(self):
+        """写入快照文件的数据（JSON）"""
+        return [[list(key), value] for key, value in self.collect().items()]
+
+    @staticmethod
+    def _add(a, b):
+        return a + b
+
+    def merge(self, snapshots):
+        """当前进程的数据加上其他进程的快照"""
+        values = self.collect()
+        for entries in snapshots:
+            for key, value in entries:
+                key = tuple(key)
+                values[key] = self._add(values[key], value) if key in values else value
+        return values
+
+    def samples(self, values=None):
+        """[(后缀, 标签值, 额外标签, 值), ...]"""
+        values = self.collect() if values is None else values
+        return [('', key, None, value) for key, value in values.items()]
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples(values):
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """只增不减的计数"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    当前值：set() 设置，或 set_function() 指定抓取时调用的回调
+    回调返回数值（无标签），或 {标签值元组: 数值}
+    """
+    kind = 'gauge'
+    aggregate = LIVE_SUM
+
+    def __init__(self, name, documentation, labels=(), aggregate=None):
+        super().__init__(name, documentation, labels, aggregate)
+        self._function = None
+        self._set_at = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+            self._set_at[key] = time.time()
+
+    def set_function(self, function):
+        self._function = function
+
+    def collect(self):
+        if self._function is None:
+            return super().collect()
+        values = self._function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return values
+
+    def snapshot(self):
+        if self.aggregate != LATEST:
+            return super().snapshot()
+        with self._lock:
+            return [[list(key), value, self._set_at[key]] for key, value in self._values.items()]
+
+    def merge(self, snapshots):
+        if self.aggregate != LATEST:
+            return super().merge(snapshots)
+        with self._lock:
+            latest = {key: (value, self._set_at[key]) for key, value in self._values.items()}
+        for entries in snapshots:
+            for key, value, set_at in entries:
+                key = tuple(key)
+                if key not in latest or set_at > latest[key][1]:
+                    latest[key] = (value, set_at)
+        return {key: value for key, (value, _) in latest.items()}
+
+
+class CallbackCounter(Gauge):
+    """由其他对象维护的累计值（如附件缓存命中数），抓取时通过回调读取"""
+    kind = 'counter'
+    aggregate = SUM
+
+
+class Histogram(Metric):
+    """分桶统计：每个标签组合保存各桶计数、总和与次数"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=SMTP_BUCKETS, aggregate=None):
+        super().__init__(name, documentation, labels, aggregate)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 代码块的耗时（抛出异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        """{标签值元组: [各桶计数, 总和, 次数]}"""
+        with self._lock:
+            return {key: [list(data[0]), data[1], data[2]] for key, data in self._values.items()}
+
+    @staticmethod
+    def _add(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def samples(self, values=None):
+        values = self.collect() if values is None else values
+        samples = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, f'le="{_format_value(float(bound))}"', cumulative))
+            samples.append(('_sum', key, None, total))
+            samples.append(('_count', key, None, count))
+        return samples
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.directory = None
+        self._dir_lock = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def _all(self):
+        with self._lock:
+            return list(self._metrics)
+
+    def enable_multiprocess(self, directory=METRICS_DIR, interval=SNAPSHOT_SECONDS):
+        """
+        多个工作进程共用 directory：本进程每隔 interval 秒（以及退出时）把指标写入 <pid>.json，
+        render() 汇总所有进程；已退出进程的快照中累计值合并到 archived.json
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._dir_lock = FileLock(os.path.join(directory, '.lock'))
+        with self._dir_lock:
+            self._archive_dead()
+        self.write_snapshot()
+        atexit.register(self.write_snapshot)
+        threading.Thread(target=self._snapshot_loop, args=(interval,), name='metrics-snapshot', daemon=True).start()
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'{pid}.json')
+
+    def _snapshot_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error(f"写入运行指标快照失败: {str(e)}")
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._all() if metric.aggregate != LOCAL}
+
+    def write_snapshot(self):
+        _write_json(self._snapshot_path(os.getpid()), self.snapshot())
+
+    def _process_snapshots(self):
+        """其他进程的快照 {pid: 数据}"""
+        snapshots = {}
+        for filename in os.listdir(self.directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            data = _read_json(os.path.join(self.directory, filename))
+            if data is not None:
+                snapshots[int(pid)] = data
+        return snapshots
+
+    def _archive_dead(self):
+        """把已退出进程（以及与本进程同一PID的旧进程）的累计值合并到归档文件，删除其快照"""
+        archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+        archive = _read_json(archive_path) or {}
+        dead = {pid: data for pid, data in self._process_snapshots().items() if not _pid_alive(pid)}
+        own = _read_json(self._snapshot_path(os.getpid()))
+        if own is not None:
+            dead[os.getpid()] = own
+        if not dead:
+            return
+        for metric in self._all():
+            if metric.aggregate != SUM:
+                continue
+            snapshots = [archive.get(metric.name, [])] + [data.get(metric.name, []) for data in dead.values()]
+            values = {}
+            for entries in snapshots:
+                for key, value in entries:
+                    key = tuple(key)
+                    values[key] = metric._add(values[key], value) if key in values else value
+            archive[metric.name] = [[list(key), value] for key, value in values.items()]
+        _write_json(archive_path, archive)
+        for pid in dead:
+            try:
+                os.remove(self._snapshot_path(pid))
+            except FileNotFoundError:
+                pass
+
+    def render(self):
+        """Prometheus 文本格式（text/plain; version=0.0.4），多进程时汇总所有进程"""
+        live = dead = []
+        if self.directory is not None:
+            with self._dir_lock:
+                snapshots = self._process_snapshots()
+                archive = _read_json(os.path.join(self.directory, ARCHIVE_FILE)) or {}
+            live = [data for pid, data in snapshots.items() if _pid_alive(pid)]
+            dead = [data for pid, data in snapshots.items() if not _pid_alive(pid)] + [archive]
+        lines = []
+        for metric in self._all():
+            values = None
+            if self.directory is not None and metric.aggregate != LOCAL:
+                sources = live + dead if metric.aggregate == SUM else live
+                values = metric.merge([data.get(metric.name, []) for data in sources])
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Excel解析（mode: eager 一次性读取 / streaming 流式读取 / batch 批量解析的单个文件 / smart_match 智能匹配附件）
+EXCEL_PARSE_SECONDS = registry.register(Histogram(
+    'mailer_excel_parse_seconds', 'Excel解析耗时（秒）', ['mode'], buckets=PARSE_BUCKETS))
+EXCEL_ROWS = registry.register(Counter(
+    'mailer_excel_rows_total', '已解析的Excel数据行数', ['mode']))
+EXCEL_RECIPIENTS = registry.register(Counter(
+    'mailer_excel_recipients_total', '解析得到的收件人数', ['mode']))
+EXCEL_SKIPPED_ROWS = registry.register(Counter(
+    'mailer_excel_skipped_rows_total', '解析时跳过的行数（无附件或无有效邮箱）', ['mode']))
+EXCEL_ROWS_PER_SECOND = registry.register(Gauge(
+    'mailer_excel_parse_rows_per_second', '最近一次解析的速度（行/秒）', ['mode'], aggregate=LATEST))
+
+# SMTP（provider: email_providers 中的服务商，未知服务商为 other）
+SMTP_CONNECT_SECONDS = registry.register(Histogram(
+    'mailer_smtp_connect_seconds', 'SMTP建立连接耗时（秒，含SSL/STARTTLS握手）', ['provider']))
+SMTP_LOGIN_SECONDS = registry.register(Histogram(
+    'mailer_smtp_login_seconds', 'SMTP登录耗时（秒）', ['provider']))
+SMTP_SEND_SECONDS = registry.register(Histogram(
+    'mailer_smtp_send_seconds', '单封邮件从MAIL FROM到服务器确认的耗时（秒）', ['provider']))
+SMTP_ERRORS = registry.register(Counter(
+    'mailer_smtp_errors_total', 'SMTP发送错误数（kind: throttle 限流 / connection 连接断开 / other 其他）',
+    ['provider', 'kind']))
+SMTP_BYTES_SENT = registry.register(Counter(
+    'mailer_smtp_bytes_sent_total', 'DATA阶段写出的邮件字节数', ['provider']))
+
+# 发送结果（status: success / failed / skipped）
+MESSAGES = registry.register(Counter(
+    'mailer_messages_total', '各状态的收件人发送结果数', ['status']))
+
+# 附件（source: cache 读入编码缓存 / stream 大附件发送时从磁盘流式编码）
+ATTACHMENT_BYTES_READ = registry.register(Counter(
+    'mailer_attachment_bytes_read_total', '从磁盘读取的附件字节数', ['source']))
+ATTACHMENT_BYTES_ENCODED = registry.register(Counter(
+    'mailer_attachment_bytes_encoded_total', 'base64编码后的附件字节数', ['source']))
+
+# 发送任务队列和附件编码缓存（抓取时读取；任务统计来自所有进程共用的任务数据库，不再跨进程汇总）
+SEND_QUEUE_DEPTH = registry.register(Gauge(
+    'mailer_send_queue_depth', '排队等待执行的发送任务数', aggregate=LOCAL))
+SEND_JOBS = registry.register(Gauge(
+    'mailer_send_jobs', '队列中保存的各状态发送任务数', ['status'], aggregate=LOCAL))
+SEND_PENDING_RECIPIENTS = registry.register(Gauge(
+    'mailer_send_pending_recipients', '未结束的任务中尚未处理的收件人数', aggregate=LOCAL))
+ATTACHMENT_CACHE_HITS = registry.register(CallbackCounter(
+    'mailer_attachment_cache_hits_total', '附件编码缓存命中次数'))
+ATTACHMENT_CACHE_MISSES = registry.register(CallbackCounter(
+    'mailer_attachment_cache_misses_total', '附件编码缓存未命中次数（读取并编码）'))
+ATTACHMENT_CACHE_EVICTIONS = registry.register(CallbackCounter(
+    'mailer_attachment_cache_evictions_total', '附件编码缓存淘汰的条目数'))
+ATTACHMENT_CACHE_BYTES = registry.register(Gauge(
+    'mailer_attachment_cache_bytes', '附件编码缓存占用的字节数'))
+
+
+def watch_send_queue(send_queue):
+    SEND_QUEUE_DEPTH.set_function(lambda: send_queue.stats()['queue_depth'])
+    SEND_JOBS.set_function(lambda: {(status,): count for status, count in send_queue.stats()['jobs'].items()})
+    SEND_PENDING_RECIPIENTS.set_function(lambda: send_queue.stats()['pending_recipients'])
+
+
+def watch_attachment_cache(cache):
+    ATTACHMENT_CACHE_HITS.set_function(lambda: cache.stats()['hits'])
+    ATTACHMENT_CACHE_MISSES.set_function(lambda: cache.stats()['misses'])
+    ATTACHMENT_CACHE_EVICTIONS.set_function(lambda: cache.stats()['evictions'])
+    ATTACHMENT_CACHE_BYTES.set_function(lambda: cache.stats()['used_bytes'])
+
+
+def provider_label(smtp_host):
+    """指标中的服务商标签：只使用已知服务商，避免任意主机名造成标签数量无限增长"""
+    from email_providers import find_provider
+
+    key, _ = find_provider(smtp_host)
+    return key or 'other'
+
+
+def record_parse(mode, seconds, rows, recipients, skipped):
+    """记录一次Excel解析"""
+    EXCEL_PARSE_SECONDS.observe(seconds, mode=mode)
+    EXCEL_ROWS.inc(rows, mode=mode)
+    EXCEL_RECIPIENTS.inc(recipients, mode=mode)
+    EXCEL_SKIPPED_ROWS.inc(skipped, mode=mode)
+    if seconds > 0:
+        EXCEL_ROWS_PER_SECOND.set(round(rows / seconds, 1), mode=mode)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+流式邮件模块 - 邮件头、正文和附件的base64分块直接写入SMTP DATA阶段，
+大附件从磁盘边读边编码，不在内存中保存整个附件或整封邮件
+"""
+import os
+import re
+import base64
+import uuid
+import smtplib
+import logging
+from email import policy
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.base import MIMEBase
+from email.header import Header
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# SMTP要求CRLF换行
+SMTP_POLICY = policy.compat32.clone(linesep='\r\n')
+
+# 每次从磁盘读取的字节数，必须是57的倍数（57字节编码后正好是一行76个字符）
+READ_CHUNK_SIZE = 57 * 1024
+
+# 超过该大小的附件不进入编码缓存，发送时从磁盘流式编码
+STREAM_THRESHOLD = int(os.environ.get('ATTACHMENT_STREAM_THRESHOLD_MB', 16)) * 1024 * 1024
+
+# 缓存中的编码结果按该字符数分块写出
+WRITE_CHUNK_CHARS = 76 * 1024
+
+
+def _quote_periods(data):
+    """行首的 '.' 需要转义为 '..'"""
+    return re.sub(br'(?m)^\.', b'..', data)
+
+
+def _serialize_headers(part):
+    return b''.join(SMTP_POLICY.fold_binary(name, value) for name, value in part.items())
+
+
+def _stream_file_base64(path):
+    """从磁盘分块读取文件并编码为base64行（读取和编码的字节数在读完后一次记入运行指标）"""
+    read = 0
+    encoded = 0
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines = base64.encodebytes(chunk).replace(b'\n', b'\r\n')
+                read += len(chunk)
+                encoded += len(lines)
+                yield lines
+    finally:
+        metrics.ATTACHMENT_BYTES_READ.inc(read, source='stream')
+        metrics.ATTACHMENT_BYTES_ENCODED.inc(encoded, source='stream')
+
+
+def _stream_encoded(encoded):
+    """缓存中已编码的附件内容（\\n换行）分块转为CRLF输出"""
+    for start in range(0, len(encoded), WRITE_CHUNK_CHARS):
+        chunk = encoded[start:start + WRITE_CHUNK_CHARS].encode('ascii')
+        yield chunk.replace(b'\n', b'\r\n')
+    if encoded and not encoded.endswith('\n'):
+        yield b'\r\n'
+
+
+class StreamingMessage:
+    """
+    按需生成的邮件：只保存附件路径，写入SMTP连接时再逐块读取、编码
+    小附件使用编码缓存，超过 STREAM_THRESHOLD 的附件直接从磁盘流式编码
+    """
+
+    def __init__(self, sender_email, to_email, subject, content, cache=None):
+        self.from_addr = sender_email
+        self.to_addrs = [to_email]
+        self.cache = cache
+        self.boundary = '===============' + uuid.uuid4().hex + '=='
+        self.attachments = []
+        # 最近一次写入SMTP连接的字节数
+        self.bytes_written = 0
+
+        root = MIMEMultipart(boundary=self.boundary)
+        root['From'] = Header(sender_email, 'utf-8')
+        root['To'] = Header(to_email, 'utf-8')
+        root['Subject'] = Header(subject, 'utf-8')
+        self._headers = _serialize_headers(root)
+        self._body = MIMEText(content, 'html', 'utf-8').as_bytes(policy=SMTP_POLICY)
+
+    def add_attachment(self, path):
+        """添加附件（只检查文件可读，不读取内容）"""
+        with open(path, 'rb'):
+            pass
+        self.attachments.append(path)
+
+    def _attachment_headers(self, path):
+        part = MIMEBase('application', 'octet-stream')
+        part['Content-Transfer-Encoding'] = 'base64'
+        filename = os.path.basename(path)
+        part.add_header(
+            'Content-Disposition',
+            f'attachment; filename="{filename}"'
+        )
+        return _serialize_headers(part)
+
+    def _attachment_payload(self, path):
+        if self.cache is not None and os.path.getsize(path) <= STREAM_THRESHOLD:
+            return _stream_encoded(self.cache.get_encoded(path))
+        return _stream_file_base64(path)
+
+    def iter_chunks(self):
+        """逐块生成完整的邮件内容（CRLF换行，已做行首 '.' 转义）"""
+        delimiter = f'--{self.boundary}\r\n'.encode('ascii')
+        yield _quote_periods(self._headers + b'\r\n' + delimiter + self._body + b'\r\n')
+        for path in self.attachments:
+            yield delimiter + self._attachment_headers(path) + b'\r\n'
+            # base64字符集不包含 '.'，附件内容无需转义
+            yield from self._attachment_payload(path)
+        yield f'--{self.boundary}--\r\n'.encode('ascii')
+
+
+def send_streaming(server, message):
+    """
+    通过已登录的SMTP连接发送 StreamingMessage
+    流程与 smtplib.SMTP.sendmail 一致，只是DATA阶段分块写入
+    """
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(message.from_addr)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, message.from_addr)
+
+    senderrs = {}
+    for addr in message.to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            senderrs[addr] = (code, resp)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(senderrs)
+    if len(senderrs) == len(message.to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(senderrs)
+
+    server.putcmd('data')
+    code, resp = server.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+
+    message.bytes_written = 0
+    try:
+        for chunk in message.iter_chunks():
+            server.send(chunk)
+            message.bytes_written += len(chunk)
+        server.send(b'.\r\n')
+    except Exception:
+        # DATA阶段中断后连接状态不可用，关闭后由调用方重连
+        server.close()
+        raise
+
+    code, resp = server.getreply()
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    return senderrs
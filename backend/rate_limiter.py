@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+发送限速模块 - 每个发件账号一个令牌桶（速率取服务商配置），该账号的所有SMTP连接共用；
+服务器返回限流错误（450/451/452，或提示发送频繁的550/554）时降速并暂停，
+之后随着发送成功逐步恢复速率；
+令牌桶状态保存在SQLite中，多个工作进程（gunicorn）中同一账号的连接共用一个令牌桶，总速率不超过服务商限制
+"""
+import os
+import re
+import time
+import sqlite3
+import smtplib
+import threading
+import logging
+from contextlib import contextmanager
+
+from email_providers import find_provider
+
+logger = logging.getLogger(__name__)
+
+# 未配置 rate_limit 的服务商（企业邮箱等）的默认速率（封/秒）
+DEFAULT_RATE_LIMIT = 5.0
+# 降速后的最低速率
+MIN_RATE_LIMIT = 0.05
+# 被限流时速率乘以该系数
+BACKOFF_FACTOR = 0.5
+# 每成功一封，速率增加当前速率的该比例（缓慢回升，避免刚恢复又被限流）
+RECOVERY_STEP = 0.01
+# 被限流后暂停的秒数，连续被限流时加倍
+BASE_PAUSE_SECONDS = 5
+MAX_PAUSE_SECONDS = 300
+
+RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB', os.path.join('data', 'rate_limits.db'))
+
+# 临时性错误，均视为限流
+# （421 是服务器关闭连接，如单连接发送数达到上限，由发送方重连后重试，不降速）
+THROTTLE_CODES = (450, 451, 452)
+# 550/554 只有在提示发送频繁时才视为限流；垃圾邮件拒收、邮箱容量超限等永久错误不重试
+THROTTLE_TEXT = re.compile(r'frequen|too many|rate.?limit|sending rate|频繁|频率|过快', re.IGNORECASE)
+
+
+def _throttle_reply(code, text):
+    if code in THROTTLE_CODES:
+        return True
+    if code in (550, 554):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        return bool(THROTTLE_TEXT.search(text or ''))
+    return False
+
+
+def is_throttle_error(error):
+    """判断SMTP错误是否为服务商限流"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return any(_throttle_reply(code, text) for code, text in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return _throttle_reply(error.smtp_code, error.smtp_error)
+    return False
+
+
+class RateLimitStore:
+    """令牌桶状态（SQLite，每个线程单独连接），同一数据目录的多个工作进程共用"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connect().execute('''
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                rate REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                paused_until REAL NOT NULL,
+                consecutive_throttles INTEGER NOT NULL,
+                throttle_count INTEGER NOT NULL
+            )
+        ''')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 手动控制事务（BEGIN IMMEDIATE），每发一封都要更新，提交时不必等待写盘
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, key, initial):
+        """
+        在写事务中读取令牌桶状态（不存在时为 initial 的副本），with 代码块中修改后写回；
+        其他进程在事务结束前等待，同一令牌不会被两个进程同时取走
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT * FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            state = dict(row) if row else dict(initial, key=key)
+            original = dict(state)
+            yield state
+            if state != original:
+                conn.execute(
+                    'INSERT OR REPLACE INTO rate_limits '
+                    '(key, rate, tokens, updated, paused_until, consecutive_throttles, throttle_count) '
+                    'VALUES (:key, :rate, :tokens, :updated, :paused_until, :consecutive_throttles, :throttle_count)',
+                    state
+                )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+
+class AdaptiveRateLimiter:
+    """
+    自适应令牌桶
+    - acquire() 取得一个令牌后才能发送，速率为 rate 封/秒，最多积攒 burst 个令牌
+    - on_throttle() 被限流：速率减半（不低于 min_rate）并暂停一段时间，暂停期间再次被限流不重复降速
+    - on_success() 发送成功：速率逐步回升，最高 max_rate
+    指定 store 时状态保存在数据库中（key 相同的限速器共用，包括其他进程中的），否则只在本对象中
+    """
+
+    def __init__(self, rate, max_rate=None, burst=1, min_rate=MIN_RATE_LIMIT, name='', store=None, key=None):
+        self.name = name
+        self.max_rate = max_rate or rate
+        self.min_rate = min_rate
+        self.burst = max(1, burst)
+        self.store = store
+        self.key = key or name
+        # 时间使用 time.time()：各进程的 monotonic 时钟不可比较
+        self._local_state = {
+            'rate': min(rate, self.max_rate),
+            'tokens': float(self.burst),
+            'updated': time.time(),
+            'paused_until': 0.0,
+            'consecutive_throttles': 0,
+            'throttle_count': 0
+        }
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _state(self):
+        """加锁读取令牌桶状态，with 代码块中的修改随后保存"""
+        with self._lock:
+            if self.store is None:
+                yield self._local_state
+                return
+            with self.store.transaction(self.key, self._local_state) as state:
+                # 服务商配置调低速率后，数据库中保存的速率也随之调低
+                state['rate'] = min(state['rate'], self.max_rate)
+                yield state
+
+    def acquire(self):
+        """阻塞直到可以发送下一封"""
+        while True:
+            with self._state() as state:
+                now = time.time()
+                if now < state['paused_until']:
+                    wait = state['paused_until'] - now
+                else:
+                    elapsed = max(0.0, now - state['updated'])
+                    tokens = min(self.burst, state['tokens'] + elapsed * state['rate'])
+                    state['updated'] = now
+                    if tokens >= 1:
+                        state['tokens'] = tokens - 1
+                        return
+                    state['tokens'] = tokens
+                    wait = (1 - tokens) / state['rate']
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._state() as state:
+            state['consecutive_throttles'] = 0
+            if state['rate'] < self.max_rate:
+                state['rate'] = min(self.max_rate, state['rate'] * (1 + RECOVERY_STEP))
+
+    def on_throttle(self, error=None):
+        """被限流，返回暂停的秒数"""
+        with self._state() as state:
+            now = time.time()
+            if now < state['paused_until']:
+                return state['paused_until'] - now
+            state['throttle_count'] += 1
+            state['consecutive_throttles'] += 1
+            state['rate'] = rate = max(self.min_rate, state['rate'] * BACKOFF_FACTOR)
+            pause = min(MAX_PAUSE_SECONDS, BASE_PAUSE_SECONDS * 2 ** (state['consecutive_throttles'] - 1))
+            state['paused_until'] = now + pause
+            state['tokens'] = 0.0
+            state['updated'] = state['paused_until']
+        logger.warning(f"{self.name} 发送被限流（{error}），速率降至 {rate:.2f} 封/秒，暂停 {pause} 秒")
+        return pause
+
+    def stats(self):
+        with self._state() as state:
+            return {
+                'rate': round(state['rate'], 3),
+                'max_rate': self.max_rate,
+                'throttle_count': state['throttle_count']
+            }
+
+
+_store = None
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limit_store():
+    global _store
+    with _limiters_lock:
+        if _store is None:
+            os.makedirs(os.path.dirname(RATE_LIMIT_DB_PATH) or '.', exist_ok=True)
+            _store = RateLimitStore(RATE_LIMIT_DB_PATH)
+        return _store
+
+
+def get_rate_limiter(smtp_host, sender_email=None):
+    """
+    同一账号共用一个限速器（同时进行的多个任务、多个工作进程都共用），速率取服务商配置
+    服务商按账号限流，多个账号各自限速，总速率随账号数增加
+    """
+    key = (smtp_host, (sender_email or '').lower())
+    store = get_rate_limit_store()
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            _, provider = find_provider(smtp_host)
+            rate = provider.get('rate_limit', DEFAULT_RATE_LIMIT)
+            limiter = AdaptiveRateLimiter(
+                rate,
+                max_rate=provider.get('max_rate_limit', rate),
+                burst=provider.get('max_connections', 1),
+                name=sender_email or smtp_host,
+                store=store,
+                key='|'.join(key)
+            )
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+收件人合并模块 - 同一个邮箱出现在多行（多个部门）时合并为一封邮件，附件合在一起发送，
+减少邮件数和重复传输；合并后附件总大小超过上限时拆成多封，每封不超过上限
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每封邮件附件总大小上限（原始大小，base64编码后约为4/3，多数邮箱的上限为20~50MB）
+DEFAULT_MERGE_MAX_BYTES = int(os.environ.get('MERGE_MAX_ATTACHMENT_MB', 15)) * 1024 * 1024
+# 合并报告中最多列出的邮箱数
+MAX_REPORTED_MERGES = 100
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def recipient_attachments(recipient):
+    return recipient.get('all_attachments') or ([recipient['attachment']] if recipient.get('attachment') else [])
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _pack_attachments(attachments, max_bytes, size_of):
+    """按顺序把附件装入若干封邮件，每封不超过 max_bytes（单个超过上限的附件单独一封）"""
+    groups = []
+    current = []
+    current_size = 0
+    for path in attachments:
+        size = size_of(path)
+        if current and current_size + size > max_bytes:
+            groups.append(current)
+            current = []
+            current_size = 0
+        current.append(path)
+        current_size += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _merge_group(rows, max_bytes, size_of):
+    first = rows[0]
+    attachments = []
+    departments = []
+    for row in rows:
+        for path in recipient_attachments(row):
+            if path not in attachments:
+                attachments.append(path)
+        department = row.get('department')
+        if department and department not in departments:
+            departments.append(department)
+
+    merged = []
+    for group in _pack_attachments(attachments, max_bytes, size_of):
+        recipient = dict(first)
+        recipient['department'] = '、'.join(departments)
+        recipient['attachment'] = group[0]
+        recipient['all_attachments'] = group
+        recipient['merged_rows'] = len(rows)
+        merged.append(recipient)
+    return merged, attachments
+
+
+def merge_recipients(recipients, max_bytes=DEFAULT_MERGE_MAX_BYTES, size_of=_file_size):
+    """
+    按邮箱（忽略大小写和首尾空格）合并收件人，保持第一次出现的顺序
+    姓名和Excel列取第一行，部门合并，附件去重后合并（超过 max_bytes 时拆成多封）
+    返回 (合并后的收件人, 合并报告)
+    """
+    sizes = {}
+
+    def cached_size(path):
+        if path not in sizes:
+            sizes[path] = size_of(path)
+        return sizes[path]
+
+    groups = {}
+    for recipient in recipients:
+        groups.setdefault(normalize_email(recipient['email']), []).append(recipient)
+
+    merged = []
+    details = []
+    merged_emails = 0
+    split_emails = 0
+    for rows in groups.values():
+        if len(rows) == 1:
+            merged.append(rows[0])
+            continue
+        messages, attachments = _merge_group(rows, max_bytes, cached_size)
+        merged.extend(messages)
+        merged_emails += 1
+        if len(messages) > 1:
+            split_emails += 1
+        if len(details) < MAX_REPORTED_MERGES:
+            details.append({
+                'email': rows[0]['email'],
+                'rows': len(rows),
+                'messages': len(messages),
+                'attachments': len(attachments)
+            })
+
+    report = {
+        'before': len(recipients),
+        'after': len(merged),
+        'merged_emails': merged_emails,
+        'split_emails': split_emails,
+        'max_bytes': max_bytes,
+        'merges': details
+    }
+    if merged_emails:
+        logger.info(f"合并收件人: {len(recipients)} -> {len(merged)} 封邮件，{merged_emails} 个邮箱合并，{split_emails} 个因附件过大拆分")
+    return merged, report
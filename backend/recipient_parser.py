@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+收件人解析模块 - 按列处理Excel数据（空值判断、邮箱提取、姓名拆分），
+替代逐行 df.iterrows()，各解析函数共用；
+以及不依赖Flask应用的工作簿解析（可在进程池中执行）
+"""
+import os
+import re
+import time
+import logging
+import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+
+from structured_logging import EventLog, log_event
+
+logger = logging.getLogger(__name__)
+
+# A列:前级 B列:部门 C列:附件位置 D列:奖金联系人 E列:奖金联系人邮箱
+COLUMNS = ['department', 'dept2', 'attachment_path', 'contact_names', 'contact_emails']
+
+EMAIL_PATTERN = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+NAME_SEPARATORS = r'[、，,;；]'
+ATTACHMENT_SEPARATORS = r'[;；]'
+
+# 流式读取时每批的行数
+STREAM_CHUNK_ROWS = 5000
+# 超过该大小的xlsx文件默认使用流式读取
+STREAM_THRESHOLD_BYTES = int(os.environ.get('EXCEL_STREAM_THRESHOLD_MB', 10)) * 1024 * 1024
+
+
+def read_columns(df):
+    """
+    取A-E列并转为字符串，空值为 ''
+    结果与逐行 str(row.iloc[i]) if pd.notna(row.iloc[i]) else "" 相同，缺少的列全部为 ''
+    """
+    columns = {}
+    for i, name in enumerate(COLUMNS):
+        if i < df.shape[1]:
+            col = df.iloc[:, i]
+            mask = col.notna()
+            values = pd.Series('', index=df.index, dtype=object)
+            values[mask] = col[mask].map(str)
+            columns[name] = values
+        else:
+            columns[name] = pd.Series('', index=df.index, dtype=object)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def field_names(df):
+    """可以在邮件模板中引用的列（表头），没有表头的列除外"""
+    return [str(name).strip() for name in df.columns if not str(name).startswith('Unnamed:')]
+
+
+def read_fields(df, index):
+    """
+    指定行的所有列，返回 {行号: {表头: 单元格字符串}}，空值为 ''
+    收件人记录中保存为 fields，供邮件模板引用任意列
+    """
+    rows = df.loc[index]
+    fields = {}
+    for column in rows.columns:
+        name = str(column).strip()
+        if name.startswith('Unnamed:'):
+            continue
+        col = rows[column]
+        mask = col.notna()
+        values = pd.Series('', index=rows.index, dtype=object)
+        values[mask] = col[mask].map(str)
+        fields[name] = values
+    return dict(zip(rows.index, pd.DataFrame(fields, index=rows.index).to_dict('records')))
+
+
+def has_value(series):
+    """非空且不是字符串 'nan'"""
+    return (series != '') & (series != 'nan')
+
+
+def find_emails(series):
+    """提取每行的所有邮箱地址，返回列表列"""
+    return series.str.findall(EMAIL_PATTERN)
+
+
+def split_names(series):
+    """
+    拆分多个姓名（顿号、逗号、分号分隔），去掉空白项
+    返回以 (行号, 序号) 为索引的姓名
+    """
+    series = series[has_value(series)]
+    names = series.str.split(NAME_SEPARATORS, regex=True).explode().str.strip()
+    names = names[names.notna() & (names != '')]
+    position = names.groupby(level=0).cumcount()
+    return pd.Series(names.to_numpy(), index=pd.MultiIndex.from_arrays([names.index, position.to_numpy()]))
+
+
+def department_names(columns):
+    """部门：前级 + 部门"""
+    return (columns['department'] + ' ' + columns['dept2']).str.strip()
+
+
+def expand_recipients(columns, emails):
+    """
+    把每行的邮箱列表展开为收件人
+    第i个邮箱对应第i个姓名，没有对应姓名时使用邮箱前缀
+    返回 [(行号, 邮箱, 姓名, 部门), ...]，顺序与原逐行解析一致
+    """
+    emails = emails[emails.str.len() > 0]
+    if emails.empty:
+        return []
+
+    exploded = emails.explode()
+    rows = exploded.index.to_numpy()
+    position = exploded.groupby(level=0).cumcount().to_numpy()
+    email_values = exploded.str.strip()
+
+    names = split_names(columns['contact_names'].loc[emails.index])
+    name_values = names.reindex(pd.MultiIndex.from_arrays([rows, position]))
+    name_values = name_values.where(name_values.notna().to_numpy(), email_values.str.split('@').str[0].to_numpy())
+
+    departments = department_names(columns.loc[emails.index]).reindex(rows)
+
+    return list(zip(rows, email_values.to_numpy(), name_values.to_numpy(), departments.to_numpy()))
+
+
+def resolve_unique(series, resolver):
+    """同样的单元格内容只解析一次（例如附件路径查找）"""
+    resolved = {value: resolver(value) for value in series.unique()}
+    return series.map(resolved).astype(object), resolved
+
+
+def should_stream(filepath):
+    """大文件（仅限xlsx，openpyxl不支持xls）使用流式读取"""
+    return filepath.lower().endswith('.xlsx') and os.path.getsize(filepath) > STREAM_THRESHOLD_BYTES
+
+
+def _convert_cell(cell):
+    """单元格取值，与 pandas.read_excel 的转换规则一致（空值、错误值为 None，整数值的浮点数转为 int）"""
+    from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+    value = cell.value
+    if value is None or cell.data_type == TYPE_ERROR:
+        return None
+    if cell.data_type == TYPE_NUMERIC:
+        return int(value) if int(value) == value else float(value)
+    if isinstance(value, str) and value in STR_NA_VALUES:
+        return None
+    return value
+
+
+def _value_kind(value):
+    """单元格取值的类型，用于判断该列在 pandas 中是否会被转为数值列"""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        try:
+            float(value)
+        except ValueError:
+            return 'text'
+        return 'numeric_text'
+    return 'other'
+
+
+def pandas_compatible(kinds):
+    """
+    一列的取值类型集合 kinds 是否保证逐个单元格 str() 与 pd.read_excel 整列读取的结果相同：
+    含非数字文本的列保持原值；全部为整数（或小数、布尔值）且没有空值的列类型不变；
+    数值列中有空值（整数变为 1.0）、整数小数混合、数字文本（'007' 变为 7）等情况由 pandas 按整列转换，
+    逐批读取无法得到相同结果
+    """
+    numeric = kinds & {'bool', 'int', 'float', 'numeric_text'}
+    return not numeric or 'text' in kinds or kinds in ({'int'}, {'float'}, {'bool'})
+
+
+class ColumnKinds:
+    """逐批读取时按列累计单元格的取值类型，读完后判断哪些列与 pd.read_excel 整列读取的结果不同"""
+
+    def __init__(self):
+        self.rows = 0
+        self.kinds = {}
+        self.counts = {}
+
+    def update(self, rows):
+        """rows 为一批已补齐宽度的行"""
+        for i, values in enumerate(zip(*rows)):
+            self.kinds.setdefault(i, set()).update(map(_value_kind, values))
+            self.counts[i] = self.counts.get(i, 0) + len(rows)
+        self.rows += len(rows)
+
+    def incompatible(self):
+        """返回结果会不同的列号（某些批次没有该列时，这些行视为空值）"""
+        columns = []
+        for i, kinds in sorted(self.kinds.items()):
+            if self.counts[i] < self.rows:
+                kinds = kinds | {'null'}
+            if not pandas_compatible(kinds):
+                columns.append(i)
+        return columns
+
+
+def _header_names(header, width):
+    """列名规则与 pandas 相同：空表头为 'Unnamed: i'，重复的表头加 '.1'、'.2' 后缀"""
+    names = []
+    seen = {}
+    for i in range(width):
+        value = header[i] if i < len(header) else None
+        name = f'Unnamed: {i}' if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _rows_to_frame(rows, start, header, column_kinds=None):
+    width = max(len(COLUMNS), len(header), max(len(row) for row in rows))
+    rows = [row + [None] * (width - len(row)) for row in rows]
+    if column_kinds is not None:
+        column_kinds.update(rows)
+    return pd.DataFrame(rows, index=pd.RangeIndex(start, start + len(rows)),
+                        columns=_header_names(header, width), dtype=object)
+
+
+def read_excel_field_names(filepath):
+    """只读取第一个工作表的表头，返回可在邮件模板中引用的列名"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        header_row = next(workbook.worksheets[0].rows, None)
+        if header_row is None:
+            return []
+        header = [_convert_cell(cell) for cell in header_row]
+        return [name for name in _header_names(header, len(header)) if not name.startswith('Unnamed:')]
+    finally:
+        workbook.close()
+
+
+def iter_excel_frames(filepath, chunk_rows=None, column_kinds=None):
+    """
+    openpyxl只读模式逐行读取第一个工作表（首行为表头），每 chunk_rows 行生成一个DataFrame
+    行号与 pd.read_excel(filepath, header=0) 相同，末尾的空行同样忽略
+    各批次单独构造，单元格保持原值：pandas 会把有空值的整数列整列转为小数（'5' 变为 '5.0'），
+    这类列无法逐批得到相同结果。column_kinds（ColumnKinds，可选）中累计各列的取值类型，
+    读完后据此判断与 pd.read_excel 的结果是否一致
+    """
+    from openpyxl import load_workbook
+
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        rows = sheet.rows
+        header_row = next(rows, None)
+        if header_row is None:
+            return
+        header = [_convert_cell(cell) for cell in header_row]
+
+        buffer = []
+        blank_rows = []
+        start = 0
+        for row in rows:
+            values = [_convert_cell(cell) for cell in row]
+            while values and values[-1] is None:
+                values.pop()
+            # 空行暂存，后面还有数据时才计入（与pandas忽略末尾空行一致）
+            if not values:
+                blank_rows.append(values)
+                continue
+            if blank_rows:
+                buffer.extend(blank_rows)
+                blank_rows = []
+            buffer.append(values)
+            if len(buffer) >= chunk_rows:
+                yield _rows_to_frame(buffer, start, header, column_kinds)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _rows_to_frame(buffer, start, header, column_kinds)
+    finally:
+        workbook.close()
+
+
+def resolve_attachment_paths(attachment_path, attachment_folder, attachment_names, events=None):
+    """
+    解析附件路径，返回附件目录中存在的文件列表
+    处理Windows路径 D:\\AutoEmail\\附件\\2025年10月\\新疆分配-域名.xlsx，可能包含多个路径，用分号分隔
+    attachment_names 为附件目录中的文件名（附件索引或文件名集合，支持 in 判断）
+    events（EventLog，可选）记录未找到的附件，由调用方汇总输出
+    """
+    attachments = []
+    if '\\' in attachment_path:
+        paths = re.split(ATTACHMENT_SEPARATORS, attachment_path)
+        for path in paths:
+            path = path.strip()
+            if path:
+                # 提取文件名，在附件目录查找
+                filename = path.split('\\')[-1]
+                local_path = os.path.join(attachment_folder, filename)
+                if filename in attachment_names:
+                    attachments.append(local_path)
+                elif events is not None:
+                    events.event('attachment_missing', '附件未找到', logging.WARNING, filename=filename, path=local_path)
+                else:
+                    log_event(logger, logging.WARNING, 'attachment_missing', '附件未找到', filename=filename, path=local_path)
+    return attachments
+
+
+def _record_skipped_rows(events, df, has_attachment, has_attachment_file, has_email):
+    """
+    跳过原因按列统计后计入汇总；只有逐条事件会被输出时（LOG_EVENTS=sample/all 且 DEBUG）才逐行记录
+    行号为Excel中的行号（表头为第1行）
+    """
+    no_attachment = ~has_attachment
+    missing_file = has_attachment & ~has_attachment_file
+    no_email = has_attachment_file & ~has_email
+    events.add('row_skipped_no_attachment', int(no_attachment.sum()))
+    events.add('row_skipped_attachment_missing', int(missing_file.sum()))
+    events.add('row_skipped_no_email', int(no_email.sum()))
+    if not events.verbose():
+        return
+    for reason, mask in (('no_attachment', no_attachment), ('attachment_missing', missing_file), ('no_email', no_email)):
+        for idx in df.index[mask.to_numpy()]:
+            events.event('row_skipped', '跳过行', row=int(idx) + 2, reason=reason)
+
+
+def parse_recipient_frame(df, attachment_folder, attachment_names, events=None):
+    """
+    解析一批Excel行，返回 (收件人列表, 跳过行数)
+    重要：只处理有附件的行，没有附件的直接跳过
+    events（EventLog，可选）中记录跳过原因和未找到的附件；未指定时本批解析完输出一条汇总
+    """
+    own_events = events is None
+    if own_events:
+        events = EventLog(logger, 'parse_rows', rows=len(df))
+    # A列:前级 B列:部门 C列:附件位置 D列:奖金联系人 E列:奖金标题(邮箱)
+    columns = read_columns(df)
+
+    # 重要：先检查是否有附件，没有附件直接跳过
+    attachment_col = columns['attachment_path']
+    has_attachment = has_value(attachment_col) & (attachment_col.str.strip() != '')
+
+    # 同一附件单元格只查找一次
+    attachments, _ = resolve_unique(
+        attachment_col[has_attachment],
+        lambda value: resolve_attachment_paths(value, attachment_folder, attachment_names, events)
+    )
+    has_attachment_file = attachments.str.len() > 0
+
+    # 提取所有邮箱地址 - 支持多个邮箱
+    emails = find_emails(columns['contact_emails'][has_value(columns['contact_emails'])])
+
+    has_attachment_file = has_attachment_file.reindex(df.index, fill_value=False)
+    has_email = (emails.str.len() > 0).reindex(df.index, fill_value=False)
+    valid = has_attachment_file & has_email
+    skipped_count = int((~valid).sum())
+    _record_skipped_rows(events, df, has_attachment, has_attachment_file, has_email)
+
+    # 各行的所有列，供邮件模板引用
+    fields = read_fields(df, valid.index[valid])
+
+    # 为每个邮箱创建收件人记录
+    recipients = []
+    for idx, email, name, department in expand_recipients(columns[valid], emails[valid[emails.index]]):
+        row_attachments = list(attachments[idx])
+        recipients.append({
+            'email': email,
+            'name': name,
+            'department': department,
+            'attachment': row_attachments[0],  # 个性化附件
+            'all_attachments': row_attachments,  # 所有附件
+            'fields': fields[idx]
+        })
+
+    if own_events:
+        events.summary(recipients=len(recipients), skipped=skipped_count)
+    return recipients, skipped_count
+
+
+def iter_workbook(filepath, attachment_folder, attachment_names, stats=None):
+    """
+    流式解析工作簿：openpyxl只读模式分批读取，每批解析完即产出收件人，
+    无需等待整个文件读完。stats 字典（可选）中累计 rows / total / skipped，并记录表头 fields
+    整个文件读完后输出一条事件汇总（跳过原因、未找到的附件）；
+    有空值的数字列等与 pd.read_excel 结果不同的列记录在 stats['inexact_columns'] 中并输出警告
+    """
+    events = EventLog(logger, 'parse_workbook', file=os.path.basename(filepath), streaming=True)
+    column_kinds = ColumnKinds()
+    columns = []
+    rows = total = skipped = 0
+    for df in iter_excel_frames(filepath, column_kinds=column_kinds):
+        columns = list(df.columns)
+        recipients, skipped_count = parse_recipient_frame(df, attachment_folder, attachment_names, events)
+        rows += len(df)
+        total += len(recipients)
+        skipped += skipped_count
+        if stats is not None:
+            stats.setdefault('fields', field_names(df))
+            stats['rows'] = stats.get('rows', 0) + len(df)
+            stats['total'] = stats.get('total', 0) + len(recipients)
+            stats['skipped'] = stats.get('skipped', 0) + skipped_count
+        yield from recipients
+    inexact = [columns[i] for i in column_kinds.incompatible()]
+    if stats is not None:
+        stats['inexact_columns'] = inexact
+    if inexact:
+        log_event(logger, logging.WARNING, 'inexact_columns',
+                  '以下列含空值的数字或数字文本，流式读取的格式与一次性读取不同（如 5 与 5.0）',
+                  file=os.path.basename(filepath), columns=inexact)
+    events.summary(rows=rows, recipients=total, skipped=skipped)
+
+
+def parse_workbook(filepath, attachment_folder, attachment_names, streaming=None, stats=None):
+    """
+    解析自定义格式的工作簿，返回 (收件人列表, 跳过行数, 表头)
+    streaming 为 None 时，大于 EXCEL_STREAM_THRESHOLD_MB 的xlsx文件自动使用流式读取；
+    流式读取的结果与一次性读取不同时（有空值的数字列等），改为一次性读取重新解析，结果始终与 pd.read_excel 一致
+    stats 字典（可选）中记录读取方式 mode（eager / streaming）、数据行数 rows 和耗时 seconds，供调用方记录运行指标
+    """
+    if streaming is None:
+        streaming = should_stream(filepath)
+    start = time.perf_counter()
+
+    if streaming:
+        logger.info(f"开始流式解析Excel: {filepath}")
+        stream_stats = {'rows': 0, 'total': 0, 'skipped': 0}
+        recipients = list(iter_workbook(filepath, attachment_folder, attachment_names, stream_stats))
+        skipped_count, fields, rows = stream_stats['skipped'], stream_stats.get('fields', []), stream_stats['rows']
+        if stream_stats['inexact_columns']:
+            logger.info(f"列 {stream_stats['inexact_columns']} 需要按整列转换，改为一次性读取: {filepath}")
+            streaming = False
+    if not streaming:
+        # 读取Excel
+        df = pd.read_excel(filepath, header=0)
+        logger.info(f"开始解析Excel，总行数: {len(df)}")
+        events = EventLog(logger, 'parse_workbook', file=os.path.basename(filepath), streaming=False)
+        recipients, skipped_count = parse_recipient_frame(df, attachment_folder, attachment_names, events)
+        fields, rows = field_names(df), len(df)
+        events.summary(rows=rows, recipients=len(recipients), skipped=skipped_count)
+
+    if stats is not None:
+        stats.update({
+            'mode': 'streaming' if streaming else 'eager',
+            'rows': rows,
+            'seconds': time.perf_counter() - start
+        })
+    return recipients, skipped_count, fields
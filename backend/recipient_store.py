@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+收件人列表存储模块 - 解析后的收件人列表保存在服务端SQLite中，通过简短的列表ID引用，
+发送时按ID分批读取，不再放进session cookie或在每次请求中来回传递完整列表
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 列表保留时间（小时），过期后在保存新列表时清理
+LIST_TTL_HOURS = float(os.environ.get('RECIPIENT_LIST_TTL_HOURS', 72))
+# 发送时每次从数据库读取的收件人数
+READ_BATCH_SIZE = 1000
+
+
+class RecipientList:
+    """
+    按ID引用的收件人列表，可直接作为发送任务的 recipients：
+    len() 返回总数，迭代时分批从数据库读取
+    """
+
+    def __init__(self, store, list_id, count):
+        self.store = store
+        self.list_id = list_id
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.store.iter_recipients(self.list_id)
+
+
+class RecipientStore:
+    """收件人列表存储（SQLite，每个线程单独连接）"""
+
+    def __init__(self, db_path, ttl_hours=LIST_TTL_HOURS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_hours * 3600
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS recipient_lists (
+                    id TEXT PRIMARY KEY,
+                    source TEXT,
+                    count INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    fields TEXT
+                )
+            ''')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(recipient_lists)')]
+            if 'fields' not in columns:
+                conn.execute('ALTER TABLE recipient_lists ADD COLUMN fields TEXT')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS recipients (
+                    list_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (list_id, position)
+                )
+            ''')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def save(self, recipients, source=None, fields=None, keep=()):
+        """
+        保存收件人列表，返回列表ID；fields 为Excel表头（邮件模板可引用的列）
+        保存前清理过期的列表，keep 中的列表（未结束的发送任务正在使用）不清理
+        """
+        self.prune(keep)
+        list_id = uuid.uuid4().hex
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT INTO recipients (list_id, position, data) VALUES (?, ?, ?)',
+                ((list_id, i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(recipients))
+            )
+            conn.execute(
+                'INSERT INTO recipient_lists (id, source, count, created_at, fields) VALUES (?, ?, ?, ?, ?)',
+                (list_id, source, len(recipients), time.time(), json.dumps(fields or [], ensure_ascii=False))
+            )
+        logger.info(f"收件人列表 {list_id} 已保存，共 {len(recipients)} 个收件人")
+        return list_id
+
+    def info(self, list_id):
+        row = self._connect().execute(
+            'SELECT id, source, count, created_at, fields FROM recipient_lists WHERE id = ?', (list_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        info = dict(row)
+        info['fields'] = json.loads(info['fields'] or '[]')
+        return info
+
+    def get(self, list_id):
+        """按ID取收件人列表，不存在（或已过期清理）时返回 None"""
+        info = self.info(list_id)
+        if info is None:
+            return None
+        return RecipientList(self, list_id, info['count'])
+
+    def load(self, list_id, offset=0, limit=None):
+        """读取列表中的一段收件人（limit 为 None 时读到末尾）"""
+        rows = self._connect().execute(
+            'SELECT data FROM recipients WHERE list_id = ? AND position >= ? ORDER BY position LIMIT ?',
+            (list_id, offset, -1 if limit is None else limit)
+        )
+        return [json.loads(row['data']) for row in rows]
+
+    def iter_recipients(self, list_id, batch_size=READ_BATCH_SIZE):
+        """分批读取，不一次性把整个列表载入内存"""
+        offset = 0
+        while True:
+            batch = self.load(list_id, offset, batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            offset += batch_size
+
+    def delete(self, list_id):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM recipients WHERE list_id = ?', (list_id,))
+            deleted = conn.execute('DELETE FROM recipient_lists WHERE id = ?', (list_id,)).rowcount
+        return deleted > 0
+
+    def prune(self, keep=()):
+        """删除过期的列表，keep 中的列表除外"""
+        conn = self._connect()
+        cutoff = time.time() - self.ttl_seconds
+        expired = [row['id'] for row in conn.execute(
+            'SELECT id FROM recipient_lists WHERE created_at < ?', (cutoff,)
+        ) if row['id'] not in keep]
+        if not expired:
+            return 0
+        with conn:
+            conn.executemany('DELETE FROM recipients WHERE list_id = ?', [(i,) for i in expired])
+            conn.executemany('DELETE FROM recipient_lists WHERE id = ?', [(i,) for i in expired])
+        logger.info(f"已清理 {len(expired)} 个过期的收件人列表")
+        return len(expired)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_recipient_store(db_path):
+    """同一进程内同一数据库共用一个存储"""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = RecipientStore(db_path)
+        return _stores[key]
@@ -0,0 +1,646 @@
+# -*- coding: utf-8 -*-
+"""
+发送任务队列模块 - 群发任务放入队列由后台线程执行，接口立即返回任务ID；
+指定任务存储（SQLite）时，任务状态和逐个收件人的结果写入数据库，
+多个工作进程（gunicorn）中的任何一个都可以查询进度、推送事件流和取消任务
+"""
+import os
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+import metrics
+from send_ledger import prune_ledgers
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_CANCELLED = 'cancelled'
+JOB_FAILED = 'failed'
+
+FINISHED_STATES = (JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED)
+
+# 本进程中未结束的任务每隔多少秒把进度写入数据库（同时作为心跳），并检查其他进程发出的取消请求
+FLUSH_INTERVAL = 1
+# 未写入数据库的结果达到该数量时立即写入
+FLUSH_BATCH = 200
+# 超过该秒数没有心跳的未结束任务，视为所在进程已退出
+STALE_SECONDS = 60
+# 检查失去心跳的任务的最短间隔（秒），查询进度时不必每次都写数据库
+STALE_CHECK_SECONDS = 5
+# 数据库中保留已结束任务的天数
+JOB_RETENTION_DAYS = float(os.environ.get('SEND_JOB_RETENTION_DAYS', 7))
+# 事件流等待其他进程中任务的新结果时的轮询间隔（秒）
+POLL_SECONDS = 0.5
+# 停止服务时取消剩余任务后，再等待正在发送的邮件完成的秒数
+CANCEL_WAIT_SECONDS = 15
+
+INTERRUPTED_MESSAGE = '任务所在的服务进程已停止，任务未完成（用同一活动ID重新发送时，已发送的收件人会跳过）'
+DRAIN_CANCEL_MESSAGE = '服务停止时任务未发送完，已取消剩余收件人（用同一活动ID重新发送可继续发送）'
+NOT_STARTED_MESSAGE = '服务停止时任务尚未开始，请重新提交'
+
+
+def progress_dict(data, processed):
+    """补充发送速率（封/秒）和预计剩余时间（秒）"""
+    data['rate'] = 0.0
+    data['eta'] = None
+    if data['started_at']:
+        elapsed = (data['finished_at'] or time.time()) - data['started_at']
+        if elapsed > 0 and processed:
+            data['rate'] = round(processed / elapsed, 2)
+            if data['status'] == JOB_RUNNING and data['total_known']:
+                data['eta'] = round(data['queued'] / data['rate'], 1)
+    return data
+
+
+class SendJob:
+    """一次群发任务及其进度（在创建它的进程中执行）"""
+
+    def __init__(self, payload, store=None):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.store = store
+        # 活动ID：用同一个活动ID重新发送时跳过已发送的收件人，未指定时每个任务单独一个活动
+        self.campaign_id = payload.get('campaign_id') or self.id
+        # 按ID引用的收件人列表，任务结束前该列表不能被删除或清理
+        self.list_id = payload.get('list_id')
+        # 收件人可以是边解析边产出的迭代器，此时总数随读取逐步增加
+        self.total_known = hasattr(payload['recipients'], '__len__')
+        self.total = len(payload['recipients']) if self.total_known else 0
+        self.status = JOB_QUEUED
+        self.error = None
+        self.results = []
+        self.sent_count = 0
+        self.failed_count = 0
+        self.skipped_count = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # 有新结果或任务结束时通知等待的事件流
+        self._updated = threading.Condition(self._lock)
+        # 已写入数据库的结果数
+        self._saved = 0
+        self._flush_lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def wait_cancelled(self, timeout):
+        """等待 timeout 秒，期间任务被取消时立即返回 True"""
+        return self._cancel_event.wait(timeout)
+
+    def add_pending(self, count=1):
+        """流式读取收件人时累计总数"""
+        with self._lock:
+            self.total += count
+
+    def finish_reading(self):
+        with self._lock:
+            self.total_known = True
+
+    def record(self, result):
+        """记录单个收件人的发送结果"""
+        with self._lock:
+            self.results.append(result)
+            if result['status'] == 'success':
+                self.sent_count += 1
+            elif result['status'] == 'skipped':
+                self.skipped_count += 1
+            else:
+                self.failed_count += 1
+            self._updated.notify_all()
+            unsaved = len(self.results) - self._saved
+        metrics.MESSAGES.inc(status=result['status'])
+        if self.store is not None and unsaved >= FLUSH_BATCH:
+            self.flush(wait=False)
+
+    def notify(self):
+        """任务状态变化（结束、取消）时唤醒等待的事件流，并写入数据库"""
+        with self._lock:
+            self._updated.notify_all()
+        self.flush()
+
+    def flush(self, wait=True):
+        """
+        把状态和尚未保存的结果写入任务存储（一个事务），同时刷新心跳
+        wait 为 False 时如果其他线程正在写入则直接返回（发送线程不等待数据库）
+        """
+        if self.store is None:
+            return
+        if not self._flush_lock.acquire(blocking=wait):
+            return
+        try:
+            with self._lock:
+                start = self._saved
+                results = self.results[start:]
+                state = self._state()
+            self.store.save(self.id, state, results, start)
+            with self._lock:
+                self._saved = start + len(results)
+        finally:
+            self._flush_lock.release()
+
+    def _state(self):
+        return {
+            'status': self.status,
+            'total': self.total,
+            'total_known': self.total_known,
+            'sent': self.sent_count,
+            'failed': self.failed_count,
+            'skipped': self.skipped_count,
+            'processed': len(self.results),
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+    def wait_for_results(self, cursor, timeout):
+        """
+        返回第 cursor 个之后的结果；暂时没有新结果且任务未结束时最多等待 timeout 秒
+        （供事件流推送使用，结果列表只追加，cursor 即已推送的结果数）
+        """
+        with self._lock:
+            if len(self.results) <= cursor and self.status not in FINISHED_STATES:
+                self._updated.wait(timeout)
+            return self.results[cursor:]
+
+    def to_dict(self, include_results=False):
+        """任务进度：各状态计数、发送速率（封/秒）和预计剩余时间（秒）"""
+        with self._lock:
+            processed = len(self.results)
+            data = {
+                'job_id': self.id,
+                'campaign_id': self.campaign_id,
+                'status': self.status,
+                'total': self.total,
+                'total_known': self.total_known,
+                'queued': self.total - processed,
+                'sent': self.sent_count,
+                'failed': self.failed_count,
+                'skipped': self.skipped_count,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'error': self.error
+            }
+            if include_results:
+                data['results'] = list(self.results)
+        return progress_dict(data, processed)
+
+
+class StoredJob:
+    """
+    其他进程中的任务（只读视图，数据来自任务存储）
+    提供与 SendJob 相同的查询接口：status / to_dict / wait_for_results
+    """
+
+    def __init__(self, store, row):
+        self.store = store
+        self.id = row['id']
+        self._row = row
+
+    @property
+    def created_at(self):
+        return self._row['created_at']
+
+    @property
+    def status(self):
+        """每次读取都从数据库刷新（事件流据此判断任务是否结束）"""
+        row = self.store.load(self.id)
+        if row is not None:
+            self._row = row
+        return self._row['status']
+
+    def wait_for_results(self, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            results = self.store.results(self.id, cursor)
+            if results or self.status in FINISHED_STATES or time.monotonic() >= deadline:
+                return results
+            time.sleep(POLL_SECONDS)
+
+    def to_dict(self, include_results=False):
+        row = self._row
+        data = {
+            'job_id': row['id'],
+            'campaign_id': row['campaign_id'],
+            'status': row['status'],
+            'total': row['total'],
+            'total_known': bool(row['total_known']),
+            'queued': row['total'] - row['processed'],
+            'sent': row['sent'],
+            'failed': row['failed'],
+            'skipped': row['skipped'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'error': row['error']
+        }
+        if include_results:
+            data['results'] = self.store.results(self.id, 0)
+        return progress_dict(data, row['processed'])
+
+
+class SendJobStore:
+    """发送任务状态和逐个收件人的结果（SQLite，每个线程单独连接），同一数据目录的多个工作进程共用"""
+
+    def __init__(self, db_path, retention_days=JOB_RETENTION_DAYS):
+        self.db_path = db_path
+        self.retention_seconds = retention_days * 86400
+        self._local = threading.local()
+        self._stale_checked = 0
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS send_jobs (
+                    id TEXT PRIMARY KEY,
+                    campaign_id TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    total INTEGER NOT NULL,
+                    total_known INTEGER NOT NULL,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    skipped INTEGER NOT NULL DEFAULT 0,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    error TEXT,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    heartbeat_at REAL NOT NULL,
+                    list_id TEXT
+                )
+            ''')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(send_jobs)')]
+            if 'list_id' not in columns:
+                conn.execute('ALTER TABLE send_jobs ADD COLUMN list_id TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS send_jobs_created ON send_jobs (created_at)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS send_job_results (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+            ''')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def create(self, job):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO send_jobs (id, campaign_id, status, total, total_known, created_at, heartbeat_at, list_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job.id, job.campaign_id, job.status, job.total, int(job.total_known), job.created_at, now, job.list_id)
+            )
+
+    def save(self, job_id, state, results=(), start=0):
+        """更新任务状态并追加结果（results 的第一个序号为 start），同时刷新心跳"""
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO send_job_results (job_id, seq, data) VALUES (?, ?, ?)',
+                [(job_id, start + i, json.dumps(result, ensure_ascii=False)) for i, result in enumerate(results)]
+            )
+            conn.execute(
+                'UPDATE send_jobs SET status = ?, total = ?, total_known = ?, sent = ?, failed = ?, skipped = ?, '
+                'processed = ?, started_at = ?, finished_at = ?, error = ?, heartbeat_at = ? WHERE id = ?',
+                (state['status'], state['total'], int(state['total_known']), state['sent'], state['failed'],
+                 state['skipped'], state['processed'], state['started_at'], state['finished_at'], state['error'],
+                 time.time(), job_id)
+            )
+
+    def load(self, job_id):
+        self.mark_stale()
+        row = self._connect().execute('SELECT * FROM send_jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, limit=200):
+        self.mark_stale()
+        rows = self._connect().execute(
+            'SELECT * FROM send_jobs ORDER BY created_at DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def results(self, job_id, cursor):
+        rows = self._connect().execute(
+            'SELECT data FROM send_job_results WHERE job_id = ? AND seq >= ? ORDER BY seq', (job_id, cursor)
+        ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def request_cancel(self, job_id):
+        """记录取消请求，由执行该任务的进程在下次检查时取消；任务不存在时返回 False"""
+        with self._connect() as conn:
+            cursor = conn.execute('UPDATE send_jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+            return cursor.rowcount > 0
+
+    def cancel_requested(self, job_ids):
+        """返回其中已被请求取消的任务ID"""
+        if not job_ids:
+            return set()
+        placeholders = ','.join('?' * len(job_ids))
+        rows = self._connect().execute(
+            f'SELECT id FROM send_jobs WHERE cancel_requested = 1 AND id IN ({placeholders})', list(job_ids)
+        ).fetchall()
+        return {row['id'] for row in rows}
+
+    def mark_stale(self, force=False):
+        """长时间没有心跳的未结束任务（所在进程已退出）标记为失败"""
+        now = time.time()
+        if not force and now - self._stale_checked < STALE_CHECK_SECONDS:
+            return
+        self._stale_checked = now
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE send_jobs SET status = ?, error = ?, finished_at = ? '
+                'WHERE status IN (?, ?) AND heartbeat_at < ?',
+                (JOB_FAILED, INTERRUPTED_MESSAGE, now, JOB_QUEUED, JOB_RUNNING, now - STALE_SECONDS)
+            )
+
+    def active_list_ids(self):
+        """所有进程中未结束任务引用的收件人列表ID"""
+        self.mark_stale()
+        rows = self._connect().execute(
+            'SELECT DISTINCT list_id FROM send_jobs WHERE status IN (?, ?) AND list_id IS NOT NULL',
+            (JOB_QUEUED, JOB_RUNNING)
+        ).fetchall()
+        return {row['list_id'] for row in rows}
+
+    def stats(self):
+        """所有进程的任务统计：各状态任务数、排队中的任务数、未结束任务中尚未处理的收件人数"""
+        self.mark_stale()
+        rows = self._connect().execute(
+            'SELECT status, COUNT(*) AS jobs, SUM(total - processed) AS pending FROM send_jobs GROUP BY status'
+        ).fetchall()
+        counts = {row['status']: row['jobs'] for row in rows}
+        pending = sum(max(0, row['pending'] or 0) for row in rows if row['status'] not in FINISHED_STATES)
+        return {'queue_depth': counts.get(JOB_QUEUED, 0), 'jobs': counts, 'pending_recipients': pending}
+
+    def prune(self):
+        """删除超过保留时间的已结束任务及其结果，以及同样超过保留时间没有写入的发送记录"""
+        cutoff = time.time() - self.retention_seconds
+        placeholders = ','.join('?' * len(FINISHED_STATES))
+        with self._connect() as conn:
+            expired = [row['id'] for row in conn.execute(
+                f'SELECT id FROM send_jobs WHERE status IN ({placeholders}) AND finished_at < ?',
+                (*FINISHED_STATES, cutoff)
+            )]
+            conn.executemany('DELETE FROM send_job_results WHERE job_id = ?', [(job_id,) for job_id in expired])
+            conn.executemany('DELETE FROM send_jobs WHERE id = ?', [(job_id,) for job_id in expired])
+            active = {row['campaign_id'] for row in conn.execute(
+                'SELECT DISTINCT campaign_id FROM send_jobs WHERE status IN (?, ?)', (JOB_QUEUED, JOB_RUNNING)
+            )}
+        if expired:
+            logger.info(f"已清理 {len(expired)} 个过期的发送任务")
+        prune_ledgers(self.retention_seconds, keep=active)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_send_job_store(db_path):
+    """同一进程内同一数据库共用一个存储"""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SendJobStore(db_path)
+        return _stores[key]
+
+
+class SendJobQueue:
+    """
+    任务队列 + 后台工作线程
+    runner(job) 负责实际发送，由工作线程调用；任务在提交它的进程中执行
+    payload 中的 temp_files（例如边读取边发送的工作簿）在任务结束后删除
+    指定 store 时任务进度写入数据库，其他进程的任务也可以查询和取消
+    """
+
+    def __init__(self, runner, workers=2, max_finished_jobs=200, store=None):
+        self.runner = runner
+        self.max_finished_jobs = max_finished_jobs
+        self.store = store
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = False
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f'send-worker-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        if store is not None:
+            store.mark_stale(force=True)
+            t = threading.Thread(target=self._monitor, name='send-job-monitor', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, payload):
+        """创建任务并放入队列，立即返回任务对象"""
+        if self._stopping:
+            raise RuntimeError('服务正在停止，请稍后重试')
+        job = SendJob(payload, store=self.store)
+        if self.store is not None:
+            self.store.prune()
+            self.store.create(job)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        logger.info(f"任务 {job.id} 已加入队列，收件人 {job.total} 个")
+        return job
+
+    def get(self, job_id):
+        """本进程中的任务返回 SendJob，其他进程中的任务返回 StoredJob，不存在时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        row = self.store.load(job_id)
+        return StoredJob(self.store, row) if row else None
+
+    def list_jobs(self):
+        with self._lock:
+            local = dict(self._jobs)
+        if self.store is None:
+            return list(local.values())
+        return [local.get(row['id']) or StoredJob(self.store, row) for row in self.store.list()]
+
+    def stats(self):
+        """队列统计：排队中的任务数、各状态任务数、未结束任务中尚未处理的收件人数"""
+        if self.store is not None:
+            return self.store.stats()
+        jobs = self.list_jobs()
+        counts = {}
+        pending = 0
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+            if job.status not in FINISHED_STATES:
+                pending += max(0, job.total - len(job.results))
+        return {'queue_depth': self._queue.qsize(), 'jobs': counts, 'pending_recipients': pending}
+
+    def active_list_ids(self):
+        """未结束的任务（本进程和其他进程）引用的收件人列表ID，这些列表不能删除或清理"""
+        active = {job.list_id for job in self._unfinished() if job.list_id}
+        if self.store is not None:
+            active |= self.store.active_list_ids()
+        return active
+
+    def cancel(self, job_id):
+        """
+        取消任务：排队中的任务不再执行，运行中的任务在当前收件人完成后停止
+        其他进程中的任务记录取消请求，由该进程在一秒内取消
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            if self.store is None or not self.store.request_cancel(job_id):
+                return None
+            return self.get(job_id)
+        if job.status not in FINISHED_STATES:
+            job.cancel()
+            if self.store is not None:
+                self.store.request_cancel(job_id)
+            with self._lock:
+                dequeued = job.status == JOB_QUEUED
+                if dequeued:
+                    job.status = JOB_CANCELLED
+                    job.finished_at = time.time()
+            if dequeued:
+                job.notify()
+        return job
+
+    @property
+    def stopping(self):
+        """drain() 已开始：不再接受新任务，事件流据此结束"""
+        return self._stopping
+
+    def drain(self, timeout):
+        """
+        停止服务前调用：不再开始新任务，排队中的任务立即标记为失败（NOT_STARTED_MESSAGE），
+        等待正在发送的任务完成；超过 timeout 秒后取消剩余收件人（当前邮件发完后停止），
+        这些任务由工作线程结束为已取消并保留 DRAIN_CANCEL_MESSAGE；
+        进程退出时仍未结束的任务由其他进程按心跳超时标记为失败
+        """
+        with self._lock:
+            self._stopping = True
+            now = time.time()
+            queued = [job for job in self._jobs.values() if job.status == JOB_QUEUED]
+            for job in queued:
+                job.status = JOB_FAILED
+                job.error = NOT_STARTED_MESSAGE
+                job.finished_at = now
+        for job in queued:
+            job.notify()
+            self._remove_temp_files(job)
+        if queued:
+            logger.info(f"服务停止：{len(queued)} 个排队中的发送任务未开始，已标记为失败")
+        deadline = time.monotonic() + timeout
+        running = self._unfinished()
+        if running:
+            logger.info(f"服务停止：等待 {len(running)} 个发送任务完成（最长 {timeout} 秒）")
+        while running and time.monotonic() < deadline:
+            time.sleep(0.5)
+            running = self._unfinished()
+        if not running:
+            return
+        logger.warning(f"服务停止：{len(running)} 个发送任务未在 {timeout} 秒内完成，取消剩余收件人")
+        for job in running:
+            job.error = DRAIN_CANCEL_MESSAGE
+            job.cancel()
+        cancel_deadline = time.monotonic() + CANCEL_WAIT_SECONDS
+        while running and time.monotonic() < cancel_deadline:
+            time.sleep(0.5)
+            running = self._unfinished()
+        if running:
+            logger.warning(f"服务停止：{len(running)} 个发送任务取消后仍未结束")
+
+    def _unfinished(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status not in FINISHED_STATES]
+
+    def _prune(self):
+        """只保留最近的若干个已结束任务"""
+        finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+        if len(finished) > self.max_finished_jobs:
+            finished.sort(key=lambda j: j.finished_at or j.created_at)
+            for job in finished[:len(finished) - self.max_finished_jobs]:
+                del self._jobs[job.id]
+
+    def _monitor(self):
+        """定期把本进程中未结束任务的进度写入数据库（作为心跳），并执行其他进程发出的取消请求"""
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            jobs = self._unfinished()
+            if not jobs:
+                continue
+            try:
+                cancelled = self.store.cancel_requested([job.id for job in jobs])
+                for job in jobs:
+                    if job.id in cancelled and not job.cancelled:
+                        logger.info(f"任务 {job.id} 收到取消请求")
+                        job.cancel()
+                    job.flush()
+            except Exception as e:
+                logger.error(f"保存发送任务进度失败: {str(e)}")
+
+    @staticmethod
+    def _remove_temp_files(job):
+        for path in job.payload.get('temp_files', ()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除任务 {job.id} 的临时文件失败: {path}: {str(e)}")
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                # 与 drain() 标记排队中的任务互斥，已标记为失败的任务不再开始
+                with self._lock:
+                    if job.status in FINISHED_STATES:
+                        continue
+                    if job.cancelled or self._stopping:
+                        if job.cancelled:
+                            job.status = JOB_CANCELLED
+                        else:
+                            job.status = JOB_FAILED
+                            job.error = NOT_STARTED_MESSAGE
+                        continue
+                    job.status = JOB_RUNNING
+                    job.started_at = time.time()
+                job.flush()
+                self.runner(job)
+                job.status = JOB_CANCELLED if job.cancelled else JOB_COMPLETED
+            except Exception as e:
+                logger.error(f"任务 {job.id} 执行失败: {str(e)}")
+                job.error = str(e)
+                job.status = JOB_FAILED
+            finally:
+                if job.finished_at is None:
+                    job.finished_at = time.time()
+                job.notify()
+                self._remove_temp_files(job)
+                logger.info(f"任务 {job.id} 结束: {job.status}, 成功{job.sent_count} 失败{job.failed_count} 跳过{job.skipped_count}")
+                self._queue.task_done()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+发送记录模块 - 每个群发活动（campaign_id）一个只追加的发送记录文件（JSON Lines），
+每封邮件被服务器接收后立即写入并 fsync；
+服务重启后用同一个 campaign_id 重新发送时，已记录的收件人（邮箱 + 附件）直接跳过，只发送剩余部分；
+多个工作进程中同一活动的任务通过记录文件旁的锁文件依次执行，不会重复发送
+"""
+import os
+import re
+import json
+import time
+import threading
+import logging
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DIR = os.environ.get('SEND_LEDGER_DIR', os.path.join('data', 'ledger'))
+# 等待其他进程释放同一活动的发送记录时，检查任务是否已取消的间隔（秒）
+LOCK_POLL_SECONDS = 1
+
+CAMPAIGN_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def valid_campaign_id(campaign_id):
+    return bool(CAMPAIGN_ID_PATTERN.match(campaign_id or ''))
+
+
+def recipient_key(recipient):
+    """去重键：收件人邮箱 + 个性化附件"""
+    attachments = recipient.get('all_attachments') or [recipient.get('attachment') or '']
+    return '|'.join([recipient['email'].strip().lower()] + sorted(attachments))
+
+
+class SendLedger:
+    """
+    单个活动的发送记录
+    - claim(key) 发送前占用，已发送或正在发送的返回 False（同一任务内重复的行也只发一次）
+    - record(key, entry) 发送成功后追加一行并 fsync
+    - release(key) 发送失败时释放占用，之后可以重试
+    创建前须已持有该活动的进程锁 process_lock，close() 时释放
+    """
+
+    def __init__(self, campaign_id, folder=LEDGER_DIR, process_lock=None):
+        self.campaign_id = campaign_id
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f'{campaign_id}.jsonl')
+        self.process_lock = process_lock
+        self.sent = set()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._refs = 0
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # 写入中途崩溃留下的不完整行，该邮件视为未发送
+                    logger.warning(f"发送记录 {self.path} 末尾有不完整的行，已截断")
+                    break
+                valid_size += len(line)
+                try:
+                    self.sent.add(json.loads(line)['key'])
+                except (ValueError, KeyError):
+                    logger.warning(f"发送记录 {self.path} 中有无法解析的行，已忽略")
+        if valid_size != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+        if self.sent:
+            logger.info(f"活动 {self.campaign_id} 已有 {len(self.sent)} 条发送记录，续发时跳过")
+
+    def claim(self, key):
+        with self._lock:
+            if key in self.sent or key in self._pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._pending.discard(key)
+
+    def record(self, key, entry):
+        line = json.dumps({'key': key, 'sent_at': time.time(), **entry}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.sent.add(key)
+            self._pending.discard(key)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        if self.process_lock is not None:
+            self.process_lock.release()
+            self.process_lock.close()
+
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def _lock_path(folder, campaign_id):
+    return os.path.join(folder, f'{campaign_id}.lock')
+
+
+def _lock_process(campaign_id, folder, cancelled):
+    """
+    取得活动的进程锁：其他进程正在发送同一活动时等待其结束（之后读取的记录包含它已发送的收件人）
+    等待期间 cancelled() 返回 True 时放弃，返回 None
+    """
+    os.makedirs(folder, exist_ok=True)
+    waiting = False
+    while True:
+        lock = FileLock(_lock_path(folder, campaign_id))
+        while not lock.acquire(blocking=False):
+            if not waiting:
+                logger.info(f"活动 {campaign_id} 正在其他进程中发送，等待其结束")
+                waiting = True
+            if cancelled is not None and cancelled():
+                lock.close()
+                return None
+            time.sleep(LOCK_POLL_SECONDS)
+        # 等待期间过期的记录和锁文件被清理时，重新在新的锁文件上加锁
+        if lock.is_current():
+            return lock
+        lock.release()
+        lock.close()
+
+
+def open_ledger(campaign_id, cancelled=None, folder=LEDGER_DIR):
+    """
+    同一活动的多个任务共用一个记录（共享去重状态），用完调用 close_ledger
+    等待其他进程时任务被取消（cancelled() 为 True）返回 None
+    """
+    while True:
+        with _ledgers_lock:
+            ledger = _ledgers.get(campaign_id)
+            if ledger is not None:
+                ledger._refs += 1
+                return ledger
+        # 等待进程锁时不持有 _ledgers_lock，不影响其他活动
+        lock = _lock_process(campaign_id, folder, cancelled)
+        if lock is None:
+            return None
+        with _ledgers_lock:
+            if campaign_id not in _ledgers:
+                try:
+                    ledger = SendLedger(campaign_id, folder, process_lock=lock)
+                except Exception:
+                    lock.release()
+                    lock.close()
+                    raise
+                ledger._refs = 1
+                _ledgers[campaign_id] = ledger
+                return ledger
+        # 等待期间本进程的其他任务已打开该活动的记录，改为共用它
+        lock.release()
+        lock.close()
+
+
+def close_ledger(ledger):
+    with _ledgers_lock:
+        ledger._refs -= 1
+        if ledger._refs <= 0:
+            _ledgers.pop(ledger.campaign_id, None)
+            ledger.close()
+
+
+def prune_ledgers(max_age_seconds, keep=(), folder=LEDGER_DIR):
+    """
+    删除超过 max_age_seconds 秒没有写入的发送记录及其锁文件，返回删除数
+    keep 中的活动（有未结束的任务）、本进程正在使用的和其他进程正在使用（持有锁）的记录不删除
+    """
+    if not os.path.isdir(folder):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for filename in os.listdir(folder):
+        campaign_id, extension = os.path.splitext(filename)
+        if extension != '.jsonl' or campaign_id in keep:
+            continue
+        path = os.path.join(folder, filename)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        with _ledgers_lock:
+            if campaign_id in _ledgers:
+                continue
+            lock = FileLock(_lock_path(folder, campaign_id))
+            if not lock.acquire(blocking=False):
+                lock.close()
+                continue
+            try:
+                if os.path.exists(path) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+                    # 持有锁时删除锁文件：正在等待旧锁文件的进程加锁后会发现文件已删除并重新加锁
+                    try:
+                        os.remove(lock.path)
+                    except OSError:
+                        pass
+            finally:
+                lock.release()
+                lock.close()
+    if removed:
+        logger.info(f"已清理 {removed} 个过期的发送记录")
+    return removed
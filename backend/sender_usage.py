@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+发件账号用量模块 - 记录每个发件账号每天已发送的邮件数（SQLite），用于按每日额度分配收件人
+"""
+import os
+import sqlite3
+import threading
+from datetime import date
+
+USAGE_DB_PATH = os.environ.get('SENDER_USAGE_DB', os.path.join('data', 'sender_usage.db'))
+
+
+class SenderUsage:
+    """每个账号每天的发送量（各线程单独连接）"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sender_usage (
+                    sender_email TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    sent INTEGER NOT NULL,
+                    PRIMARY KEY (sender_email, day)
+                )
+            ''')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def sent_today(self, sender_email):
+        row = self._connect().execute(
+            'SELECT sent FROM sender_usage WHERE sender_email = ? AND day = ?',
+            (sender_email.lower(), date.today().isoformat())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add(self, sender_email, count=1):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO sender_usage (sender_email, day, sent) VALUES (?, ?, ?) '
+                'ON CONFLICT (sender_email, day) DO UPDATE SET sent = sent + excluded.sent',
+                (sender_email.lower(), date.today().isoformat(), count)
+            )
+
+
+_usage = None
+_usage_lock = threading.Lock()
+
+
+def get_sender_usage():
+    global _usage
+    with _usage_lock:
+        if _usage is None:
+            os.makedirs(os.path.dirname(USAGE_DB_PATH) or '.', exist_ok=True)
+            _usage = SenderUsage(USAGE_DB_PATH)
+        return _usage
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+结构化日志模块 - JSON格式日志记录，由后台线程写出（请求线程只把记录放入队列）；
+逐行、逐个收件人的事件通过 EventLog 按级别开关、采样或只在操作结束时输出一条汇总，
+关闭详细日志时热循环中每个事件只有一次计数
+
+环境变量:
+    LOG_LEVEL         日志级别（默认 INFO，DEBUG 时输出逐条事件）
+    LOG_FORMAT        json（默认）或 text
+    LOG_EVENTS        逐条事件的输出方式: summary（默认，只输出汇总）/ sample（采样）/ all（全部）
+    LOG_SAMPLE_FIRST  采样时每种事件先输出的条数（默认10）
+    LOG_SAMPLE_EVERY  之后每多少条输出一条（默认100）
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_EVENTS = os.environ.get('LOG_EVENTS', 'summary').lower()
+SAMPLE_FIRST = int(os.environ.get('LOG_SAMPLE_FIRST', 10))
+SAMPLE_EVERY = max(1, int(os.environ.get('LOG_SAMPLE_EVERY', 100)))
+# 汇总中每种事件保留的示例数
+SUMMARY_EXAMPLES = 5
+
+EVENT_MODES = ('summary', 'sample', 'all')
+
+
+def _fields(record):
+    """记录中的结构化字段（log_event / EventLog 通过 extra 传入）"""
+    fields = {}
+    event = getattr(record, 'event', None)
+    if event:
+        fields['event'] = event
+    fields.update(getattr(record, 'fields', None) or {})
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行JSON：time / level / logger / message / thread，加上事件字段"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for key, value in _fields(record).items():
+            data.setdefault(key, value)
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """本地开发用：普通文本，事件字段以 key=value 附在后面"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _fields(record)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={json.dumps(value, ensure_ascii=False, default=str)}'
+                                   for key, value in fields.items())
+        return text
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    只把记录放入队列，消息拼接和格式化都在写日志的线程中进行
+    （标准 QueueHandler.prepare 会在调用线程中先格式化；同一进程内的队列不需要序列化记录）
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=None, fmt=None):
+    """
+    配置根日志：记录放入队列，由后台线程按 LOG_FORMAT 写到标准错误输出
+    重复调用不会重复添加处理器；进程退出时写完队列中剩余的记录
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        fmt = fmt or LOG_FORMAT
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(DeferredQueueHandler(log_queue))
+        root.setLevel(level or LOG_LEVEL)
+
+        _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台写日志线程（写完队列中的记录）"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def log_event(logger, level, event, message=None, **fields):
+    """输出一条结构化事件，级别未启用时直接返回（不拼接消息、不构造记录）"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message or event, extra={'event': event, 'fields': fields})
+
+
+class EventLog:
+    """
+    一次操作（解析一个工作簿、执行一个发送任务）中的逐条事件
+    - summary: 逐条事件只计数并保留前几条示例，summary() 时输出一条汇总
+    - sample: 每种事件输出前 SAMPLE_FIRST 条，之后每 SAMPLE_EVERY 条输出一条
+    - all: 每条都输出
+    sample / all 模式下逐条事件同样受日志级别控制；汇总按出现过的最高级别输出
+    verbose 为 True 时才值得为逐条事件构造字段（调用方可据此跳过整段循环）
+    """
+
+    def __init__(self, logger, operation, mode=None, **context):
+        self.logger = logger
+        self.operation = operation
+        self.mode = mode if mode in EVENT_MODES else (LOG_EVENTS if LOG_EVENTS in EVENT_MODES else 'summary')
+        self.context = context
+        self.counts = {}
+        self.examples = {}
+        self.suppressed = 0
+        self.level = logging.NOTSET
+        self._lock = threading.Lock()
+
+    def verbose(self, level=logging.DEBUG):
+        """逐条事件是否会被输出（summary 模式只保留示例，不需要逐条构造）"""
+        return self.mode != 'summary' and self.logger.isEnabledFor(level)
+
+    def add(self, event, count, level=logging.INFO):
+        """批量计数（已按列统计好的数量，不逐条输出）"""
+        if count <= 0:
+            return
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + count
+            self.level = max(self.level, level)
+
+    def event(self, event, message=None, level=logging.DEBUG, **fields):
+        with self._lock:
+            count = self.counts.get(event, 0) + 1
+            self.counts[event] = count
+            self.level = max(self.level, level)
+            if self.mode == 'summary':
+                if count <= SUMMARY_EXAMPLES:
+                    self.examples.setdefault(event, []).append(fields)
+                return
+            if self.mode == 'sample' and count > SAMPLE_FIRST and (count - SAMPLE_FIRST) % SAMPLE_EVERY:
+                self.suppressed += 1
+                return
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message or event,
+                            extra={'event': event, 'fields': {**self.context, **fields, 'seq': count}})
+
+    def summary(self, message=None, **fields):
+        """输出本次操作的事件汇总（没有任何事件时不输出）"""
+        with self._lock:
+            if not self.counts:
+                return
+            data = {'operation': self.operation, **self.context, **fields, 'counts': dict(self.counts)}
+            if self.examples:
+                data['examples'] = dict(self.examples)
+            if self.suppressed:
+                data['suppressed'] = self.suppressed
+            level = max(self.level, logging.INFO)
+        if self.logger.isEnabledFor(level):
+            counts = '，'.join(f'{event} {count}' for event, count in data['counts'].items())
+            self.logger.log(level, message or f'{self.operation}: {counts}',
+                            extra={'event': 'summary', 'fields': data})
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# 后端模块直接放在 backend 目录下（与 python app.py 运行时相同的导入方式）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+重写后的解析函数与原来逐行（iterrows）解析的结果一致
+legacy_* 为重写前的实现（去掉日志），附件目录改为参数
+"""
+import os
+import re
+
+import pandas as pd
+import pytest
+
+import excel_handler
+import recipient_parser
+from benchmarks.excel_corpus import attachment_names, generate_workbook
+
+# 原来的解析函数就有的收件人字段（fields 等为后来新增）
+RECIPIENT_KEYS = ('email', 'name', 'department', 'attachment', 'all_attachments')
+EMAIL_PATTERN = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
+
+
+def legacy_parse_custom_excel(filepath, attachment_folder):
+    df = pd.read_excel(filepath, header=0)
+    recipients = []
+    skipped_count = 0
+    for idx, row in df.iterrows():
+        department = str(row.iloc[0]) if pd.notna(row.iloc[0]) else ""
+        dept2 = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ""
+        attachment_path = str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else ""
+        contact_names = str(row.iloc[3]) if len(row) > 3 and pd.notna(row.iloc[3]) else ""
+        contact_emails = str(row.iloc[4]) if len(row) > 4 and pd.notna(row.iloc[4]) else ""
+
+        if not attachment_path or attachment_path == 'nan' or attachment_path.strip() == '':
+            skipped_count += 1
+            continue
+
+        attachments = []
+        if '\\' in attachment_path:
+            for path in re.split(r'[;；]', attachment_path):
+                path = path.strip()
+                if path:
+                    local_path = os.path.join(attachment_folder, path.split('\\')[-1])
+                    if os.path.exists(local_path):
+                        attachments.append(local_path)
+        if not attachments:
+            skipped_count += 1
+            continue
+
+        if not contact_emails or contact_emails == 'nan':
+            skipped_count += 1
+            continue
+        emails = re.findall(EMAIL_PATTERN, str(contact_emails))
+        if not emails:
+            skipped_count += 1
+            continue
+
+        names = []
+        if contact_names and contact_names != 'nan':
+            names = [n.strip() for n in re.split(r'[、，,;；]', contact_names) if n.strip()]
+
+        for i, email in enumerate(emails):
+            recipients.append({
+                'email': email.strip(),
+                'name': names[i] if i < len(names) else email.split('@')[0],
+                'department': f"{department} {dept2}".strip(),
+                'attachment': attachments[0],
+                'all_attachments': attachments
+            })
+    return recipients, skipped_count
+
+
+def legacy_parse_excel_with_attachment_check(filepath):
+    df = pd.read_excel(filepath, header=0)
+    recipients = []
+    skipped = 0
+    for idx, row in df.iterrows():
+        attachment_path = str(row.iloc[2]) if len(row) > 2 and pd.notna(row.iloc[2]) else ""
+        if not attachment_path or attachment_path == 'nan' or attachment_path.strip() == '':
+            skipped += 1
+            continue
+        emails_str = str(row.iloc[4]) if len(row) > 4 and pd.notna(row.iloc[4]) else ""
+        if not emails_str or emails_str == 'nan':
+            skipped += 1
+            continue
+        emails = re.findall(EMAIL_PATTERN, emails_str)
+        if not emails:
+            skipped += 1
+            continue
+        names_str = str(row.iloc[3]) if len(row) > 3 and pd.notna(row.iloc[3]) else ""
+        names = re.split(r'[、，,;；]', names_str) if names_str and names_str != 'nan' else []
+        names = [n.strip() for n in names if n.strip()]
+        filename = attachment_path.split('\\')[-1] if '\\' in attachment_path else attachment_path
+        dept1 = str(row.iloc[0]) if pd.notna(row.iloc[0]) else ""
+        dept2 = str(row.iloc[1]) if len(row) > 1 and pd.notna(row.iloc[1]) else ""
+        for i, email in enumerate(emails):
+            recipients.append({
+                'email': email.strip(),
+                'name': names[i] if i < len(names) else email.split('@')[0],
+                'department': f"{dept1} {dept2}".strip(),
+                'attachment': f'/app/attachments/{filename}'
+            })
+    return recipients, skipped
+
+
+def legacy_keys(recipients):
+    return [{key: r[key] for key in RECIPIENT_KEYS if key in r} for r in recipients]
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    """excel_corpus 生成的两种格式（A~E列文本；带空值的数字列）"""
+    folder = tmp_path_factory.mktemp('corpus')
+    attachment_folder = folder / 'attachments'
+    attachment_folder.mkdir()
+    names = attachment_names(60)
+    for name in names:
+        (attachment_folder / name).write_bytes(name.encode('utf-8'))
+    workbooks = {}
+    for layout in ('text', 'numeric'):
+        path = str(folder / f'{layout}.xlsx')
+        generate_workbook(path, 600, names, seed=7, layout=layout)
+        workbooks[layout] = path
+    return workbooks, str(attachment_folder)
+
+
+@pytest.mark.parametrize('layout', ['text', 'numeric'])
+@pytest.mark.parametrize('streaming', [False, True])
+def test_parse_workbook_matches_legacy(corpus, layout, streaming):
+    workbooks, attachment_folder = corpus
+    expected, expected_skipped = legacy_parse_custom_excel(workbooks[layout], attachment_folder)
+    recipients, skipped, _ = recipient_parser.parse_workbook(
+        workbooks[layout], attachment_folder, set(os.listdir(attachment_folder)), streaming=streaming
+    )
+    assert expected
+    assert skipped == expected_skipped
+    assert legacy_keys(recipients) == expected
+
+
+def test_numeric_departments_match_legacy(corpus):
+    """数字编码列有空值时，原来的结果为 '3.0 101.0'，重写后保持不变"""
+    workbooks, attachment_folder = corpus
+    expected, _ = legacy_parse_custom_excel(workbooks['numeric'], attachment_folder)
+    assert any(re.fullmatch(r'\d+\.0 \d+\.0', r['department']) for r in expected)
+    recipients, _, _ = recipient_parser.parse_workbook(
+        workbooks['numeric'], attachment_folder, set(os.listdir(attachment_folder)), streaming=True
+    )
+    assert [r['department'] for r in recipients] == [r['department'] for r in expected]
+
+
+@pytest.mark.parametrize('layout', ['text', 'numeric'])
+def test_attachment_check_matches_legacy(corpus, layout):
+    workbooks, _ = corpus
+    expected, expected_skipped = legacy_parse_excel_with_attachment_check(workbooks[layout])
+    result = excel_handler.parse_excel_with_attachment_check(workbooks[layout])
+    assert result['success']
+    assert result['skipped'] == expected_skipped
+    assert result['recipients'] == expected
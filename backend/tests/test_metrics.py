@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""运行指标：多个工作进程的汇总"""
+import json
+import os
+import subprocess
+import sys
+
+import metrics
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def make_registry():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter('mailer_test_total', '测试计数', ['status']))
+    histogram = registry.register(metrics.Histogram('mailer_test_seconds', '测试耗时', buckets=(1, 5)))
+    latest = registry.register(metrics.Gauge('mailer_test_speed', '测试速度', aggregate=metrics.LATEST))
+    live = registry.register(metrics.Gauge('mailer_test_bytes', '测试占用'))
+    local = registry.register(metrics.Gauge('mailer_test_depth', '测试队列', aggregate=metrics.LOCAL))
+    return registry, counter, histogram, latest, live, local
+
+
+def write_snapshot(directory, pid, data):
+    with open(os.path.join(directory, f'{pid}.json'), 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_render_sums_all_processes(tmp_path):
+    directory = str(tmp_path)
+    dead = exited_pid()
+    write_snapshot(directory, os.getppid(), {
+        'mailer_test_total': [[['success'], 3]],
+        'mailer_test_seconds': [[[], [[1, 1, 0], 4.0, 2]]],
+        'mailer_test_speed': [[[], 50, 2000000000.0]],
+        'mailer_test_bytes': [[[], 100]],
+        'mailer_test_depth': [[[], 99]]
+    })
+    registry, counter, histogram, latest, live, local = make_registry()
+    registry.enable_multiprocess(directory, interval=3600)
+    write_snapshot(directory, dead, {'mailer_test_total': [[['success'], 2], [['failed'], 1]],
+                                     'mailer_test_bytes': [[[], 1000]]})
+    counter.inc(status='success')
+    histogram.observe(0.5)
+    latest.set(10)
+    live.set(7)
+    local.set_function(lambda: 4)
+
+    text = registry.render()
+    assert 'mailer_test_total{status="success"} 6' in text
+    assert 'mailer_test_total{status="failed"} 1' in text
+    assert 'mailer_test_seconds_bucket{le="1"} 2' in text
+    assert 'mailer_test_seconds_count 3' in text
+    assert 'mailer_test_speed 50' in text
+    assert 'mailer_test_bytes 107' in text
+    assert 'mailer_test_depth 4' in text
+
+
+def test_dead_processes_are_archived(tmp_path):
+    directory = str(tmp_path)
+    dead = exited_pid()
+    write_snapshot(directory, dead, {'mailer_test_total': [[['success'], 2]], 'mailer_test_bytes': [[[], 1000]]})
+    registry, counter, _, _, _, _ = make_registry()
+    registry.enable_multiprocess(directory, interval=3600)
+
+    assert not os.path.exists(os.path.join(directory, f'{dead}.json'))
+    counter.inc(status='success')
+    text = registry.render()
+    assert 'mailer_test_total{status="success"} 3' in text
+    assert 'mailer_test_bytes 0' not in text and 'mailer_test_bytes 1000' not in text
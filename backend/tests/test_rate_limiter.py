@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""SMTP回复码分类：限流（降速后重试）、连接关闭（重连后重试）、永久错误（不重试、不换账号）；多进程共用的令牌桶"""
+import time
+import smtplib
+
+import pytest
+
+import rate_limiter
+from rate_limiter import AdaptiveRateLimiter, RateLimitStore, is_throttle_error
+from email_sender import _is_connection_error, _is_message_error, _is_recipient_error
+
+
+@pytest.mark.parametrize('error, throttle', [
+    (smtplib.SMTPDataError(450, b'4.7.1 Too many messages, slow down'), True),
+    (smtplib.SMTPDataError(451, b'4.3.2 rate limited'), True),
+    (smtplib.SMTPSenderRefused(452, b'too many recipients', 'a@example.cn'), True),
+    (smtplib.SMTPDataError(550, b'Ip frequency limited'), True),
+    (smtplib.SMTPDataError(554, '发送频繁，请稍后再试'.encode('utf-8')), True),
+    # 单连接发送数达到上限：重连即可，不降速
+    (smtplib.SMTPDataError(421, b'too many messages on this connection'), False),
+    # 永久错误
+    (smtplib.SMTPDataError(554, b'5.7.1 message rejected as spam'), False),
+    (smtplib.SMTPDataError(550, b'5.2.2 mailbox size limit exceeded'), False),
+    (smtplib.SMTPDataError(550, b'5.1.1 user unknown'), False),
+    (smtplib.SMTPRecipientsRefused({'a@example.cn': (550, b'mailbox unavailable')}), False),
+    (smtplib.SMTPRecipientsRefused({'a@example.cn': (450, b'try again later')}), True),
+])
+def test_is_throttle_error(error, throttle):
+    assert is_throttle_error(error) is throttle
+
+
+def test_421_is_a_connection_error():
+    assert _is_connection_error(smtplib.SMTPDataError(421, b'closing connection'))
+    refused = smtplib.SMTPRecipientsRefused({'a@example.cn': (421, b'too many messages on this connection')})
+    assert _is_connection_error(refused)
+    assert not _is_recipient_error(refused)
+
+
+def test_unknown_recipient_is_permanent():
+    refused = smtplib.SMTPRecipientsRefused({'a@example.cn': (550, b'user unknown')})
+    assert _is_recipient_error(refused)
+    assert not _is_connection_error(refused)
+
+
+@pytest.mark.parametrize('error, permanent', [
+    (smtplib.SMTPDataError(552, b'5.3.4 message size exceeds fixed limit'), True),
+    (smtplib.SMTPDataError(554, b'5.7.1 message rejected as spam'), True),
+    # 限流、连接关闭、账号问题：换账号或稍后重试
+    (smtplib.SMTPDataError(554, '发送频繁，请稍后再试'.encode('utf-8')), False),
+    (smtplib.SMTPDataError(421, b'closing connection'), False),
+    (smtplib.SMTPDataError(451, b'local error in processing'), False),
+    (smtplib.SMTPSenderRefused(553, b'sender address rejected', 'a@example.cn'), False),
+    (smtplib.SMTPAuthenticationError(535, b'authentication failed'), False),
+    (smtplib.SMTPRecipientsRefused({'a@example.cn': (550, b'user unknown')}), False),
+])
+def test_rejected_message_is_not_retried_on_other_accounts(error, permanent):
+    assert _is_message_error(error) is permanent
+
+
+def test_limiters_share_tokens_through_store(tmp_path):
+    """两个进程中同一账号的限速器（这里用两个对象模拟）共用一个令牌桶"""
+    store = RateLimitStore(str(tmp_path / 'rate_limits.db'))
+    first = AdaptiveRateLimiter(10, name='a@example.cn', store=store)
+    second = AdaptiveRateLimiter(10, name='a@example.cn', store=RateLimitStore(store.db_path))
+    start = time.monotonic()
+    first.acquire()
+    second.acquire()
+    first.acquire()
+    assert time.monotonic() - start >= 0.18
+
+
+def test_throttle_pauses_every_process(tmp_path, monkeypatch):
+    store = RateLimitStore(str(tmp_path / 'rate_limits.db'))
+    first = AdaptiveRateLimiter(10, name='a@example.cn', store=store)
+    second = AdaptiveRateLimiter(10, name='a@example.cn', store=store)
+    monkeypatch.setattr(rate_limiter, 'BASE_PAUSE_SECONDS', 0.2)
+    assert first.on_throttle('450') == 0.2
+    assert second.stats() == {'rate': 5.0, 'max_rate': 10, 'throttle_count': 1}
+    start = time.monotonic()
+    second.acquire()
+    assert time.monotonic() - start >= 0.15
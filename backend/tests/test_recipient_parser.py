@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""收件人解析：流式读取与一次性读取（pd.read_excel）结果一致"""
+import pytest
+from openpyxl import Workbook
+
+import recipient_parser
+
+HEADER = ['前级', '部门', '附件位置', '奖金联系人', '奖金标题', '工号']
+ATTACHMENT = 'D:\\AutoEmail\\附件\\分配表.xlsx'
+
+
+def write_workbook(path, rows, header=HEADER):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def attachment_folder(tmp_path):
+    folder = tmp_path / 'attachments'
+    folder.mkdir()
+    (folder / '分配表.xlsx').write_bytes(b'x')
+    return str(folder)
+
+
+def parse(filepath, attachment_folder, streaming):
+    stats = {}
+    recipients, skipped, fields = recipient_parser.parse_workbook(
+        filepath, attachment_folder, {'分配表.xlsx'}, streaming=streaming, stats=stats
+    )
+    return recipients, skipped, fields, stats
+
+
+def test_numeric_column_with_blanks_matches_eager(tmp_path, attachment_folder):
+    """有空值的整数列在 pandas 中整列转为小数：'1.0 x'，流式读取必须得到相同结果"""
+    filepath = write_workbook(tmp_path / 'numeric.xlsx', [
+        [1, 'x', ATTACHMENT, '张三', 'a@example.cn', 1001],
+        [None, 'y', ATTACHMENT, '李四', 'b@example.cn', None],
+        [3, None, ATTACHMENT, '王五', 'c@example.cn', 1003],
+    ])
+    eager = parse(filepath, attachment_folder, streaming=False)
+    streamed = parse(filepath, attachment_folder, streaming=True)
+
+    assert [r['department'] for r in eager[0]] == ['1.0 x', 'y', '3.0']
+    assert [r['fields']['工号'] for r in eager[0]] == ['1001.0', '', '1003.0']
+    assert streamed[:3] == eager[:3]
+
+
+def test_auto_streaming_matches_eager(tmp_path, attachment_folder, monkeypatch):
+    """超过大小阈值自动改为流式读取时，结果与文件大小无关"""
+    rows = [[i if i % 7 else None, f'部门{i % 3}', ATTACHMENT, f'联系人{i}', f'user{i}@example.cn', i]
+            for i in range(1, 40)]
+    filepath = write_workbook(tmp_path / 'auto.xlsx', rows)
+    eager = parse(filepath, attachment_folder, streaming=False)
+
+    monkeypatch.setattr(recipient_parser, 'STREAM_THRESHOLD_BYTES', 0)
+    monkeypatch.setattr(recipient_parser, 'STREAM_CHUNK_ROWS', 5)
+    auto = parse(filepath, attachment_folder, streaming=None)
+    assert auto[:3] == eager[:3]
+
+
+def test_streaming_used_when_columns_are_compatible(tmp_path, attachment_folder, monkeypatch):
+    """没有需要整列转换的列时使用流式读取，结果同样一致（整数列、文本与数字混合的列保持原值）"""
+    rows = [[f'分公司{i}' if i % 4 else 123, '市场部', ATTACHMENT, f'联系人{i}', f'user{i}@example.cn', i]
+            for i in range(1, 30)]
+    filepath = write_workbook(tmp_path / 'text.xlsx', rows)
+    monkeypatch.setattr(recipient_parser, 'STREAM_CHUNK_ROWS', 4)
+    eager = parse(filepath, attachment_folder, streaming=False)
+    streamed = parse(filepath, attachment_folder, streaming=True)
+
+    assert streamed[3]['mode'] == 'streaming'
+    assert streamed[:3] == eager[:3]
+
+
+def test_iter_workbook_reports_inexact_columns(tmp_path, attachment_folder):
+    filepath = write_workbook(tmp_path / 'numeric.xlsx', [
+        [1, 'x', ATTACHMENT, '张三', 'a@example.cn', 1001],
+        [None, 'y', ATTACHMENT, '李四', 'b@example.cn', 1002],
+    ])
+    stats = {}
+    list(recipient_parser.iter_workbook(filepath, attachment_folder, {'分配表.xlsx'}, stats))
+    assert stats['inexact_columns'] == ['前级']
+
+
+@pytest.mark.parametrize('kinds, compatible', [
+    ({'int'}, True),
+    ({'float'}, True),
+    ({'text', 'null'}, True),
+    ({'text', 'int', 'null'}, True),
+    ({'other', 'null'}, True),
+    ({'int', 'null'}, False),
+    ({'int', 'float'}, False),
+    ({'bool', 'null'}, False),
+    ({'numeric_text'}, False),
+])
+def test_pandas_compatible(kinds, compatible):
+    assert recipient_parser.pandas_compatible(kinds) is compatible
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""发送任务队列：任务结束后删除临时文件、正在使用的收件人列表不被清理、停止服务"""
+import threading
+import time
+
+from recipient_store import RecipientStore
+from send_jobs import (SendJobQueue, SendJobStore, JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED,
+                       DRAIN_CANCEL_MESSAGE, NOT_STARTED_MESSAGE)
+
+
+def test_temp_files_removed_when_job_finishes(tmp_path):
+    workbook = tmp_path / 'upload.xlsx'
+    workbook.write_bytes(b'x')
+    queue = SendJobQueue(lambda job: None, workers=1)
+    job = queue.submit({'recipients': [], 'temp_files': [str(workbook)]})
+    queue._queue.join()
+    assert job.status == JOB_COMPLETED
+    assert not workbook.exists()
+
+
+def test_temp_files_removed_when_queued_job_is_cancelled(tmp_path):
+    workbook = tmp_path / 'upload.xlsx'
+    workbook.write_bytes(b'x')
+    release = threading.Event()
+    queue = SendJobQueue(lambda job: release.wait(5), workers=1)
+    running = queue.submit({'recipients': []})
+    queued = queue.submit({'recipients': [], 'temp_files': [str(workbook)]})
+    queue.cancel(queued.id)
+    release.set()
+    queue._queue.join()
+    assert running.status == JOB_COMPLETED
+    assert queued.status == JOB_CANCELLED
+    assert not workbook.exists()
+
+
+def test_lists_of_unfinished_jobs_are_kept(tmp_path):
+    recipients = RecipientStore(str(tmp_path / 'recipients.db'))
+    list_id = recipients.save([{'email': 'a@example.cn'}])
+    queued_list = recipients.save([{'email': 'b@example.cn'}])
+    recipients.ttl_seconds = 0
+    release = threading.Event()
+    store = SendJobStore(str(tmp_path / 'send_jobs.db'))
+    queue = SendJobQueue(lambda job: release.wait(5), workers=1, store=store)
+    queue.submit({'recipients': recipients.get(list_id), 'list_id': list_id})
+    queue.submit({'recipients': recipients.get(queued_list), 'list_id': queued_list})
+    # 其他工作进程只能从数据库看到这些任务
+    assert store.active_list_ids() == {list_id, queued_list}
+    assert queue.active_list_ids() == {list_id, queued_list}
+
+    time.sleep(0.01)
+    assert recipients.prune(keep=queue.active_list_ids()) == 0
+    assert recipients.get(list_id) is not None and recipients.get(queued_list) is not None
+
+    release.set()
+    queue._queue.join()
+    assert queue.active_list_ids() == set()
+    assert recipients.prune(keep=queue.active_list_ids()) == 2
+
+
+def test_drain_fails_queued_jobs_and_waits_for_running():
+    started = threading.Event()
+    release = threading.Event()
+
+    def runner(job):
+        started.set()
+        release.wait(5)
+
+    queue = SendJobQueue(runner, workers=1)
+    running = queue.submit({'recipients': []})
+    assert started.wait(5)
+    queued = queue.submit({'recipients': []})
+    drain = threading.Thread(target=queue.drain, args=(5,))
+    drain.start()
+    # 排队中的任务在停止开始时就标记为失败，而不是等到超时
+    deadline = time.monotonic() + 5
+    while queued.status != JOB_FAILED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queued.status == JOB_FAILED
+    assert queued.error == NOT_STARTED_MESSAGE
+
+    release.set()
+    drain.join(5)
+    queue._queue.join()
+    assert running.status == JOB_COMPLETED and running.error is None
+    assert queued.status == JOB_FAILED and queued.error == NOT_STARTED_MESSAGE
+
+
+def test_drain_timeout_cancels_running_job():
+    started = threading.Event()
+    finished = []
+
+    def runner(job):
+        started.set()
+        job.wait_cancelled(10)
+        finished.append(job.status)
+
+    queue = SendJobQueue(runner, workers=1)
+    job = queue.submit({'recipients': []})
+    assert started.wait(5)
+    queue.drain(0)
+    queue._queue.join()
+    # 结束状态由工作线程写入，停止时的说明不会被清空
+    assert finished == ['running']
+    assert job.status == JOB_CANCELLED
+    assert job.error == DRAIN_CANCEL_MESSAGE
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""发送记录：用同一活动ID重新发送时跳过已发送的收件人、过期清理"""
+import os
+import time
+
+import send_ledger
+
+
+def recipient(email, attachment='attachments/分配表.xlsx'):
+    return {'email': email, 'attachment': attachment, 'all_attachments': [attachment]}
+
+
+def test_resend_skips_recorded_recipients(tmp_path):
+    folder = str(tmp_path)
+    sent = send_ledger.recipient_key(recipient('a@example.cn'))
+    failed = send_ledger.recipient_key(recipient('b@example.cn'))
+    ledger = send_ledger.open_ledger('campaign', folder=folder)
+    assert ledger.claim(sent) and ledger.claim(failed)
+    # 同一任务中重复的行在发送期间也只发一次
+    assert not ledger.claim(sent)
+    ledger.record(sent, {'email': 'a@example.cn'})
+    ledger.release(failed)
+    send_ledger.close_ledger(ledger)
+
+    ledger = send_ledger.open_ledger('campaign', folder=folder)
+    try:
+        # 邮箱大小写不同也视为同一收件人；附件不同则是另一封邮件
+        assert not ledger.claim(send_ledger.recipient_key(recipient('A@Example.cn')))
+        assert ledger.claim(failed)
+        assert ledger.claim(send_ledger.recipient_key(recipient('a@example.cn', 'attachments/其他.xlsx')))
+    finally:
+        send_ledger.close_ledger(ledger)
+
+
+def test_incomplete_last_line_counts_as_unsent(tmp_path):
+    folder = str(tmp_path)
+    first = send_ledger.recipient_key(recipient('a@example.cn'))
+    second = send_ledger.recipient_key(recipient('b@example.cn'))
+    ledger = send_ledger.open_ledger('crashed', folder=folder)
+    ledger.claim(first)
+    ledger.record(first, {'email': 'a@example.cn'})
+    send_ledger.close_ledger(ledger)
+    with open(os.path.join(folder, 'crashed.jsonl'), 'a', encoding='utf-8') as f:
+        f.write('{"key": "' + second)
+
+    ledger = send_ledger.open_ledger('crashed', folder=folder)
+    try:
+        assert not ledger.claim(first)
+        assert ledger.claim(second)
+    finally:
+        send_ledger.close_ledger(ledger)
+
+
+def test_prune_removes_expired_ledgers(tmp_path):
+    folder = str(tmp_path)
+    for campaign_id in ('old', 'active', 'recent'):
+        ledger = send_ledger.open_ledger(campaign_id, folder=folder)
+        ledger.record(campaign_id, {'email': f'{campaign_id}@example.cn'})
+        send_ledger.close_ledger(ledger)
+    expired = time.time() - 3600
+    for campaign_id in ('old', 'active'):
+        os.utime(os.path.join(folder, f'{campaign_id}.jsonl'), (expired, expired))
+
+    assert send_ledger.prune_ledgers(600, keep={'active'}, folder=folder) == 1
+    assert sorted(os.listdir(folder)) == ['active.jsonl', 'active.lock', 'recent.jsonl', 'recent.lock']
+
+
+def test_prune_skips_ledgers_in_use(tmp_path):
+    folder = str(tmp_path)
+    ledger = send_ledger.open_ledger('busy', folder=folder)
+    expired = time.time() - 3600
+    os.utime(ledger.path, (expired, expired))
+    try:
+        assert send_ledger.prune_ledgers(600, folder=folder) == 0
+    finally:
+        send_ledger.close_ledger(ledger)
+    assert send_ledger.prune_ledgers(600, folder=folder) == 1
+    assert os.listdir(folder) == []
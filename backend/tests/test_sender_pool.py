@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""发件账号池：所有账号暂停时等待恢复，任务取消后立即停止等待"""
+import threading
+import time
+
+from email_sender import SenderPool
+from send_jobs import SendJob
+from sender_usage import SenderUsage
+
+
+def make_pool(tmp_path):
+    usage = SenderUsage(str(tmp_path / 'usage.db'))
+    config = {'smtp_host': '127.0.0.1', 'smtp_port': 2525, 'sender_email': 'a@example.cn', 'password': 'x'}
+    return SenderPool([config], usage=usage)
+
+
+def test_acquire_stops_waiting_when_job_cancelled(tmp_path):
+    senders = make_pool(tmp_path)
+    senders.accounts[0].cooldown_until = time.monotonic() + 60
+    job = SendJob({'recipients': []})
+    threading.Timer(0.2, job.cancel).start()
+
+    start = time.monotonic()
+    assert senders.acquire(wait_cancelled=job.wait_cancelled) is None
+    assert time.monotonic() - start < 5
+
+
+def test_acquire_waits_for_cooldown(tmp_path):
+    senders = make_pool(tmp_path)
+    account = senders.accounts[0]
+    account.cooldown_until = time.monotonic() + 0.2
+    job = SendJob({'recipients': []})
+
+    assert senders.acquire(wait_cancelled=job.wait_cancelled) is account
+    assert account.in_flight == 1
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""分块上传：合并时的并发提交"""
+import io
+import os
+import threading
+
+import pytest
+
+from attachment_index import AttachmentIndex
+from attachment_store import AttachmentStore
+from upload_sessions import UploadSessions, UploadError
+
+
+@pytest.fixture
+def sessions(tmp_path):
+    folder = str(tmp_path / 'attachments')
+    os.makedirs(folder)
+    index = AttachmentIndex(folder, str(tmp_path / 'index.db'))
+    return UploadSessions(str(tmp_path / 'uploads.db'), AttachmentStore(folder, index))
+
+
+def upload(sessions, data, chunk_size=4):
+    status = sessions.create('合同.pdf', len(data), chunk_size)
+    for index in range(status['total_chunks']):
+        sessions.write_chunk(status['upload_id'], index, io.BytesIO(data[index * chunk_size:(index + 1) * chunk_size]))
+    return status['upload_id']
+
+
+def test_complete_twice_commits_once(sessions, monkeypatch):
+    upload_id = upload(sessions, b'0123456789')
+    entered = threading.Event()
+    release = threading.Event()
+    commit = sessions.store.commit
+    commits = []
+
+    def slow_commit(*args):
+        commits.append(args)
+        entered.set()
+        release.wait(5)
+        return commit(*args)
+
+    monkeypatch.setattr(sessions.store, 'commit', slow_commit)
+    results = []
+    first = threading.Thread(target=lambda: results.append(sessions.complete(upload_id)))
+    first.start()
+    assert entered.wait(5)
+    with pytest.raises(UploadError):
+        sessions.complete(upload_id)
+    with pytest.raises(UploadError):
+        sessions.write_chunk(upload_id, 0, io.BytesIO(b'0123'))
+    with pytest.raises(UploadError):
+        sessions.delete(upload_id)
+    release.set()
+    first.join(5)
+
+    assert len(commits) == 1
+    assert results[0]['name'] == '合同.pdf'
+    assert sessions.complete(upload_id) is None
+
+
+def test_failed_commit_reopens_session(sessions, monkeypatch):
+    upload_id = upload(sessions, b'0123456789')
+    commit = sessions.store.commit
+
+    def failing_commit(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(sessions.store, 'commit', failing_commit)
+    with pytest.raises(OSError):
+        sessions.complete(upload_id)
+
+    monkeypatch.setattr(sessions.store, 'commit', commit)
+    assert sessions.complete(upload_id)['name'] == '合同.pdf'
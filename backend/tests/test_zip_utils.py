@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""压缩包解压：不安全成员、重名文件"""
+import io
+import os
+import zipfile
+
+import zip_utils
+
+
+def make_zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    buf.seek(0)
+    return zipfile.ZipFile(buf)
+
+
+def test_plan_renames_duplicate_basenames():
+    zf = make_zip([('a/合同.pdf', b'a'), ('b/合同.pdf', b'b'), ('合同 (2).pdf', b'c'), ('c/合同.pdf', b'd')])
+    members, rejected = zip_utils.plan_extraction(zf)
+    assert rejected == []
+    assert [name for _, name in members] == ['合同.pdf', '合同 (2).pdf', '合同 (2) (2).pdf', '合同 (3).pdf']
+
+
+def test_plan_rejects_unsafe_members():
+    zf = make_zip([('../evil.pdf', b'x'), ('/etc/passwd', b'x'), ('ok.pdf', b'x'), ('__MACOSX/._ok.pdf', b'x')])
+    members, rejected = zip_utils.plan_extraction(zf)
+    assert [name for _, name in members] == ['ok.pdf']
+    assert rejected == ['../evil.pdf', '/etc/passwd']
+
+
+def test_extract_keeps_every_duplicate(tmp_path):
+    zf = make_zip([('a/合同.pdf', b'a'), ('b/合同.pdf', b'b')])
+    progress = zip_utils.ExtractProgress()
+    result = zip_utils.extract_zip(zf, str(tmp_path), progress=progress)
+    assert sorted(result['files']) == ['合同 (2).pdf', '合同.pdf']
+    assert sorted(os.listdir(tmp_path)) == ['合同 (2).pdf', '合同.pdf']
+    assert progress.total_files == progress.done_files == 2
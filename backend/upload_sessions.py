@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+分块上传模块 - 大附件分成固定大小的块上传，每块单独校验SHA256并直接写入临时文件中对应的位置，
+已收到的块记录在SQLite中：连接中断后查询已收到的块即可续传，多个块可以并行上传；
+全部收到后校验整个文件并存入附件存储
+"""
+import os
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+import logging
+
+from attachment_index import file_sha256
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# 单块上限需小于 nginx 的 client_max_body_size
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_MB', 10 * 1024)) * 1024 * 1024
+# 上传会话保留时间（小时），超时未完成的会话在创建新会话时清理
+SESSION_TTL_HOURS = float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+READ_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """上传请求无效（块序号/大小/校验和不对等），返回400"""
+
+
+class UploadSessions:
+    """分块上传会话（SQLite，每个线程单独连接），临时文件放在附件存储的临时目录中"""
+
+    def __init__(self, db_path, store, ttl_hours=SESSION_TTL_HOURS):
+        self.db_path = db_path
+        self.store = store
+        self.ttl_seconds = ttl_hours * 3600
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    id TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    sha256 TEXT,
+                    tmp_path TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'open'
+                )
+            ''')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(upload_sessions)')]
+            if 'state' not in columns:
+                conn.execute("ALTER TABLE upload_sessions ADD COLUMN state TEXT NOT NULL DEFAULT 'open'")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_chunks (
+                    upload_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    PRIMARY KEY (upload_id, idx)
+                )
+            ''')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def chunk_count(size, chunk_size):
+        return max(1, -(-size // chunk_size))
+
+    def create(self, filename, size, chunk_size=None, sha256=None):
+        """创建上传会话并预分配临时文件，返回会话状态"""
+        chunk_size = int(chunk_size or DEFAULT_CHUNK_SIZE)
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError(f'块大小必须在 1 到 {MAX_CHUNK_SIZE} 字节之间')
+        if not 0 <= size <= MAX_FILE_SIZE:
+            raise UploadError(f'文件大小超过上限 {MAX_FILE_SIZE // (1024 * 1024)}MB')
+        self.prune()
+
+        upload_id = uuid.uuid4().hex
+        tmp_path = self.store.temp_path()
+        with open(tmp_path, 'wb') as f:
+            f.truncate(size)
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO upload_sessions (id, filename, size, chunk_size, sha256, tmp_path, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (upload_id, filename, size, chunk_size, sha256, tmp_path, now, now)
+            )
+        logger.info(f"分块上传 {upload_id} 已创建: {filename}, {size} 字节, 块大小 {chunk_size}")
+        return self.status(upload_id)
+
+    def _session(self, upload_id):
+        row = self._connect().execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    def status(self, upload_id):
+        """会话状态，received 为已收到的块序号（续传时跳过），不存在时返回 None"""
+        session = self._session(upload_id)
+        if session is None:
+            return None
+        received = [row['idx'] for row in self._connect().execute(
+            'SELECT idx FROM upload_chunks WHERE upload_id = ? ORDER BY idx', (upload_id,)
+        )]
+        total_chunks = self.chunk_count(session['size'], session['chunk_size'])
+        return {
+            'upload_id': upload_id,
+            'filename': session['filename'],
+            'size': session['size'],
+            'chunk_size': session['chunk_size'],
+            'total_chunks': total_chunks,
+            'received': received,
+            'complete': len(received) == total_chunks
+        }
+
+    def write_chunk(self, upload_id, index, stream, expected_sha256=None):
+        """
+        从请求流中读取一块写入临时文件的对应位置（不在内存中缓存整块），
+        长度必须与该块应有的长度一致；提供了 expected_sha256 时校验
+        """
+        session = self._session(upload_id)
+        if session is None:
+            return None
+        if session['state'] != 'open':
+            raise UploadError('上传正在合并，不能再上传块')
+        total_chunks = self.chunk_count(session['size'], session['chunk_size'])
+        if not 0 <= index < total_chunks:
+            raise UploadError(f'块序号 {index} 超出范围（共 {total_chunks} 块）')
+        offset = index * session['chunk_size']
+        expected_size = min(session['chunk_size'], session['size'] - offset)
+
+        digest = hashlib.sha256()
+        written = 0
+        with open(session['tmp_path'], 'r+b') as f:
+            f.seek(offset)
+            while written <= expected_size:
+                data = stream.read(min(READ_SIZE, expected_size + 1 - written))
+                if not data:
+                    break
+                if written + len(data) > expected_size:
+                    raise UploadError(f'块 {index} 超出应有的长度 {expected_size}')
+                f.write(data)
+                digest.update(data)
+                written += len(data)
+            if written != expected_size:
+                raise UploadError(f'块 {index} 长度为 {written}，应为 {expected_size}')
+            f.flush()
+            os.fsync(f.fileno())
+
+        chunk_sha256 = digest.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != chunk_sha256:
+            raise UploadError(f'块 {index} 校验和不一致')
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO upload_chunks (upload_id, idx, size, sha256) VALUES (?, ?, ?, ?)',
+                (upload_id, index, written, chunk_sha256)
+            )
+            conn.execute('UPDATE upload_sessions SET updated_at = ? WHERE id = ?', (time.time(), upload_id))
+        return {'upload_id': upload_id, 'index': index, 'size': written, 'sha256': chunk_sha256}
+
+    def complete(self, upload_id):
+        """
+        所有块都已收到时校验整个文件并存入附件存储，返回附件索引条目；
+        会话不存在时返回 None，缺少块、校验失败或正在被另一个请求合并时抛出 UploadError
+        合并前先把会话从 open 原子地改为 completing：重复提交（包括其他工作进程）只有一个请求能合并，
+        合并期间不再接受块；合并出错时恢复为 open，可以重试
+        """
+        status = self.status(upload_id)
+        if status is None:
+            return None
+        if not status['complete']:
+            missing = sorted(set(range(status['total_chunks'])) - set(status['received']))
+            raise UploadError(f'还有 {len(missing)} 块未上传: {missing[:20]}')
+        if not self._set_state(upload_id, 'open', 'completing'):
+            if self._session(upload_id) is None:
+                return None
+            raise UploadError('上传正在合并中，请勿重复提交')
+
+        session = self._session(upload_id)
+        try:
+            sha256 = file_sha256(session['tmp_path'])
+            if session['sha256'] and session['sha256'].lower() != sha256:
+                self._remove(session)
+                raise UploadError('文件校验和不一致，请重新上传')
+            entry = self.store.commit(session['tmp_path'], session['filename'], sha256)
+        except UploadError:
+            raise
+        except Exception:
+            self._set_state(upload_id, 'completing', 'open')
+            raise
+        self._delete_rows(upload_id)
+        logger.info(f"分块上传 {upload_id} 完成: {session['filename']}")
+        return entry
+
+    def _set_state(self, upload_id, expected, state):
+        """会话状态为 expected 时改为 state，返回是否修改成功"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                'UPDATE upload_sessions SET state = ?, updated_at = ? WHERE id = ? AND state = ?',
+                (state, time.time(), upload_id, expected)
+            )
+        return cursor.rowcount == 1
+
+    def _delete_rows(self, upload_id):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM upload_chunks WHERE upload_id = ?', (upload_id,))
+            conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+
+    def _remove(self, session):
+        self._delete_rows(session['id'])
+        if os.path.exists(session['tmp_path']):
+            os.remove(session['tmp_path'])
+
+    def delete(self, upload_id):
+        """取消上传，删除临时文件（正在合并的会话不能取消）"""
+        session = self._session(upload_id)
+        if session is None:
+            return False
+        if session['state'] != 'open':
+            raise UploadError('上传正在合并，不能取消')
+        self._remove(session)
+        return True
+
+    def prune(self):
+        """删除超时未完成的会话"""
+        cutoff = time.time() - self.ttl_seconds
+        expired = [dict(row) for row in self._connect().execute(
+            'SELECT * FROM upload_sessions WHERE updated_at < ?', (cutoff,)
+        )]
+        for session in expired:
+            self._remove(session)
+        if expired:
+            logger.info(f"已清理 {len(expired)} 个超时的分块上传")
+        return len(expired)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_upload_sessions(db_path, store):
+    """同一进程内同一数据库共用一个会话管理"""
+    key = os.path.abspath(db_path)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = UploadSessions(db_path, store)
+        return _sessions[key]
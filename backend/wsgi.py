@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+生产环境入口 - 由 gunicorn 加载（配置见 gunicorn.conf.py）:
+    gunicorn -c gunicorn.conf.py wsgi:app
+本地开发仍可直接运行 python app.py（单进程开发服务器）
+"""
+from app import app  # noqa: F401
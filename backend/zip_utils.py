@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+ZIP工具模块 - 成员文件名解码（Windows压缩的中文文件名通常为GBK编码），
+以及附件ZIP包的安全解压：逐个成员边读边写，大文件多线程并行解压，
+防止路径穿越和压缩炸弹，解压过程中可查询进度
+"""
+import os
+import stat
+import time
+import uuid
+import hashlib
+import posixpath
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 压缩包限制：成员数、解压后总大小、单个成员的压缩比
+MAX_MEMBERS = int(os.environ.get('ZIP_MAX_MEMBERS', 20000))
+MAX_TOTAL_BYTES = int(os.environ.get('ZIP_MAX_TOTAL_MB', 20 * 1024)) * 1024 * 1024
+MAX_COMPRESSION_RATIO = 200
+# 小于该大小的成员不检查压缩比（文本文件压缩比本来就高）
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+# 超过该大小的成员在线程池中并行解压（zlib解压时释放GIL）
+PARALLEL_MEMBER_BYTES = 8 * 1024 * 1024
+EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# ZIP通用标志位：文件名为UTF-8编码
+UTF8_FLAG = 0x800
+
+
+def decode_member_name(info):
+    """
+    成员文件名：未设置UTF-8标志时 zipfile 按 cp437 解码，
+    Windows自带压缩工具生成的中文文件名实际是GBK，需要重新解码
+    """
+    name = info.filename
+    if not info.flag_bits & UTF8_FLAG:
+        try:
+            name = name.encode('cp437').decode('gbk')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name.replace('\\', '/')
+
+
+def member_basename(name):
+    return posixpath.basename(name.rstrip('/'))
+
+
+def is_hidden_member(name):
+    """macOS压缩包中的 __MACOSX/ 和 ._ 开头的资源文件"""
+    return name.startswith('__MACOSX/') or member_basename(name).startswith('._')
+
+
+class UnsafeZipError(ValueError):
+    """压缩包超出限制（疑似压缩炸弹）"""
+
+
+def safe_member_name(name):
+    """
+    解压后的文件名（只取文件名，不保留目录结构，附件按文件名匹配）
+    绝对路径、包含 .. 的路径返回 None（路径穿越）
+    """
+    if name.startswith('/') or (len(name) > 1 and name[1] == ':'):
+        return None
+    if '..' in name.split('/'):
+        return None
+    basename = member_basename(name)
+    if not basename or basename in ('.', '..') or '\x00' in basename:
+        return None
+    return basename
+
+
+def _is_symlink(info):
+    return stat.S_ISLNK(info.external_attr >> 16)
+
+
+class ExtractProgress:
+    """解压进度（解压在请求线程中进行，其他请求通过 upload_id 查询）"""
+
+    def __init__(self):
+        self.status = 'extracting'
+        self.total_files = 0
+        self.total_bytes = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.current = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def advance(self, nbytes):
+        with self._lock:
+            self.done_bytes += nbytes
+
+    def file_done(self, name):
+        with self._lock:
+            self.done_files += 1
+            self.current = name
+
+    def finish(self, error=None):
+        self.status = 'failed' if error else 'completed'
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            percent = 100.0 if not self.total_bytes else round(self.done_bytes * 100 / self.total_bytes, 1)
+            return {
+                'status': self.status,
+                'total_files': self.total_files,
+                'done_files': self.done_files,
+                'total_bytes': self.total_bytes,
+                'done_bytes': self.done_bytes,
+                'percent': percent,
+                'current': self.current,
+                'error': self.error
+            }
+
+
+def _unique_name(name, used):
+    """不同目录下的同名文件解压后会互相覆盖，重名时依次改名为 合同 (2).pdf、合同 (3).pdf ..."""
+    if name not in used:
+        return name
+    stem, ext = os.path.splitext(name)
+    index = 2
+    while f'{stem} ({index}){ext}' in used:
+        index += 1
+    return f'{stem} ({index}){ext}'
+
+
+def plan_extraction(zf):
+    """
+    检查压缩包并列出要解压的成员，返回 ([(info, 文件名), ...], [被拒绝的成员名])
+    文件名在返回的列表中唯一（不同目录下的同名文件会改名，见 _unique_name）
+    成员数、解压后总大小或压缩比超出限制时抛出 UnsafeZipError
+    """
+    infos = zf.infolist()
+    if len(infos) > MAX_MEMBERS:
+        raise UnsafeZipError(f'压缩包成员过多（{len(infos)} 个，上限 {MAX_MEMBERS}）')
+
+    members = []
+    rejected = []
+    renamed = []
+    used = set()
+    total = 0
+    for info in infos:
+        name = decode_member_name(info)
+        if info.is_dir() or is_hidden_member(name):
+            continue
+        target = safe_member_name(name)
+        if target is None or _is_symlink(info):
+            rejected.append(name)
+            continue
+        if (info.file_size > RATIO_CHECK_MIN_BYTES
+                and info.file_size > MAX_COMPRESSION_RATIO * max(info.compress_size, 1)):
+            raise UnsafeZipError(f'{name} 压缩比异常（疑似压缩炸弹）')
+        total += info.file_size
+        if total > MAX_TOTAL_BYTES:
+            raise UnsafeZipError(f'解压后总大小超过上限 {MAX_TOTAL_BYTES // (1024 * 1024)}MB')
+        unique = _unique_name(target, used)
+        if unique != target:
+            renamed.append(f'{name} -> {unique}')
+        used.add(unique)
+        members.append((info, unique))
+    if renamed:
+        logger.warning(f"压缩包中有 {len(renamed)} 个重名文件已改名: {renamed[:10]}")
+    return members, rejected
+
+
+def _move_into(target_folder):
+    def save(tmp_path, name, sha256):
+        os.replace(tmp_path, os.path.join(target_folder, name))
+    return save
+
+
+def extract_zip(zf, target_folder, save=None, progress=None, tmp_dir=None):
+    """
+    把压缩包中的文件解压到 target_folder（不保留目录结构）
+    每个成员先写入 tmp_dir 中的临时文件，同时计算SHA256，写完后调用 save(临时文件, 文件名, sha256)
+    保存（例如存入附件存储并更新索引）；未指定 save 时直接原子地移动到目标目录
+    返回 {'files': [...], 'rejected': [...]}
+    """
+    members, rejected = plan_extraction(zf)
+    if rejected:
+        logger.warning(f"压缩包中有 {len(rejected)} 个不安全的成员已跳过: {rejected[:10]}")
+    progress = progress or ExtractProgress()
+    progress.total_files = len(members)
+    progress.total_bytes = sum(info.file_size for info, _ in members)
+
+    save = save or _move_into(target_folder)
+    own_tmp_dir = tmp_dir is None
+    if own_tmp_dir:
+        tmp_dir = os.path.join(target_folder, '.extracting')
+        os.makedirs(tmp_dir, exist_ok=True)
+    save_lock = threading.Lock()
+
+    def extract_one(info, name):
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        try:
+            with zf.open(info) as src, open(tmp_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                    dst.write(chunk)
+                    digest.update(chunk)
+                    progress.advance(len(chunk))
+            with save_lock:
+                save(tmp_path, name, digest.hexdigest())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        progress.file_done(name)
+        return name
+
+    files = []
+    try:
+        with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='unzip') as executor:
+            futures = []
+            for info, name in members:
+                if info.file_size >= PARALLEL_MEMBER_BYTES:
+                    futures.append(executor.submit(extract_one, info, name))
+                else:
+                    files.append(extract_one(info, name))
+            files.extend(future.result() for future in futures)
+    finally:
+        if own_tmp_dir:
+            try:
+                os.rmdir(tmp_dir)
+            except OSError:
+                pass
+    return {'files': files, 'rejected': rejected}
@@ -66,12 +66,31 @@ interface Recipient {
   [key: string]: any
 }
 
+// 邮件模板变量：name / email / department 或Excel中任意列的表头（与后端 mail_template 规则一致）
+const BUILTIN_FIELDS = ['name', 'email', 'department']
+
+const renderTemplate = (template: string, recipient: Recipient) =>
+  template.replace(/\{\{\s*([^{}]+?)\s*\}\}/g, (_, field: string) => {
+    const value = BUILTIN_FIELDS.includes(field) ? recipient[field] : recipient.fields?.[field]
+    return value == null ? '' : String(value)
+  })
+
 interface SendResult {
   recipient: string
   success: boolean
   message: string
 }
 
+interface SendSummary {
+  total: number
+  success: number
+  fail: number
+  skipped: number
+  rate: number
+  eta: number | null
+  status: string
+}
+
 interface EmailTemplate {
   id: string
   name: string
@@ -83,6 +102,11 @@ interface EmailTemplate {
 
 const API_BASE = '/api'
 
+// 超过该大小的附件分块上传（可并行、断点续传）
+const CHUNK_UPLOAD_THRESHOLD = 20 * 1024 * 1024
+const CHUNK_SIZE = 8 * 1024 * 1024
+const PARALLEL_CHUNKS = 3
+
 const App: React.FC = () => {
   const [current, setCurrent] = useState(0)
   const [smtpConfig, setSmtpConfig] = useState<SmtpConfig>({
@@ -96,12 +120,20 @@ const App: React.FC = () => {
     html_mode: false
   })
   const [recipients, setRecipients] = useState<Recipient[]>([])
+  // 服务端保存的收件人列表ID，手动修改收件人后失效（改为直接提交收件人）
+  const [recipientListId, setRecipientListId] = useState<string | null>(null)
+  // 活动ID：同一批收件人再次点击发送（如服务重启后）时沿用，已发送的收件人不会重复发送
+  const [campaignId, setCampaignId] = useState<string | null>(null)
+  // Excel表头，可在邮件模板中作为变量引用
+  const [templateFields, setTemplateFields] = useState<string[]>([])
+  // 同一邮箱出现在多行时合并为一封邮件（附件合并发送）
+  const [mergeRecipients, setMergeRecipients] = useState(false)
   const [subject, setSubject] = useState('')
   const [content, setContent] = useState('')
   const [commonAttachments, setCommonAttachments] = useState<string[]>([])
   const [sending, setSending] = useState(false)
   const [sendResults, setSendResults] = useState<SendResult[]>([])
-  const [sendSummary, setSendSummary] = useState({ total: 0, success: 0, fail: 0 })
+  const [sendSummary, setSendSummary] = useState<SendSummary>({ total: 0, success: 0, fail: 0, skipped: 0, rate: 0, eta: null, status: '' })
   const [testingConnection, setTestingConnection] = useState(false)
   const [diagnosing, setDiagnosing] = useState(false)
   const [diagnosisResult, setDiagnosisResult] = useState<any>(null)
@@ -271,6 +303,9 @@ const App: React.FC = () => {
   const handleExcelUpload = async (file: File) => {
     const formData = new FormData()
     formData.append('file', file)
+    if (mergeRecipients) {
+      formData.append('merge_recipients', '1')
+    }
 
     try {
       const response = await axios.post(`${API_BASE}/parse-excel`, formData, {
@@ -278,7 +313,10 @@ const App: React.FC = () => {
       })
 
       if (response.data.success) {
-        setRecipients(response.data.data.recipients)
+        setRecipients(response.data.recipients)
+        setRecipientListId(response.data.list_id || null)
+        setCampaignId(null)
+        setTemplateFields(response.data.fields || [])
         message.success(response.data.message)
       } else {
         message.error(response.data.message)
@@ -293,17 +331,88 @@ const App: React.FC = () => {
     return false // 阻止默认上传行为
   }
 
-  const handleAttachmentUpload = async (file: File) => {
-    const formData = new FormData()
-    formData.append('file', file)
+  // SHA256（非HTTPS页面中浏览器不提供 crypto.subtle，返回 null）
+  const blobSha256 = async (blob: Blob) => {
+    if (!window.crypto?.subtle) {
+      return null
+    }
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer())
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('')
+  }
 
+  // 分块上传：每块单独校验，并行上传；上传会话ID保存在 localStorage，中断后重新选择同一文件时只上传缺少的块
+  const uploadInChunks = async (file: File) => {
+    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`
+    let status: any = null
+    const savedId = localStorage.getItem(resumeKey)
+    if (savedId) {
+      try {
+        status = (await axios.get(`${API_BASE}/uploads/${savedId}`)).data
+      } catch {
+        localStorage.removeItem(resumeKey)
+      }
+    }
+    if (!status) {
+      status = (await axios.post(`${API_BASE}/uploads`, {
+        filename: file.name,
+        size: file.size,
+        chunk_size: CHUNK_SIZE
+      })).data
+      localStorage.setItem(resumeKey, status.upload_id)
+    }
+
+    const received = new Set<number>(status.received)
+    const pending = Array.from({ length: status.total_chunks }, (_, i) => i).filter(i => !received.has(i))
+    const uploadWorker = async () => {
+      while (pending.length > 0) {
+        const index = pending.shift()!
+        const chunk = file.slice(index * status.chunk_size, (index + 1) * status.chunk_size)
+        const chunkSha256 = await blobSha256(chunk)
+        await axios.put(`${API_BASE}/uploads/${status.upload_id}/chunks/${index}`, chunk, {
+          headers: {
+            'Content-Type': 'application/octet-stream',
+            ...(chunkSha256 ? { 'X-Chunk-Sha256': chunkSha256 } : {})
+          }
+        })
+      }
+    }
+    await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, uploadWorker))
+
+    const response = await axios.post(`${API_BASE}/uploads/${status.upload_id}/complete`)
+    localStorage.removeItem(resumeKey)
+    return response.data
+  }
+
+  const handleAttachmentUpload = async (file: File) => {
     try {
+      if (file.size > CHUNK_UPLOAD_THRESHOLD) {
+        const result = await uploadInChunks(file)
+        setCommonAttachments([...commonAttachments, result.path])
+        message.success('附件上传成功')
+        return false
+      }
+
+      // 先发送SHA256，服务器上已有相同内容时无需重新上传
+      const sha256 = await blobSha256(file)
+      if (sha256) {
+        const linkResponse = await axios.post(`${API_BASE}/attachments/link`, {
+          files: [{ filename: file.name, sha256 }]
+        })
+        if (linkResponse.data.linked?.length) {
+          setCommonAttachments([...commonAttachments, linkResponse.data.linked[0].path])
+          message.success('附件上传成功（服务器已有相同文件）')
+          return false
+        }
+      }
+
+      const formData = new FormData()
+      formData.append('file', file)
       const response = await axios.post(`${API_BASE}/upload-attachment`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
       })
 
       if (response.data.success) {
-        setCommonAttachments([...commonAttachments, response.data.data.filepath])
+        setCommonAttachments([...commonAttachments, response.data.path])
         message.success('附件上传成功')
       } else {
         message.error(response.data.message)
@@ -382,6 +491,92 @@ const App: React.FC = () => {
     }
   }
 
+  // 轮询后台发送任务直到结束
+  const toSendResult = (r: any): SendResult => ({
+    recipient: r.email,
+    success: r.status === 'success',
+    message: r.message
+  })
+
+  const updateSendSummary = (job: any) => {
+    setSendSummary({
+      total: job.total,
+      success: job.sent,
+      fail: job.failed,
+      skipped: job.skipped,
+      rate: job.rate,
+      eta: job.eta,
+      status: job.status
+    })
+  }
+
+  // 轮询任务进度（浏览器不支持事件流时使用）
+  const waitForSendJob = async (jobId: string) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 2000))
+      const response = await axios.get(`${API_BASE}/send-jobs/${jobId}`, {
+        params: { include_results: 1 }
+      })
+      const job = response.data.job
+      updateSendSummary(job)
+      if (['completed', 'cancelled', 'failed'].includes(job.status)) {
+        setSendResults(job.results.map(toSendResult))
+        if (job.error) {
+          message.error('发送任务失败: ' + job.error)
+        }
+        return
+      }
+    }
+  }
+
+  // 通过事件流实时接收每个收件人的结果和汇总进度，直到任务结束
+  const watchSendJob = (jobId: string) => new Promise<void>((resolve, reject) => {
+    if (typeof EventSource === 'undefined') {
+      waitForSendJob(jobId).then(resolve, reject)
+      return
+    }
+
+    // 结果先缓存，每半秒批量更新一次界面
+    let pending: SendResult[] = []
+    const flush = () => {
+      if (pending.length > 0) {
+        const batch = pending
+        pending = []
+        setSendResults(prev => prev.concat(batch))
+      }
+    }
+    const timer = window.setInterval(flush, 500)
+    const source = new EventSource(`${API_BASE}/send-jobs/${jobId}/events`)
+    const close = () => {
+      source.close()
+      window.clearInterval(timer)
+      flush()
+    }
+
+    source.addEventListener('result', (e: MessageEvent) => {
+      pending.push(toSendResult(JSON.parse(e.data)))
+    })
+    source.addEventListener('progress', (e: MessageEvent) => {
+      updateSendSummary(JSON.parse(e.data))
+    })
+    source.addEventListener('done', (e: MessageEvent) => {
+      const job = JSON.parse(e.data)
+      close()
+      updateSendSummary(job)
+      if (job.error) {
+        message.error('发送任务失败: ' + job.error)
+      }
+      resolve()
+    })
+    source.onerror = () => {
+      // 网络中断时浏览器会自动重连并从 Last-Event-ID 继续；连接被拒绝时改为轮询
+      if (source.readyState === EventSource.CLOSED) {
+        close()
+        waitForSendJob(jobId).then(resolve, reject)
+      }
+    }
+  })
+
   const handleSendEmails = async () => {
     if (!subject || !content) {
       message.warning('请填写邮件主题和内容')
@@ -395,21 +590,23 @@ const App: React.FC = () => {
 
     setSending(true)
     setSendResults([])
+    setSendSummary({ total: 0, success: 0, fail: 0, skipped: 0, rate: 0, eta: null, status: 'queued' })
 
     try {
       const response = await axios.post(`${API_BASE}/send-emails`, {
         smtp_config: smtpConfig,
-        recipients: recipients,
+        ...(recipientListId ? { list_id: recipientListId } : { recipients: recipients }),
+        ...(campaignId ? { campaign_id: campaignId } : {}),
         subject: subject,
         content: content,
         common_attachments: commonAttachments
       })
 
       if (response.data.success) {
-        setSendResults(response.data.data.results)
-        setSendSummary(response.data.data.summary)
         message.success(response.data.message)
+        setCampaignId(response.data.campaign_id)
         setCurrent(3)
+        await watchSendJob(response.data.job_id)
       } else {
         message.error(response.data.message)
       }
@@ -454,6 +651,7 @@ const App: React.FC = () => {
 
   const handleDeleteRecipient = (email: string) => {
     setRecipients(recipients.filter(r => r.email !== email))
+    setRecipientListId(null)
     message.success('已删除收件人')
   }
 
@@ -464,6 +662,7 @@ const App: React.FC = () => {
         setRecipients(recipients.map(r => 
           r.email === editingRecipient.email ? { ...values } : r
         ))
+        setRecipientListId(null)
         message.success('收件人信息已更新')
       } else {
         // 新增模式
@@ -472,6 +671,7 @@ const App: React.FC = () => {
           return
         }
         setRecipients([...recipients, values])
+        setRecipientListId(null)
         message.success('已添加收件人')
       }
       setIsAddModalVisible(false)
@@ -940,16 +1140,20 @@ const App: React.FC = () => {
                         style={{ marginBottom: 16 }}
                       />
 
-                      <Upload
-                        accept=".xlsx,.xls,.csv"
-                        beforeUpload={handleExcelUpload}
-                        showUploadList={false}
-                        maxCount={1}
-                      >
-                        <Button icon={<UploadOutlined />} type="primary" size="large">
-                          上传Excel文件
-                        </Button>
-                      </Upload>
+                      <Space>
+                        <Upload
+                          accept=".xlsx,.xls,.csv"
+                          beforeUpload={handleExcelUpload}
+                          showUploadList={false}
+                          maxCount={1}
+                        >
+                          <Button icon={<UploadOutlined />} type="primary" size="large">
+                            上传Excel文件
+                          </Button>
+                        </Upload>
+                        <Switch checked={mergeRecipients} onChange={setMergeRecipients} />
+                        <Text type="secondary">同一邮箱的多行合并为一封邮件</Text>
+                      </Space>
                     </div>
                   )
                 },
@@ -1078,7 +1282,7 @@ const App: React.FC = () => {
                 <Form.Item 
                   label="邮件内容" 
                   required
-                  extra={`支持个性化变量: {{name}} {{email}}${smtpConfig.html_mode ? ' | HTML模式已开启' : ''}`}
+                  extra={`支持个性化变量（主题和内容均可使用）: ${[...BUILTIN_FIELDS, ...templateFields].map(f => `{{${f}}}`).join(' ')}${smtpConfig.html_mode ? ' | HTML模式已开启' : ''}`}
                 >
                   <TextArea 
                     placeholder="请输入邮件内容..."
@@ -1119,11 +1323,9 @@ const App: React.FC = () => {
                     <div>
                       <Text strong>发送给: {recipients[0].name} ({recipients[0].email})</Text>
                       <div className="preview-section">
-                        <div className="preview-title">主题: {subject || '(未填写)'}</div>
+                        <div className="preview-title">主题: {renderTemplate(subject, recipients[0]) || '(未填写)'}</div>
                         <div className="preview-content">
-                          {content
-                            .replace(/\{\{name\}\}/g, recipients[0].name)
-                            .replace(/\{\{email\}\}/g, recipients[0].email) || '(未填写)'}
+                          {renderTemplate(content, recipients[0]) || '(未填写)'}
                         </div>
                       </div>
                     </div>
@@ -1160,17 +1362,22 @@ const App: React.FC = () => {
           {current === 3 && (
             <div>
               <Alert
-                message="发送完成"
+                message={sending ? '正在发送' : '发送完成'}
                 description={
                   <div>
-                    <p>总计: {sendSummary.total} | 成功: {sendSummary.success} | 失败: {sendSummary.fail}</p>
+                    <p>
+                      总计: {sendSummary.total} | 成功: {sendSummary.success} | 失败: {sendSummary.fail}
+                      {sendSummary.skipped > 0 && ` | 跳过: ${sendSummary.skipped}`}
+                      {sending && ` | 速率: ${sendSummary.rate} 封/秒`}
+                      {sending && sendSummary.eta !== null && ` | 预计剩余: ${Math.ceil(sendSummary.eta / 60)} 分钟`}
+                    </p>
                     <Progress 
-                      percent={Math.round((sendSummary.success / sendSummary.total) * 100)}
-                      status={sendSummary.fail > 0 ? 'exception' : 'success'}
+                      percent={sendSummary.total ? Math.round(((sendSummary.success + sendSummary.fail + sendSummary.skipped) / sendSummary.total) * 100) : 0}
+                      status={sending ? 'active' : (sendSummary.fail > 0 ? 'exception' : 'success')}
                     />
                   </div>
                 }
-                type={sendSummary.fail > 0 ? 'warning' : 'success'}
+                type={sending ? 'info' : (sendSummary.fail > 0 ? 'warning' : 'success')}
                 showIcon
                 style={{ marginBottom: 24 }}
               />
@@ -1200,6 +1407,9 @@ const App: React.FC = () => {
                 <Button type="primary" onClick={() => {
                   setCurrent(0)
                   setRecipients([])
+                  setRecipientListId(null)
+                  setCampaignId(null)
+                  setTemplateFields([])
                   setSubject('')
                   setContent('')
                   setCommonAttachments([])